@@ -5,8 +5,8 @@ import os
 import jinja2
 
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
-VERSIONS = [(1, 0), (1, 1), None]
-LATEST_VERSION = (1, 1)
+VERSIONS = [(1, 0), (1, 1), (1, 2), None]
+LATEST_VERSION = (1, 2)
 
 
 def generate_schema():
@@ -30,7 +30,7 @@ def generate_schema():
         with open(os.path.join(version_dir, 'patchwork.yaml'), 'wb') as fh:
             template.stream(version=version, version_str=version_str,
                             version_url=version_url).dump(fh, encoding='utf-8')
-            fh.write('\n')
+            fh.write(b'\n')
 
 
 if __name__ == '__main__':
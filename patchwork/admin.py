@@ -6,6 +6,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.db import models
 from django.db.models import Prefetch
 
 from patchwork.models import Bundle
@@ -20,6 +21,7 @@ from patchwork.models import Series
 from patchwork.models import SeriesReference
 from patchwork.models import State
 from patchwork.models import Submission
+from patchwork.models import SubmissionBody
 from patchwork.models import Tag
 from patchwork.models import UserProfile
 
@@ -75,24 +77,73 @@ class StateAdmin(admin.ModelAdmin):
 admin.site.register(State, StateAdmin)
 
 
-class SubmissionAdmin(admin.ModelAdmin):
+class SubmissionBodyInline(admin.StackedInline):
+    model = SubmissionBody
+    can_delete = False
+    verbose_name_plural = 'body'
+    exclude = ('diff', )
+    # whitespace is significant in mails and diffs
+    formfield_overrides = {
+        models.TextField: {'strip': False},
+    }
+
+
+class PatchBodyInline(SubmissionBodyInline):
+    exclude = ()
+
+
+class SubmissionBodyAdminMixin(object):
+    """Save changes to the body through the submission.
+
+    This ensures the content is normalised, the tag counts refreshed and
+    the hash of a patch recalculated, as they are for any other change.
+    """
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not SubmissionBody:
+            return super(SubmissionBodyAdminMixin, self).save_formset(
+                request, form, formset, change)
+
+        formset.save(commit=False)
+
+        # the forms have already updated the submission's body, so mark
+        # it as changed through the submission
+        submission = form.instance
+        for body_form in formset.forms:
+            if not body_form.has_changed():
+                continue
+
+            body = body_form.instance
+            submission.headers = body.headers
+            submission.content = body.content
+            if isinstance(submission, Patch):
+                # pull requests have no diff, rather than an empty one
+                submission.diff = body.diff or None
+                if 'diff' in body_form.changed_data:
+                    submission.hash = None
+            submission.save()
+
+
+class SubmissionAdmin(SubmissionBodyAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'submitter', 'project', 'date')
     list_filter = ('project', )
     search_fields = ('name', 'submitter__name', 'submitter__email')
     date_hierarchy = 'date'
+    inlines = (SubmissionBodyInline, )
 
 
 admin.site.register(Submission, SubmissionAdmin)
 admin.site.register(CoverLetter, SubmissionAdmin)
 
 
-class PatchAdmin(admin.ModelAdmin):
+class PatchAdmin(SubmissionBodyAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'submitter', 'project', 'state', 'date',
                     'archived', 'is_pull_request')
     list_filter = ('project', 'submitter', 'state', 'archived')
     list_select_related = ('submitter', 'project', 'state')
     search_fields = ('name', 'submitter__name', 'submitter__email')
     date_hierarchy = 'date'
+    inlines = (PatchBodyInline, )
 
     def is_pull_request(self, patch):
         return bool(patch.pull_url)
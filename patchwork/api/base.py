@@ -8,23 +8,21 @@ from distutils.version import StrictVersion
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 from rest_framework import permissions
+from rest_framework.pagination import CursorPagination
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.serializers import HyperlinkedIdentityField
 from rest_framework.serializers import HyperlinkedModelSerializer
 
 
-class LinkHeaderPagination(PageNumberPagination):
-    """Provide pagination based on rfc5988.
+class LinkHeaderMixin(object):
+    """Provide links to other pages in the Link header, as per rfc5988.
 
-    This is the Link header, similar to how GitHub does it. See:
+    This is similar to how GitHub does it. See:
 
        https://tools.ietf.org/html/rfc5988#section-5
        https://developer.github.com/guides/traversing-with-pagination
     """
-    page_size = settings.REST_RESULTS_PER_PAGE
-    max_page_size = settings.MAX_REST_RESULTS_PER_PAGE
-    page_size_query_param = 'per_page'
 
     def get_paginated_response(self, data):
         next_url = self.get_next_link()
@@ -42,6 +40,62 @@ class LinkHeaderPagination(PageNumberPagination):
         return Response(data, headers=headers)
 
 
+class LinkHeaderCursorPagination(LinkHeaderMixin, CursorPagination):
+    """Provide cursor-based pagination, with links in the Link header.
+
+    Each page is found by filtering on the position of the last item of the
+    previous page, rather than using an offset, and the total number of
+    items isn't counted. This keeps requests for later pages as cheap as
+    those for the first.
+
+    Items are always ordered by the view's ``cursor_ordering``, as the
+    ordering must be fixed for a cursor to remain valid.
+    """
+    page_size = settings.REST_RESULTS_PER_PAGE
+    max_page_size = settings.MAX_REST_RESULTS_PER_PAGE
+    page_size_query_param = 'per_page'
+
+    def get_ordering(self, request, queryset, view):
+        return view.cursor_ordering
+
+
+class LinkHeaderPagination(LinkHeaderMixin, PageNumberPagination):
+    """Provide pagination based on rfc5988.
+
+    Views that set ``cursor_ordering`` also support cursor-based pagination,
+    using ``LinkHeaderCursorPagination``. Clients opt in to this by passing
+    the ``cursor`` parameter, which is empty for the first page.
+    """
+    page_size = settings.REST_RESULTS_PER_PAGE
+    max_page_size = settings.MAX_REST_RESULTS_PER_PAGE
+    page_size_query_param = 'per_page'
+    cursor_query_param = LinkHeaderCursorPagination.cursor_query_param
+
+    cursor_pagination = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (getattr(view, 'cursor_ordering', None) and
+                self.cursor_query_param in request.query_params):
+            self.cursor_pagination = LinkHeaderCursorPagination()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view)
+
+        return super(LinkHeaderPagination, self).paginate_queryset(
+            queryset, request, view)
+
+    def get_next_link(self):
+        if self.cursor_pagination:
+            return self.cursor_pagination.get_next_link()
+
+        return super(LinkHeaderPagination, self).get_next_link()
+
+    def get_previous_link(self):
+        if self.cursor_pagination:
+            return self.cursor_pagination.get_previous_link()
+
+        return super(LinkHeaderPagination, self).get_previous_link()
+
+
 class PatchworkPermission(permissions.BasePermission):
     """This permission works for Project and Patch model objects"""
     def has_object_permission(self, request, view, obj):
@@ -75,7 +129,7 @@ class CheckHyperlinkedIdentityField(HyperlinkedIdentityField):
         return self.reverse(
             view_name,
             kwargs={
-                'patch_id': obj.patch.id,
+                'patch_id': obj.patch_id,
                 'check_id': obj.id,
             },
             request=request,
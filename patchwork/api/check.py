@@ -96,6 +96,7 @@ class CheckListCreate(CheckMixin, ListCreateAPIView):
 
     lookup_url_kwarg = 'patch_id'
     ordering = 'id'
+    cursor_ordering = ('id',)
 
     def create(self, request, patch_id, *args, **kwargs):
         p = get_object_or_404(Patch, id=patch_id)
@@ -63,6 +63,7 @@ class CommentList(ListAPIView):
     search_fields = ('subject',)
     ordering_fields = ('id', 'subject', 'date', 'submitter')
     ordering = 'id'
+    cursor_ordering = ('id',)
     lookup_url_kwarg = 'pk'
 
     def get_queryset(self):
@@ -96,11 +96,11 @@ class CoverLetterList(ListAPIView):
     search_fields = ('name',)
     ordering_fields = ('id', 'name', 'date', 'submitter')
     ordering = 'id'
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
         return CoverLetter.objects.all()\
-            .select_related('project', 'submitter', 'series')\
-            .defer('content', 'headers')
+            .select_related('project', 'submitter', 'series')
 
 
 class CoverLetterDetail(RetrieveAPIView):
@@ -110,4 +110,4 @@ class CoverLetterDetail(RetrieveAPIView):
 
     def get_queryset(self):
         return CoverLetter.objects.all()\
-            .select_related('project', 'submitter', 'series')
+            .select_related('project', 'submitter', 'series', 'body')
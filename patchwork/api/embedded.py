@@ -11,6 +11,7 @@ nested fields.
 
 from collections import OrderedDict
 
+from django.utils.functional import cached_property
 from rest_framework.serializers import CharField
 from rest_framework.serializers import SerializerMethodField
 from rest_framework.serializers import PrimaryKeyRelatedField
@@ -53,8 +54,14 @@ class SerializedRelatedField(PrimaryKeyRelatedField):
             for item in queryset
         ])
 
+    @cached_property
+    def _serializer(self):
+        # building a serializer's fields is expensive, so reuse one for every
+        # object rather than creating one each time
+        return self._Serializer(context=self.context)
+
     def to_representation(self, data):
-        return self._Serializer(context=self.context).to_representation(data)
+        return self._serializer.to_representation(data)
 
 
 class MboxMixin(BaseHyperlinkedModelSerializer):
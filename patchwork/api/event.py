@@ -4,10 +4,18 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 from collections import OrderedDict
+import contextlib
+from distutils.version import StrictVersion
+import threading
+import timeit
 
+from django.conf import settings
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
+from rest_framework.response import Response
 from rest_framework.serializers import ModelSerializer
-from rest_framework.serializers import SerializerMethodField
 
 from patchwork.api.embedded import CheckSerializer
 from patchwork.api.embedded import CoverLetterSerializer
@@ -18,6 +26,7 @@ from patchwork.api.embedded import UserSerializer
 from patchwork.api.filters import EventFilterSet
 from patchwork.api.patch import StateField
 from patchwork.models import Event
+from patchwork import pubsub
 
 
 class EventSerializer(ModelSerializer):
@@ -30,7 +39,6 @@ class EventSerializer(ModelSerializer):
     current_state = StateField()
     previous_delegate = UserSerializer()
     current_delegate = UserSerializer()
-    created_check = SerializerMethodField()
     created_check = CheckSerializer()
 
     _category_map = {
@@ -46,21 +54,87 @@ class EventSerializer(ModelSerializer):
         Event.CATEGORY_SERIES_COMPLETED: ['series'],
     }
 
+    # related objects which can be reduced to their IDs, keyed by the name
+    # used in requests and responses
+    _expandable_fields = OrderedDict([
+        ('project', 'project'),
+        ('patch', 'patch'),
+        ('series', 'series'),
+        ('cover', 'cover'),
+        ('previous_delegate', 'previous_delegate'),
+        ('current_delegate', 'current_delegate'),
+        ('check', 'created_check'),
+    ])
+
+    @classmethod
+    def get_sparse_fields(cls, request):
+        """Return the fields and related objects requested by the client.
+
+        The ``fields`` parameter lists the top-level fields to include,
+        while the ``expand`` parameter lists the related objects to embed
+        in full. Related objects which aren't expanded are represented by
+        their IDs. Unknown names are ignored. These parameters were added
+        in API version 1.2.
+
+        Returns:
+            A tuple of the names of the fields to include and the names of
+            the model fields to expand, either of which is None if all are
+            wanted.
+        """
+        if not request or (request.version and StrictVersion(
+                request.version) < StrictVersion('1.2')):
+            return None, None
+
+        def parse(param):
+            if param not in request.query_params:
+                return None
+            return {x.strip() for x in request.query_params[param].split(',')}
+
+        fields = parse('fields')
+        expand = parse('expand')
+        if expand is not None:
+            expand = {cls._expandable_fields[x] for x in expand
+                      if x in cls._expandable_fields}
+
+        return fields, expand
+
+    @cached_property
+    def _sparse_fields(self):
+        return self.get_sparse_fields(self.context.get('request'))
+
     def to_representation(self, instance):
-        data = super(EventSerializer, self).to_representation(instance)
+        fields, expand = self._sparse_fields
+        category_fields = self._category_map[instance.category]
+
+        data = OrderedDict()
         payload = OrderedDict()
-        kept_fields = self._category_map[instance.category] + [
-            'id', 'category', 'project', 'date']
 
-        for field in [x for x in data]:
-            if field not in kept_fields:
-                del data[field]
-            elif field in self._category_map[instance.category]:
-                field_name = 'check' if field == 'created_check' else field
-                payload[field_name] = data.pop(field)
+        # only serialize the fields used by this category of event, as the
+        # embedded objects are expensive to build
+        for field_name in ['id', 'category', 'project', 'date'] + \
+                category_fields:
+            field = self.fields[field_name]
+
+            if expand is not None and field_name not in expand and \
+                    field_name in self._expandable_fields.values():
+                # avoid loading the related object at all
+                value = getattr(instance, field_name + '_id')
+            else:
+                attribute = field.get_attribute(instance)
+                value = None if attribute is None else \
+                    field.to_representation(attribute)
+
+            if field_name in category_fields:
+                payload['check' if field_name == 'created_check' else
+                        field_name] = value
+            else:
+                data[field_name] = value
 
         data['payload'] = payload
 
+        if fields is not None:
+            data = OrderedDict((k, v) for k, v in data.items() if k in fields)
+
         return data
 
     class Meta:
@@ -78,11 +152,112 @@ class EventList(ListAPIView):
     filter_class = filterset_class = EventFilterSet
     page_size_query_param = None  # fixed page size
     ordering_fields = ()
-    ordering = '-date'
+    ordering = ('-date', '-id')
+    cursor_ordering = ('-date', '-id')
 
     def get_queryset(self):
-        return Event.objects.all()\
-            .prefetch_related('project', 'patch', 'series', 'cover',
-                              'previous_state', 'current_state',
-                              'previous_delegate', 'current_delegate',
-                              'created_check')
+        _, expand = EventSerializer.get_sparse_fields(self.request)
+
+        related = ['previous_state', 'current_state']
+        for field in EventSerializer._expandable_fields.values():
+            if expand is None or field in expand:
+                related.append(field)
+        if 'series' in related:
+            # needed for the series' web URL
+            related.append('series__project')
+
+        # none of these are embedded, and they can be large
+        deferred = []
+        if 'patch' in related:
+            deferred.extend(['patch__tag_counts', 'patch__check_summary'])
+
+        # most of these are null for any given event, so join them rather
+        # than making a query for each
+        return Event.objects.all().select_related(*related).defer(*deferred)
+
+
+_waiting_lock = threading.Lock()
+_waiting = 0
+
+
+@contextlib.contextmanager
+def _waiting_slot():
+    """Reserve a slot for a request waiting for events.
+
+    Yields whether a slot was free, as limited by the
+    ``REST_EVENT_STREAM_MAX_WAITING`` setting.
+    """
+    global _waiting
+
+    limit = settings.REST_EVENT_STREAM_MAX_WAITING
+    with _waiting_lock:
+        reserved = limit is None or _waiting < limit
+        if reserved:
+            _waiting += 1
+
+    try:
+        yield reserved
+    finally:
+        if reserved:
+            with _waiting_lock:
+                _waiting -= 1
+
+
+class EventStream(EventList):
+    """Wait for new events.
+
+    Returns the events committed after the one identified by ``since_id``,
+    oldest first. If there are none, waits for one to be committed.
+
+    Event IDs are allocated before the transaction creating the event
+    commits, so an event can become visible after one with a later ID.
+    Events are instead ordered by the sequence number they're given once
+    committed, so clients following the stream don't skip over them.
+    """
+
+    pagination_class = None
+    ordering = ('sequence', 'id')
+
+    def _get_events(self, since_id):
+        events = self.filter_queryset(self.get_queryset()).filter(
+            sequence__isnull=False).order_by(*self.ordering)
+
+        since = Event.objects.filter(id=since_id).values_list(
+            'sequence', flat=True).first()
+        if since is None:
+            # the event has been removed, or isn't numbered yet
+            return events.filter(id__gt=since_id)
+
+        return events.filter(Q(sequence__gt=since) |
+                             Q(sequence=since, id__gt=since_id))
+
+    def list(self, request, *args, **kwargs):
+        try:
+            since_id = int(request.query_params['since_id'])
+        except (KeyError, ValueError):
+            raise ValidationError({'since_id': 'An event ID is required.'})
+
+        events = self._get_events(since_id)
+
+        with _waiting_slot() as reserved:
+            timeout = settings.REST_EVENT_STREAM_TIMEOUT if reserved else 0
+            deadline = timeit.default_timer() + timeout
+            while True:
+                # read this first, so events created while we're looking
+                # for them aren't missed
+                generation = pubsub.events.generation
+                if events.exists():
+                    break
+
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0:
+                    break
+
+                # we'll be woken early if this process creates an event, but
+                # other processes can only be caught by checking again
+                pubsub.events.wait(generation, min(
+                    remaining, settings.REST_EVENT_STREAM_POLL_INTERVAL))
+
+        serializer = self.get_serializer(
+            events[:settings.REST_RESULTS_PER_PAGE], many=True)
+        return Response(serializer.data)
@@ -11,6 +11,7 @@ from django_filters import IsoDateTimeFilter
 from django_filters import ModelMultipleChoiceFilter
 from django.forms import ModelMultipleChoiceField as BaseMultipleChoiceField
 from django.forms.widgets import MultipleHiddenInput
+from rest_framework import filters
 
 from patchwork.compat import NAME_FIELD
 from patchwork.models import Bundle
@@ -79,6 +80,28 @@ class ModelMultipleChoiceField(BaseMultipleChoiceField):
         return qs
 
 
+class OrderingFilter(filters.OrderingFilter):
+    """Ordering filter supporting fields that are stored under another name.
+
+    Views can set ``ordering_field_map`` to a mapping of the field names
+    accepted in requests to the model fields used to order by them.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super(OrderingFilter, self).get_ordering(
+            request, queryset, view)
+        field_map = getattr(view, 'ordering_field_map', {})
+        if not ordering or not field_map:
+            return ordering
+
+        result = []
+        for term in ordering:
+            prefix = '-' if term.startswith('-') else ''
+            field = term.lstrip('-')
+            result.append(prefix + field_map.get(field, field))
+        return result
+
+
 class BaseField(ModelMultipleChoiceField):
 
     alternate_lookup = None
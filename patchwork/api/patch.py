@@ -177,14 +177,14 @@ class PatchList(ListAPIView):
     search_fields = ('name',)
     ordering_fields = ('id', 'name', 'project', 'date', 'state', 'archived',
                        'submitter', 'check')
+    ordering_field_map = {'check': 'check_state'}
     ordering = 'id'
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
         return Patch.objects.all()\
-            .prefetch_related('check_set')\
             .select_related('project', 'state', 'submitter', 'delegate',
-                            'series')\
-            .defer('content', 'diff', 'headers')
+                            'series')
 
 
 class PatchDetail(RetrieveUpdateAPIView):
@@ -203,6 +203,5 @@ class PatchDetail(RetrieveUpdateAPIView):
 
     def get_queryset(self):
         return Patch.objects.all()\
-            .prefetch_related('check_set')\
             .select_related('project', 'state', 'submitter', 'delegate',
-                            'series')
+                            'series', 'body')
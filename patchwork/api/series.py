@@ -66,6 +66,7 @@ class SeriesList(SeriesMixin, ListAPIView):
     search_fields = ('name',)
     ordering_fields = ('id', 'name', 'date', 'submitter', 'received_all')
     ordering = 'id'
+    cursor_ordering = ('id',)
 
 
 class SeriesDetail(SeriesMixin, RetrieveAPIView):
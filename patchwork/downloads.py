@@ -0,0 +1,180 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Caching of the mbox files and diffs that patches are downloaded as.
+
+Each rendered file is cached under a key containing a version token for
+the submission it was rendered from. Whenever something included in the
+file changes, such as the submission's comments or delegate, the token is
+removed. A new token is created the next time one is needed, so files
+cached under the old token are never used again and simply expire.
+
+Tokens are also used to derive the ``ETag`` and ``Last-Modified`` headers
+of downloads, allowing clients to make conditional requests.
+
+Tokens are only removed from the cache by the process making the change, so
+caching is disabled unless ``DOWNLOAD_CACHE`` names a cache shared by every
+process.
+"""
+
+import hashlib
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import quote_etag
+
+
+def is_enabled():
+    """Check whether downloads are cached."""
+    return settings.DOWNLOAD_CACHE is not None
+
+
+def _get_cache():
+    return caches[settings.DOWNLOAD_CACHE]
+
+
+def _version_key(submission_id):
+    return 'patchwork:download-version:%d' % submission_id
+
+
+def _file_key(kind, submission_id, version):
+    return 'patchwork:download:%s:%d:%s' % (kind, submission_id, version)
+
+
+def _new_version():
+    # the time is used as the modification time of the files, while the
+    # random part ensures tokens created at the same time are distinct
+    return '%d.%08x' % (time.time() * 1000000, random.getrandbits(32))
+
+
+def get_versions(submission_ids):
+    """Get the version tokens of the given submissions.
+
+    Tokens are created for any submissions that don't have one.
+
+    Arguments:
+        submission_ids: The IDs of the submissions.
+
+    Returns:
+        A dict mapping each submission ID to its token, which is empty if
+        caching is disabled.
+    """
+    if not is_enabled():
+        return {}
+
+    cache = _get_cache()
+
+    keys = {_version_key(x): x for x in submission_ids}
+    versions = {keys[key]: version for key, version in
+                cache.get_many(list(keys)).items()}
+
+    created = {}
+    for key, submission_id in keys.items():
+        if submission_id not in versions:
+            created[key] = versions[submission_id] = _new_version()
+
+    if created:
+        cache.set_many(created, settings.DOWNLOAD_CACHE_TIMEOUT)
+
+    return versions
+
+
+def invalidate(submission_ids):
+    """Stop using the cached files of the given submissions.
+
+    This should be called whenever something included in the files
+    changes. The tokens are removed immediately, and again once the current
+    transaction is committed, since files rendered from the database before
+    then don't include the changes.
+
+    Arguments:
+        submission_ids: The IDs of the submissions.
+    """
+    if not is_enabled():
+        return
+
+    keys = [_version_key(x) for x in submission_ids]
+    if not keys:
+        return
+
+    cache = _get_cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_files(kind, versions):
+    """Get cached files.
+
+    Arguments:
+        kind: The kind of file, such as 'mbox' or 'diff'.
+        versions: A dict mapping the ID of each submission to get the file
+            for to its version token.
+
+    Returns:
+        A dict mapping the ID of each submission with a cached file to the
+        file's content.
+    """
+    keys = {_file_key(kind, submission_id, version): submission_id
+            for submission_id, version in versions.items()}
+    return {keys[key]: content for key, content in
+            _get_cache().get_many(list(keys)).items()}
+
+
+def set_files(kind, versions, files):
+    """Cache rendered files.
+
+    Arguments:
+        kind: The kind of file, such as 'mbox' or 'diff'.
+        versions: A dict mapping the ID of each submission to the version
+            token read before its file was rendered.
+        files: A dict mapping the ID of each submission to its file.
+    """
+    _get_cache().set_many({
+        _file_key(kind, submission_id, versions[submission_id]): content
+        for submission_id, content in files.items()
+    }, settings.DOWNLOAD_CACHE_TIMEOUT)
+
+
+def get_etag(kind, submission_ids, versions):
+    """Get the entity tag of a download.
+
+    Arguments:
+        kind: The kind of file, such as 'mbox' or 'diff'.
+        submission_ids: The IDs of the submissions in the download, in
+            order.
+        versions: A dict mapping each submission ID to its version token.
+
+    Returns:
+        A quoted entity tag, which changes whenever any of the files do, or
+        None if caching is disabled.
+    """
+    if not is_enabled():
+        return None
+
+    digest = hashlib.sha1(kind.encode('ascii'))
+    for submission_id in submission_ids:
+        digest.update(('\n%d:%s' % (
+            submission_id, versions[submission_id])).encode('ascii'))
+    return quote_etag(digest.hexdigest())
+
+
+def get_last_modified(versions):
+    """Get the modification time of a download.
+
+    Arguments:
+        versions: A dict mapping the ID of each submission in the download
+            to its version token.
+
+    Returns:
+        The time, in seconds since the epoch, at which the newest of the
+        tokens was created, or None if there are none.
+    """
+    if not versions:
+        return None
+
+    return max(int(version.split('.')[0])
+               for version in versions.values()) // 1000000
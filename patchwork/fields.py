@@ -4,8 +4,12 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import base64
 import hashlib
+import json
+import zlib
 
+from django.conf import settings
 from django.db import models
 from django.utils import six
 
@@ -28,3 +32,100 @@ class HashField(models.CharField):
 
     def db_type(self, connection=None):
         return 'char(%d)' % self.n_bytes
+
+
+class JSONField(models.TextField):
+    """A JSON-serializable value, stored as text.
+
+    This works with every database, but unlike the native JSON types
+    provided by some, the value can't be used in lookups.
+    """
+
+    def from_db_value(self, value, *args, **kwargs):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if not isinstance(value, six.string_types):
+            return value
+
+        if not value:
+            return self.get_default()
+
+        return json.loads(value)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+
+        return json.dumps(value, sort_keys=True)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self.value_from_object(obj))
+
+
+class TagCountsField(JSONField):
+    """A mapping of tag IDs to counts, stored as JSON.
+
+    This allows the tag counts of a patch to be loaded along with the patch
+    itself, rather than looking up each count in a separate table.
+    """
+
+    def to_python(self, value):
+        value = super(TagCountsField, self).to_python(value)
+        if not value:
+            return {}
+
+        return {int(tag_id): count for tag_id, count in value.items()}
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+
+        return super(TagCountsField, self).get_prep_value(
+            {six.text_type(tag_id): count for tag_id, count in value.items()})
+
+
+class CompressedTextField(models.TextField):
+    """Text which may be stored compressed.
+
+    If the ``COMPRESS_CONTENT`` setting is enabled, values are compressed
+    using zlib and stored base64-encoded, after a prefix which marks them as
+    compressed. Values are read correctly however they were stored, so the
+    setting can be changed at any time, and existing values converted using
+    the ``recompress`` management command. Compressed values can only be
+    used in exact and ``isnull`` lookups.
+    """
+
+    prefix = '\x01zlib:'
+
+    # shorter values compress poorly, if at all
+    min_length = 256
+
+    def _compress(self, value):
+        return self.prefix + base64.b64encode(
+            zlib.compress(value.encode('utf-8'))).decode('ascii')
+
+    def from_db_value(self, value, *args, **kwargs):
+        if value is None or not value.startswith(self.prefix):
+            return value
+
+        return zlib.decompress(
+            base64.b64decode(value[len(self.prefix):])).decode('utf-8')
+
+    def get_prep_value(self, value):
+        value = super(CompressedTextField, self).get_prep_value(value)
+        if value is None:
+            return None
+
+        if value.startswith(self.prefix):
+            # plain text must never be mistaken for compressed text
+            return self._compress(value)
+
+        if not settings.COMPRESS_CONTENT or len(value) < self.min_length:
+            return value
+
+        compressed = self._compress(value)
+        if len(compressed) >= len(value):
+            return value
+
+        return compressed
@@ -15,24 +15,83 @@ HUNK_RE = re.compile(r'^\@\@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? \@\@')
 FILENAME_RE = re.compile(r'^(---|\+\+\+) (\S+)')
 
 
-def hash_diff(diff):
-    """Generate a hash from a diff."""
+class DiffScanner(object):
+    """Scan a diff, generating its hash and finding the files it changes.
+
+    The diff can be provided in chunks via ``update``, allowing it to be
+    scanned while it's being extracted from a mail. Once all of the diff
+    has been provided, ``finish`` must be called before any of the
+    results are used. The results are identical to those generated by
+    scanning the entire diff at once.
+    """
 
-    # normalise spaces
-    diff = diff.replace('\r', '')
-    diff = diff.strip() + '\n'
+    def __init__(self):
+        self._hash = hashlib.sha1()
+        self._filenames = set()
+        self._partial = ''
+        # the last line seen with any non-whitespace characters, along with
+        # any whitespace-only lines seen since, which are only hashed if
+        # they aren't found at the end of the diff
+        self._held = None
+        self._blank = []
+        self._finished = False
+
+        self.insertions = 0
+        self.deletions = 0
+
+    def update(self, diff):
+        """Add a chunk of the diff."""
+        lines = (self._partial + diff.replace('\r', '')).split('\n')
+        self._partial = lines.pop()
+
+        for line in lines:
+            self._add_line(line)
+
+    def finish(self):
+        """Mark the end of the diff."""
+        if self._finished:
+            return
+
+        self._add_line(self._partial)
+        self._partial = ''
+
+        # normalise spaces
+        if self._held is not None:
+            self._scan_line(self._held.rstrip())
+        self._held = None
+        self._blank = []
+
+        self._finished = True
+
+    def _add_line(self, line):
+        if not line.strip():
+            if self._held is not None:
+                self._blank.append(line)
+            return
+
+        if self._held is None:
+            # normalise spaces
+            line = line.lstrip()
+        else:
+            self._scan_line(self._held)
+            for blank in self._blank:
+                self._scan_line(blank)
 
-    prefixes = ['-', '+', ' ']
-    hashed = hashlib.sha1()
+        self._held = line
+        self._blank = []
 
-    for line in diff.split('\n'):
+    def _scan_line(self, line):
         if len(line) <= 0:
-            continue
+            return
 
         hunk_match = HUNK_RE.match(line)
         filename_match = FILENAME_RE.match(line)
 
         if filename_match:
+            filename = filename_match.group(2)
+            if not filename.startswith('/dev/null'):
+                self._filenames.add('/'.join(filename.split('/')[1:]))
+
             # normalise -p1 top-directories
             if filename_match.group(1) == '---':
                 filename = 'a/'
@@ -49,16 +108,40 @@ def hash_diff(diff):
                 return int(x)
             line_nos = list(map(fn, hunk_match.groups()))
             line = '@@ -%d +%d @@' % tuple(line_nos)
-        elif line[0] in prefixes:
+        elif line[0] in ['-', '+', ' ']:
             # if we have a +, - or context line, leave as-is
-            pass
+            if line[0] == '+':
+                self.insertions += 1
+            elif line[0] == '-':
+                self.deletions += 1
         else:
             # other lines are ignored
-            continue
+            return
+
+        self._hash.update((line + '\n').encode('utf-8'))
 
-        hashed.update((line + '\n').encode('utf-8'))
+    def hexdigest(self):
+        """Return the hash of the diff."""
+        return self._hash.hexdigest()
+
+    @property
+    def filenames(self):
+        """Return the sorted names of files changed by the diff."""
+        return sorted(self._filenames)
+
+    @property
+    def files(self):
+        """Return the number of files changed by the diff."""
+        return len(self._filenames)
+
+
+def hash_diff(diff):
+    """Generate a hash from a diff."""
+    scanner = DiffScanner()
+    scanner.update(diff)
+    scanner.finish()
 
-    return hashed.hexdigest()
+    return scanner.hexdigest()
 
 
 def main(args):
@@ -0,0 +1,316 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""A minimal LMTP server for receiving mail.
+
+This allows a single, long-running process to handle every mail
+delivered by an MTA, rather than starting a new Python interpreter and
+setting up Django for each mail as ``parsemail.sh`` does. Mails can be
+delivered over TCP or a UNIX socket, either directly by an MTA that
+supports LMTP or via the ``parsemail-client`` script.
+
+Only the subset of LMTP (RFC 2033) required to deliver mail is
+implemented. Like ``parsemail.sh``, every mail accepted is acknowledged
+as delivered, regardless of whether it could be parsed, to avoid bounce
+messages being sent to the submitter.
+
+Mails delivered concurrently can optionally be parsed in batches, which
+saves each batch in a single transaction.
+"""
+
+import logging
+import os
+import socket
+import threading
+import timeit
+
+from django.db import close_old_connections
+from django.utils.six.moves import queue
+from django.utils.six.moves import socketserver
+
+from patchwork.mbox import message_from_bytes
+from patchwork.parser import parse_mail
+from patchwork.parser import parse_mail_batch
+from patchwork.parser import DuplicateMailError
+
+logger = logging.getLogger(__name__)
+
+MAX_LINE_LENGTH = 65536
+
+
+def deliver(data, list_id=None):
+    """Parse a mail, logging rather than raising any errors."""
+    try:
+        mail = message_from_bytes(data)
+    except AttributeError:
+        logger.warning('Broken email ignored')
+        return
+
+    try:
+        result = parse_mail(mail, list_id)
+        if result is None:
+            logger.warning('Nothing added to database')
+    except DuplicateMailError as exc:
+        logger.warning('Duplicate mail for message ID %s', exc.msgid)
+    except (ValueError, Exception) as exc:
+        logger.exception('Error when parsing incoming email: %s', exc,
+                         extra={'mail': mail.as_string()})
+
+
+def _report(mail, result):
+    """Log the result of parsing a mail in a batch."""
+    if isinstance(result, DuplicateMailError):
+        logger.warning('Duplicate mail for message ID %s', result.msgid)
+    elif isinstance(result, Exception):
+        logger.error('Error when parsing incoming email: %s', result,
+                     exc_info=(type(result), result,
+                               getattr(result, '__traceback__', None)),
+                     extra={'mail': mail.as_string()})
+    elif result is None:
+        logger.warning('Nothing added to database')
+
+
+class MailBatcher(object):
+    """Parse mails delivered concurrently in batches.
+
+    Mails are collected until there are ``size`` of them, or ``delay``
+    seconds have passed since the first arrived, then parsed together
+    using ``parse_mail_batch``. Each delivery waits until its mail has been
+    parsed, so mails are still only acknowledged once they're stored.
+    """
+
+    def __init__(self, list_id=None, size=10, delay=0.1):
+        self.list_id = list_id
+        self.size = size
+        self.delay = delay
+        self._condition = threading.Condition()
+        self._pending = []
+
+    def start(self):
+        thread = threading.Thread(target=self._work)
+        thread.daemon = True
+        thread.start()
+
+    def deliver(self, data):
+        """Parse a mail as part of the next batch, logging any errors."""
+        try:
+            mail = message_from_bytes(data)
+        except AttributeError:
+            logger.warning('Broken email ignored')
+            return
+
+        done = threading.Event()
+        with self._condition:
+            self._pending.append((mail, done))
+            self._condition.notify()
+        done.wait()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            deadline = timeit.default_timer() + self.delay
+            while len(self._pending) < self.size:
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = self._pending[:self.size]
+            del self._pending[:self.size]
+
+        return batch
+
+    def _parse(self, batch):
+        mails = [mail for mail, _ in batch]
+        try:
+            results = parse_mail_batch(mails, self.list_id)
+        except Exception as exc:
+            # the whole batch was rolled back
+            logger.exception('Error when parsing batch of %d incoming '
+                             'emails: %s', len(mails), exc)
+            results = []
+        finally:
+            for _, done in batch:
+                done.set()
+
+        for mail, result in zip(mails, results):
+            _report(mail, result)
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+
+            close_old_connections()
+            try:
+                self._parse(batch)
+            finally:
+                close_old_connections()
+
+
+class LMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, code, *lines):
+        lines = lines or ('OK',)
+        for i, line in enumerate(lines):
+            sep = ' ' if i == len(lines) - 1 else '-'
+            self.wfile.write(('%d%s%s\r\n' % (code, sep, line)).encode())
+        self.wfile.flush()
+
+    def reset(self):
+        self.sender = None
+        self.recipients = []
+
+    def read_data(self):
+        """Read a dot-terminated message, undoing any dot-stuffing."""
+        lines = []
+        # long lines are read in chunks, and only the first chunk of a line
+        # can be the terminator or be dot-stuffed
+        line_start = True
+        while True:
+            line = self.rfile.readline(MAX_LINE_LENGTH)
+            if not line:
+                return None
+
+            if line_start:
+                if line.rstrip(b'\r\n') == b'.':
+                    break
+
+                if line.startswith(b'..'):
+                    line = line[1:]
+
+            line_start = line.endswith(b'\n')
+            lines.append(line)
+
+        # a line ending may itself be split between chunks
+        return b''.join(lines).replace(b'\r\n', b'\n')
+
+    def handle(self):
+        self.reset()
+        self.reply(220, '%s LMTP Patchwork ready' % socket.getfqdn())
+
+        while True:
+            line = self.rfile.readline(MAX_LINE_LENGTH)
+            if not line:
+                return
+
+            line = line.decode('ascii', 'replace').strip()
+            command, _, argument = line.partition(' ')
+            command = command.upper()
+
+            if command == 'LHLO':
+                self.reply(250, socket.getfqdn(), '8BITMIME', 'PIPELINING')
+            elif command == 'MAIL':
+                self.reset()
+                self.sender = argument
+                self.reply(250)
+            elif command == 'RCPT':
+                if self.sender is None:
+                    self.reply(503, 'Need MAIL command')
+                    continue
+                self.recipients.append(argument)
+                self.reply(250)
+            elif command == 'DATA':
+                if not self.recipients:
+                    self.reply(503, 'Need RCPT command')
+                    continue
+
+                self.reply(354, 'Start mail input; end with <CRLF>.<CRLF>')
+                data = self.read_data()
+                if data is None:
+                    return
+
+                self.server.deliver(data)
+
+                # LMTP requires a reply for each recipient
+                for _ in self.recipients:
+                    self.reply(250)
+                self.reset()
+            elif command == 'RSET':
+                self.reset()
+                self.reply(250)
+            elif command == 'NOOP':
+                self.reply(250)
+            elif command == 'QUIT':
+                self.reply(221, 'Bye')
+                return
+            else:
+                self.reply(500, 'Command not recognized')
+
+
+class _WorkerPoolMixIn(object):
+    """Handle connections using a fixed pool of worker threads.
+
+    Each worker keeps its own database connection open between mails,
+    subject to the usual ``CONN_MAX_AGE`` handling. If ``batch_size`` is
+    greater than 1, the mails being delivered by the workers are instead
+    parsed in batches by a separate thread. As each worker delivers one
+    mail at a time, batches are limited to the number of workers.
+    """
+
+    def start_workers(self, workers, batch_size=1, batch_delay=0.1):
+        self._requests = queue.Queue()
+
+        self._batcher = None
+        if batch_size > 1 and workers > 1:
+            self._batcher = MailBatcher(self.list_id,
+                                        min(batch_size, workers), batch_delay)
+            self._batcher.start()
+
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            request, client_address = self._requests.get()
+
+            close_old_connections()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                close_old_connections()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def deliver(self, data):
+        if self._batcher:
+            self._batcher.deliver(data)
+        else:
+            deliver(data, self.list_id)
+
+
+class LMTPServer(_WorkerPoolMixIn, socketserver.TCPServer):
+
+    allow_reuse_address = True
+
+    def __init__(self, address, list_id=None, workers=1, batch_size=1,
+                 batch_delay=0.1):
+        socketserver.TCPServer.__init__(self, address, LMTPHandler)
+        self.list_id = list_id
+        self.start_workers(workers, batch_size, batch_delay)
+
+
+class UnixLMTPServer(_WorkerPoolMixIn, socketserver.UnixStreamServer):
+
+    def __init__(self, path, list_id=None, workers=1, batch_size=1,
+                 batch_delay=0.1):
+        # remove any socket left over from a previous run
+        if os.path.exists(path):
+            os.unlink(path)
+
+        socketserver.UnixStreamServer.__init__(self, path, LMTPHandler)
+        self.list_id = list_id
+        self.start_workers(workers, batch_size, batch_delay)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
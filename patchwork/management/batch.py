@@ -0,0 +1,192 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Support for commands that update existing patches in bulk.
+
+Patches are processed in batches of consecutive IDs, either in the
+command's own process or spread across a pool of worker processes. The
+ID of the last patch in each completed batch can be recorded in a
+checkpoint file, allowing an interrupted run to be resumed.
+"""
+
+import multiprocessing
+import os
+import sys
+import timeit
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+
+from patchwork.models import Patch
+
+
+def _init_worker():
+    # this is a no-op if the worker was forked from an initialized parent
+    django.setup()
+
+
+def _process_batch(args):
+    process_batch, batch = args
+
+    with transaction.atomic():
+        process_batch(batch)
+
+    return batch[-1], len(batch)
+
+
+def _read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return 0
+
+    with open(path) as f:
+        return int(f.read().strip() or 0)
+
+
+def _write_checkpoint(path, patch_id):
+    # write atomically, so an interruption can't leave a corrupt file
+    with open(path + '.tmp', 'w') as f:
+        f.write('%d\n' % patch_id)
+    os.rename(path + '.tmp', path)
+
+
+class PatchBatchCommand(BaseCommand):
+    """A command that updates patches in batches.
+
+    Subclasses must set ``process_batch`` to a module-level function,
+    which is called with a list of patch IDs and must update those patches
+    without relying on per-patch ``save`` calls or signals. Each call is
+    made in its own transaction. Subclasses which update cover letters too
+    can set ``model`` to ``Submission``, in which case the IDs are those of
+    submissions.
+    """
+
+    process_batch = None
+
+    model = Patch
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'patch_ids',
+            nargs='*',
+            type=int,
+            help='a patch ID. If not supplied, all patches will be updated.')
+        parser.add_argument(
+            '--project',
+            help='only update patches belonging to the project with this '
+            'link name.')
+        parser.add_argument(
+            '--since',
+            help='only update patches received on or after this date, in '
+            'YYYY-MM-DD or ISO 8601 format.')
+        parser.add_argument(
+            '--jobs', '-j',
+            type=int, default=1,
+            help='number of worker processes to update patches with.')
+        parser.add_argument(
+            '--batch-size',
+            type=int, default=500,
+            help='number of patches to update in a single transaction.')
+        parser.add_argument(
+            '--checkpoint',
+            help='file to record progress in. If the file exists, patches '
+            'up to the ID recorded in it are skipped. It is removed once all '
+            'patches have been updated.')
+
+    def get_queryset(self, options):
+        patches = self.model.objects.all()
+
+        if options['patch_ids']:
+            patches = patches.filter(id__in=options['patch_ids'])
+
+        if options['project']:
+            if self.model is Patch:
+                patches = patches.filter(
+                    patch_project__linkname=options['project'])
+            else:
+                patches = patches.filter(project__linkname=options['project'])
+
+        if options['since']:
+            since = (parse_datetime(options['since']) or
+                     parse_date(options['since']))
+            if since is None:
+                self.stderr.write('Invalid date: %s' % options['since'])
+                sys.exit(1)
+            patches = patches.filter(date__gte=since)
+
+        return patches
+
+    def _batches(self, patches, start, batch_size):
+        """Split the patches into batches of IDs, after 'start'."""
+        patches = patches.order_by('id').values_list('id', flat=True)
+        while True:
+            batch = list(patches.filter(id__gt=start)[:batch_size])
+            if not batch:
+                return
+
+            yield batch
+            start = batch[-1]
+
+    def _progress(self, done, count, elapsed):
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write('%06d/%06d (%.1f patches/s)\r' % (
+            done, count, rate), ending='')
+        self.stdout.flush()
+
+    def handle(self, *args, **options):
+        jobs = options['jobs']
+        if jobs < 1:
+            self.stderr.write('Invalid number of jobs: %d' % jobs)
+            sys.exit(1)
+
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write('Invalid batch size: %d' % batch_size)
+            sys.exit(1)
+
+        patches = self.get_queryset(options)
+
+        checkpoint = options['checkpoint']
+        start = _read_checkpoint(checkpoint)
+        if start:
+            self.stdout.write('Resuming after patch %d' % start)
+
+        count = patches.filter(id__gt=start).count()
+        batches = self._batches(patches, start, batch_size)
+
+        tasks = ((type(self).process_batch, batch) for batch in batches)
+
+        if jobs > 1:
+            # each worker must open its own database connection: one
+            # inherited from the parent would be shared by all of them
+            connections.close_all()
+            pool = multiprocessing.Pool(jobs, initializer=_init_worker)
+            results = pool.imap(_process_batch, tasks)
+        else:
+            pool = None
+            results = (_process_batch(task) for task in tasks)
+
+        begin = timeit.default_timer()
+        done = 0
+        try:
+            # results are returned in order, so once a batch is complete
+            # so is every batch before it
+            for last_id, updated in results:
+                done += updated
+                if checkpoint:
+                    _write_checkpoint(checkpoint, last_id)
+                self._progress(done, count, timeit.default_timer() - begin)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = timeit.default_timer() - begin
+        self.stdout.write('\nUpdated %d patches in %.1fs' % (done, elapsed))
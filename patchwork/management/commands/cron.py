@@ -7,11 +7,12 @@ from django.core.management.base import BaseCommand
 
 from patchwork.notifications import expire_notifications
 from patchwork.notifications import send_notifications
+from patchwork.retention import prune_events
 
 
 class Command(BaseCommand):
-    help = ('Run periodic Patchwork functions: send notifications and '
-            'expire unused users')
+    help = ('Run periodic Patchwork functions: send notifications, '
+            'expire unused users and remove old events')
 
     def handle(self, *args, **kwargs):
         errors = send_notifications()
@@ -20,3 +21,5 @@ class Command(BaseCommand):
                               (recipient.email, error))
 
         expire_notifications()
+
+        prune_events()
@@ -3,19 +3,193 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from collections import Counter
+from collections import OrderedDict
+import email.parser
 import logging
-import mailbox
+import multiprocessing
 import os
 import sys
 
+import django
 from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import six
 
 from patchwork import models
+from patchwork.mbox import message_from_bytes
+from patchwork.mbox import open_archive
+from patchwork.parser import clean_header
+from patchwork.parser import find_references
 from patchwork.parser import parse_mail
+from patchwork.parser import parse_mail_batch
 from patchwork.parser import DuplicateMailError
+from patchwork.stats import collect_parse_stats
+from patchwork.stats import ParseStats
 
 logger = logging.getLogger(__name__)
 
+DUPLICATE = 'duplicate'
+DROPPED = 'dropped'
+ERROR = 'error'
+
+# per-worker state, populated by '_init_worker'
+_worker_archive = None
+_worker_list_id = None
+_worker_batch_size = None
+_worker_stats = None
+
+
+def _classify(result):
+    """Classify the result of parsing a mail.
+
+    Returns:
+        The type of the object created, or one of ``DUPLICATE``,
+        ``DROPPED`` or ``ERROR``.
+    """
+    if isinstance(result, DuplicateMailError):
+        logger.warning('Duplicate mail for message ID %s', result.msgid)
+        return DUPLICATE
+    elif isinstance(result, Exception):
+        logger.warning('Invalid mail: %s', result)
+        return ERROR
+    elif result:
+        return type(result)
+    return DROPPED
+
+
+def _parse_mails(mails, list_id, batch_size):
+    """Parse mails, in batches of 'batch_size', and classify the results."""
+    if batch_size <= 1:
+        for mail in mails:
+            try:
+                result = parse_mail(mail, list_id)
+            except (ValueError, Exception) as exc:
+                result = exc
+            yield _classify(result)
+        return
+
+    batch = []
+    for mail in mails:
+        batch.append(mail)
+        if len(batch) < batch_size:
+            continue
+
+        for result in parse_mail_batch(batch, list_id):
+            yield _classify(result)
+        batch = []
+
+    if batch:
+        for result in parse_mail_batch(batch, list_id):
+            yield _classify(result)
+
+
+def _read_headers(data):
+    if six.PY3:
+        return email.parser.BytesHeaderParser().parsebytes(data)
+    return email.parser.HeaderParser().parsestr(data)
+
+
+def group_by_thread(archive):
+    """Group the messages of a mailbox by thread.
+
+    Messages are linked to each other using their Message-ID, In-Reply-To
+    and References headers, so that every message in a thread (and thus
+    every patch in a series, including revisions sent in reply to a
+    previous revision) ends up in the same group. Messages within a
+    group retain their order in the mailbox, which is required for
+    ``find_series`` to see patches and replies in the order they were
+    archived.
+
+    Args:
+        archive (patchwork.mbox.MboxReader or patchwork.mbox.MaildirReader):
+            The archive to group
+
+    Returns:
+        A list of lists of archive keys, ordered by the first appearance
+        of each thread in the archive.
+    """
+    parents = {}
+
+    def find(msgid):
+        root = msgid
+        while parents[root] != root:
+            root = parents[root]
+        # path compression
+        while parents[msgid] != root:
+            parents[msgid], msgid = root, parents[msgid]
+        return root
+
+    messages = []
+    for key in archive.iterkeys():
+        headers = _read_headers(archive.get_bytes(key))
+
+        msgids = [clean_header(headers.get('Message-Id', ''))]
+        msgids += find_references(headers)
+        msgids = [msgid[:255] for msgid in msgids if msgid]
+
+        if not msgids:
+            # we can't thread this, so it's a thread of its own
+            msgids = [key]
+
+        for msgid in msgids:
+            parents.setdefault(msgid, msgid)
+
+        root = find(msgids[0])
+        for msgid in msgids[1:]:
+            other = find(msgid)
+            if other != root:
+                parents[other] = root
+
+        messages.append((key, msgids[0]))
+
+    threads = OrderedDict()
+    for key, msgid in messages:
+        threads.setdefault(find(msgid), []).append(key)
+
+    return list(threads.values())
+
+
+def _init_worker(path, list_id, batch_size, stats):
+    global _worker_archive, _worker_list_id, _worker_batch_size
+    global _worker_stats
+
+    # this is a no-op if the worker was forked from an initialized parent
+    django.setup()
+
+    _worker_archive = open_archive(path)
+    _worker_list_id = list_id
+    _worker_batch_size = batch_size
+    _worker_stats = stats
+
+
+def _parse_thread(keys):
+    """Parse a thread of mails.
+
+    Returns:
+        A tuple of a Counter of results and, if requested, a ParseStats.
+    """
+    results = Counter()
+    stats = ParseStats() if _worker_stats else None
+
+    def _mails():
+        for key in keys:
+            try:
+                yield message_from_bytes(_worker_archive.get_bytes(key))
+            except AttributeError:
+                logger.warning('Broken email ignored')
+                results[ERROR] += 1
+
+    if stats is not None:
+        with collect_parse_stats(stats):
+            results.update(_parse_mails(_mails(), _worker_list_id,
+                                        _worker_batch_size))
+    else:
+        results.update(_parse_mails(_mails(), _worker_list_id,
+                                    _worker_batch_size))
+
+    return results, stats
+
 
 class Command(BaseCommand):
     help = 'Parse an mbox archive file and store any patches/comments found.'
@@ -23,22 +197,91 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(
             'infile',
-            help='input mbox filename')
+            nargs='?',
+            type=str,
+            default=None,
+            help='input mbox filename, Maildir directory or, if not '
+            'supplied, stdin')
         parser.add_argument(
             '--list-id',
             help='mailing list ID. If not supplied, this will be '
             'extracted from the mail headers.')
+        parser.add_argument(
+            '--jobs', '-j',
+            type=int, default=1,
+            help='number of worker processes to parse mails with. Mails are '
+            'distributed between workers by thread.')
+        parser.add_argument(
+            '--batch-size',
+            type=int, default=1,
+            help='number of mails to save to the database in a single '
+            'transaction.')
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='show the time spent and database queries made in each '
+            'phase of parsing.')
 
-    def handle(self, *args, **options):
-        results = {
-            models.Patch: 0,
-            models.CoverLetter: 0,
-            models.Comment: 0,
-        }
-        duplicates = 0
-        dropped = 0
-        errors = 0
+    def _progress(self, i):
+        self.stdout.write('%06d\r' % i, ending='')
+        self.stdout.flush()
+
+    def _parse_serial(self, archive, list_id, batch_size, stats,
+                      verbosity):
+        results = Counter()
+
+        def _parse():
+            for i, result in enumerate(_parse_mails(
+                    archive.messages(), list_id, batch_size)):
+                results[result] += 1
+
+                if verbosity < 3 and (i % 10) == 0:
+                    self._progress(i)
+
+        if stats is not None:
+            with collect_parse_stats(stats):
+                _parse()
+        else:
+            _parse()
+
+        results[ERROR] += archive.broken
+
+        return results, archive.count
+
+    def _parse_parallel(self, archive, path, list_id, batch_size, stats,
+                        jobs, verbosity):
+        results = Counter()
+
+        threads = group_by_thread(archive)
+        count = sum(len(thread) for thread in threads)
+        logger.info('Parsing %d mails in %d threads', count, len(threads))
+
+        # each worker must open its own database connection: one
+        # inherited from the parent would be shared by all of them
+        connections.close_all()
+
+        pool = multiprocessing.Pool(
+            jobs, initializer=_init_worker,
+            initargs=(path, list_id, batch_size, stats is not None))
+        try:
+            done = 0
+            for thread_results, thread_stats in pool.imap_unordered(
+                    _parse_thread, threads):
+                results.update(thread_results)
+                done += sum(thread_results.values())
 
+                if thread_stats is not None:
+                    stats.merge(thread_stats)
+
+                if verbosity < 3:
+                    self._progress(done)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return results, count
+
+    def handle(self, *args, **options):
         verbosity = int(options['verbosity'])
         if not verbosity:
             level = logging.CRITICAL
@@ -52,62 +295,49 @@ class Command(BaseCommand):
         if level:
             logger.setLevel(level)
             logging.getLogger('patchwork.parser').setLevel(level)
+            logging.getLogger('patchwork.mbox').setLevel(level)
+            logging.getLogger('patchwork.stats').setLevel(level)
 
-        # TODO(stephenfin): Support passing via stdin
         path = args and args[0] or options['infile']
-        if not os.path.exists(path):
+        if path is not None and not os.path.exists(path):
             logger.error('Invalid path: %s', path)
             sys.exit(1)
 
-        # assume if <infile> is a directory, then we're passing a maildir
-        if os.path.isfile(path):
-            mbox = mailbox.mbox(path, create=False)
-        else:
-            mbox = mailbox.Maildir(path, create=False)
-
-        count = len(mbox)
-
-        # Iterate through the mbox. This will pick up exceptions that are only
-        # thrown when a broken email is found part way through. Without this
-        # block, we'd get the exception thrown in enumerate(mbox) below, which
-        # is harder to catch. This is due to a bug in the Python 'email'
-        # library, as described here:
-        #
-        #   https://lists.ozlabs.org/pipermail/patchwork/2017-July/004486.html
-        #
-        # The alternative is converting the mbox to a list of messages, but
-        # that requires holding the entire thing in memory, which is wateful.
-        try:
-            for m in mbox:
-                pass
-        except AttributeError:
-            logger.error('Broken mbox/Maildir, aborting')
-            return
+        jobs = options['jobs']
+        if jobs < 1:
+            logger.error('Invalid number of jobs: %d', jobs)
+            sys.exit(1)
 
-        logger.info('Parsing %d mails', count)
-        for i, msg in enumerate(mbox):
-            try:
-                obj = parse_mail(msg, options['list_id'])
-                if obj:
-                    results[type(obj)] += 1
-                else:
-                    dropped += 1
-            except DuplicateMailError as exc:
-                duplicates += 1
-                logger.warning('Duplicate mail for message ID %s', exc.msgid)
-            except (ValueError, Exception) as exc:
-                errors += 1
-                logger.warning('Invalid mail: %s', exc.message)
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            logger.error('Invalid batch size: %d', batch_size)
+            sys.exit(1)
 
-            if verbosity < 3 and (i % 10) == 0:
-                self.stdout.write('%06d/%06d\r' % (i, count), ending='')
-                self.stdout.flush()
+        stats = ParseStats() if options['stats'] else None
 
-        mbox.close()
+        archive = open_archive(path)
+
+        if jobs > 1 and not archive.seekable:
+            logger.error('Parallel parsing requires an mbox file or Maildir')
+            sys.exit(1)
+
+        if jobs > 1:
+            results, count = self._parse_parallel(
+                archive, path, options['list_id'], batch_size, stats, jobs,
+                verbosity)
+        else:
+            results, count = self._parse_serial(
+                archive, options['list_id'], batch_size, stats, verbosity)
+
+        archive.close()
 
         if not verbosity:
             return
 
+        duplicates = results[DUPLICATE]
+        dropped = results[DROPPED]
+        errors = results[ERROR]
+
         self.stdout.write(
             'Processed %(total)d messages -->\n'
             '  %(covers)4d cover letters\n'
@@ -126,3 +356,6 @@ class Command(BaseCommand):
                 'errors': errors,
                 'new': count - duplicates - dropped - errors,
             })
+
+        if stats is not None:
+            self.stdout.write('\n' + stats.summary())
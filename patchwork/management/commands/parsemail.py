@@ -10,6 +10,9 @@ import sys
 from django.core.management import base
 from django.utils import six
 
+from patchwork.lmtp import LMTPServer
+from patchwork.lmtp import UnixLMTPServer
+from patchwork.parser import enable_msgid_cache
 from patchwork.parser import parse_mail
 from patchwork.parser import DuplicateMailError
 
@@ -30,8 +33,94 @@ class Command(base.BaseCommand):
             '--list-id',
             help='mailing list ID. If not supplied, this will be '
             'extracted from the mail headers.')
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            help='run as a daemon, receiving mails via LMTP rather than '
+            'parsing a single mail.')
+        parser.add_argument(
+            '--socket',
+            help='path of the UNIX socket to listen on, when run as a '
+            'daemon.')
+        parser.add_argument(
+            '--host',
+            default='localhost',
+            help='address to listen on, when run as a daemon and no socket '
+            'is given. Defaults to localhost.')
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8024,
+            help='port to listen on, when run as a daemon and no socket is '
+            'given. Defaults to 8024.')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='number of mails to parse concurrently, when run as a '
+            'daemon. Defaults to 1.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1,
+            help='maximum number of mails delivered concurrently to parse '
+            'in a single transaction, when run as a daemon. Batches are '
+            'limited to the number of workers. Defaults to 1, which '
+            'disables batching.')
+        parser.add_argument(
+            '--batch-delay',
+            type=int,
+            default=100,
+            help='maximum number of milliseconds to wait for further mails '
+            'to add to a batch, when run as a daemon. Defaults to 100.')
+
+    def handle_daemon(self, **options):
+        if options['workers'] < 1:
+            self.stderr.write('Invalid number of workers: %d' %
+                              options['workers'])
+            sys.exit(1)
+
+        if options['batch_size'] < 1:
+            self.stderr.write('Invalid batch size: %d' %
+                              options['batch_size'])
+            sys.exit(1)
+
+        if options['batch_delay'] < 0:
+            self.stderr.write('Invalid batch delay: %d' %
+                              options['batch_delay'])
+            sys.exit(1)
+
+        # replies generally arrive soon after the mail they reply to, so
+        # remember where recent mails ended up
+        enable_msgid_cache()
+
+        batch_delay = options['batch_delay'] / 1000.0
+        if options['socket']:
+            server = UnixLMTPServer(options['socket'],
+                                    list_id=options['list_id'],
+                                    workers=options['workers'],
+                                    batch_size=options['batch_size'],
+                                    batch_delay=batch_delay)
+        else:
+            server = LMTPServer((options['host'], options['port']),
+                                list_id=options['list_id'],
+                                workers=options['workers'],
+                                batch_size=options['batch_size'],
+                                batch_delay=batch_delay)
+
+        logger.info('Listening for mail on %s', server.server_address)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
 
     def handle(self, *args, **options):
+        if options['daemon']:
+            return self.handle_daemon(**options)
+
         infile = args[0] if args else options['infile']
 
         try:
@@ -0,0 +1,35 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from patchwork.management.batch import PatchBatchCommand
+from patchwork.models import Comment
+from patchwork.models import Submission
+from patchwork.models import SubmissionBody
+
+
+def _rewrite(model, ids, fields):
+    # values are read back as text and written again, which stores them
+    # compressed or not according to the current COMPRESS_CONTENT setting.
+    # The values are large, so write each row separately rather than
+    # building one huge CASE expression.
+    for row in model.objects.filter(pk__in=ids).values_list('pk', *fields):
+        model.objects.filter(pk=row[0]).update(**dict(zip(fields, row[1:])))
+
+
+def _recompress(submission_ids):
+    _rewrite(SubmissionBody, submission_ids, ('headers', 'content', 'diff'))
+
+    comment_ids = list(Comment.objects.filter(
+        submission__in=submission_ids).values_list('id', flat=True))
+    _rewrite(Comment, comment_ids, ('headers', 'content'))
+
+
+class Command(PatchBatchCommand):
+    help = ('Compress, or decompress, the headers, content and diffs of '
+            'existing submissions and their comments, according to the '
+            'COMPRESS_CONTENT setting')
+
+    process_batch = staticmethod(_recompress)
+
+    model = Submission
@@ -4,29 +4,31 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-from django.core.management.base import BaseCommand
+from django.db.models import Case
+from django.db.models import Value
+from django.db.models import When
 
+from patchwork.hasher import hash_diff
+from patchwork.management.batch import PatchBatchCommand
 from patchwork.models import Patch
 
 
-class Command(BaseCommand):
-    help = 'Update the hashes on existing patches'
-    args = '[<patch_id>...]'
+def _rehash(patch_ids):
+    patches = Patch.objects.filter(pk__in=patch_ids,
+                                   body__diff__isnull=False)
+
+    hashes = [
+        When(pk=patch_id, then=Value(hash_diff(diff)))
+        for patch_id, diff in patches.values_list('pk', 'body__diff')]
+    if not hashes:
+        return
 
-    def handle(self, *args, **options):
-        query = Patch.objects
+    # update every patch using a single query
+    patches.update(
+        hash=Case(*hashes, output_field=Patch._meta.get_field('hash')))
 
-        if args:
-            query = query.filter(id_in=args)
-        else:
-            query = query.all()
 
-        count = query.count()
+class Command(PatchBatchCommand):
+    help = 'Update the hashes on existing patches'
 
-        for i, patch in enumerate(query.iterator()):
-            patch.hash = None
-            patch.save()
-            if (i % 10) == 0:
-                self.stdout.write('%06d/%06d\r' % (i, count), ending='')
-                self.stdout.flush()
-        self.stdout.write('\ndone')
+    process_batch = staticmethod(_rehash)
@@ -3,28 +3,15 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-from django.core.management.base import BaseCommand
-
+from patchwork.management.batch import PatchBatchCommand
 from patchwork.models import Patch
 
 
-class Command(BaseCommand):
-    help = 'Update the tag (Ack/Review/Test) counts on existing patches'
-    args = '[<patch_id>...]'
-
-    def handle(self, *args, **options):
-        query = Patch.objects
+def _retag(patch_ids):
+    Patch.objects.refresh_tag_counts(patch_ids)
 
-        if args:
-            query = query.filter(id__in=args)
-        else:
-            query = query.all()
 
-        count = query.count()
+class Command(PatchBatchCommand):
+    help = 'Update the tag (Ack/Review/Test) counts on existing patches'
 
-        for i, patch in enumerate(query.iterator()):
-            patch.refresh_tag_counts()
-            if (i % 10) == 0:
-                self.stdout.write('%06d/%06d\r' % (i, count), ending='')
-                self.stdout.flush()
-        self.stdout.write('\ndone')
+    process_batch = staticmethod(_retag)
@@ -0,0 +1,221 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Streaming readers for mbox and Maildir archives.
+
+Unlike the readers found in the ``mailbox`` module, these don't need to
+scan an mbox file before reading messages from it, and can read from
+non-seekable streams such as ``stdin``. Messages are returned as raw
+bytes which can be parsed by the caller, allowing broken messages to be
+skipped rather than aborting the entire import.
+"""
+
+import email
+import logging
+import mailbox
+import mmap
+import os
+import stat
+import sys
+
+from django.utils import six
+
+logger = logging.getLogger(__name__)
+
+FROM_LINE = b'From '
+
+
+def message_from_bytes(data):
+    """Parse a mail from raw bytes."""
+    if six.PY3:
+        return email.message_from_bytes(data)
+    return email.message_from_string(data)
+
+
+class _Reader(object):
+
+    def __init__(self):
+        self.count = 0
+        self.broken = 0
+
+    def iterkeys(self):
+        raise NotImplementedError
+
+    def get_bytes(self, key):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        for key in self.iterkeys():
+            yield self.get_bytes(key)
+
+    def messages(self):
+        """Iterate through the messages of the archive.
+
+        Messages that can't be parsed are skipped and counted in
+        ``broken``. ``count`` holds the number of messages read so far,
+        including broken ones.
+        """
+        # Parsing can fail with an AttributeError when a broken email is
+        # found. This is due to a bug in the Python 'email' library, as
+        # described here:
+        #
+        #   https://lists.ozlabs.org/pipermail/patchwork/2017-July/004486.html
+        for data in self:
+            self.count += 1
+
+            try:
+                mail = message_from_bytes(data)
+            except AttributeError:
+                logger.warning('Broken email ignored')
+                self.broken += 1
+                continue
+
+            yield mail
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MboxReader(_Reader):
+    """Read messages from an mbox file or stream.
+
+    Messages are split on lines beginning with ``From ``. Where possible,
+    the file is memory-mapped and each message can be accessed directly
+    using the key returned by ``iterkeys``. Otherwise, the file is read
+    line-by-line and messages can only be iterated through once.
+    """
+
+    def __init__(self, fileobj):
+        super(MboxReader, self).__init__()
+
+        self._owned = isinstance(fileobj, six.string_types)
+        if self._owned:
+            fileobj = open(fileobj, 'rb')
+
+        self._file = fileobj
+        self._map = None
+
+        try:
+            mode = os.fstat(fileobj.fileno()).st_mode
+        except (AttributeError, EnvironmentError, ValueError):
+            # not a real file, e.g. a BytesIO or an io.UnsupportedOperation
+            # (a subclass of ValueError) from a wrapped stream
+            return
+
+        if stat.S_ISREG(mode) and os.fstat(fileobj.fileno()).st_size:
+            self._map = mmap.mmap(fileobj.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    @property
+    def seekable(self):
+        """Whether messages can be accessed by key."""
+        return self._map is not None
+
+    def iterkeys(self):
+        """Iterate through the (start, end) offsets of each message."""
+        if not self.seekable:
+            raise TypeError('Messages can only be accessed by key in '
+                            'regular files')
+
+        if self._map[:len(FROM_LINE)] == FROM_LINE:
+            start = 0
+        else:
+            # skip anything before the first message, like 'mailbox' does
+            start = self._map.find(b'\n' + FROM_LINE)
+            if start == -1:
+                return
+            start += 1
+
+        size = len(self._map)
+        while start < size:
+            end = self._map.find(b'\n' + FROM_LINE, start)
+            end = size if end == -1 else end + 1
+            yield (start, end)
+            start = end
+
+    def get_bytes(self, key):
+        start, end = key
+        return self._strip(self._map[start:end])
+
+    @staticmethod
+    def _strip(data):
+        # drop the 'From ' line and the blank line separating messages
+        start = data.find(b'\n')
+        if start == -1:
+            return b''
+
+        data = data[start + 1:]
+        if data.endswith(b'\n\n'):
+            data = data[:-1]
+        elif data.endswith(b'\r\n\r\n'):
+            data = data[:-2]
+        return data
+
+    def __iter__(self):
+        if self.seekable:
+            for data in super(MboxReader, self).__iter__():
+                yield data
+            return
+
+        lines = []
+        for line in self._file:
+            if line.startswith(FROM_LINE):
+                if lines:
+                    yield self._strip(b''.join(lines))
+                lines = [line]
+            elif lines:
+                lines.append(line)
+
+        if lines:
+            yield self._strip(b''.join(lines))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+        if self._owned:
+            self._file.close()
+
+
+class MaildirReader(_Reader):
+    """Read messages from a Maildir."""
+
+    def __init__(self, path):
+        super(MaildirReader, self).__init__()
+
+        self._maildir = mailbox.Maildir(path, factory=None, create=False)
+
+    @property
+    def seekable(self):
+        return True
+
+    def iterkeys(self):
+        return self._maildir.iterkeys()
+
+    def get_bytes(self, key):
+        if six.PY3:
+            return self._maildir.get_bytes(key)
+        return self._maildir.get_string(key)
+
+    def close(self):
+        self._maildir.close()
+
+
+def open_archive(path=None):
+    """Open an mbox file, a Maildir, or stdin if no path is given."""
+    if path is None:
+        return MboxReader(getattr(sys.stdin, 'buffer', sys.stdin))
+
+    # assume if <path> is a directory, then we're passing a maildir
+    if os.path.isdir(path):
+        return MaildirReader(path)
+
+    return MboxReader(path)
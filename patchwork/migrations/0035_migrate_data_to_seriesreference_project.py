@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0034_add_seriesreference_project'),
+    ]
+
+    operations = [
+        # Copy Series.project to SeriesReference.project. There's nothing to
+        # do in reverse as the column is simply dropped.
+        migrations.RunSQL(
+            """UPDATE patchwork_seriesreference SET project_id =
+                  (SELECT project_id FROM patchwork_series
+                   WHERE patchwork_series.id =
+                            patchwork_seriesreference.series_id);
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0035_migrate_data_to_seriesreference_project'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='seriesreference',
+            name='project',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='patchwork.Project'),
+        ),
+        migrations.AddIndex(
+            model_name='seriesreference',
+            index=models.Index(fields=['project', 'msgid'], name='seriesref_project_msgid_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+import patchwork.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0036_add_seriesreference_project_index'),
+    ]
+
+    operations = [
+        # Add Patch.tag_counts, denormalised from PatchTag
+        migrations.AddField(
+            model_name='patch',
+            name='tag_counts',
+            field=patchwork.fields.TagCountsField(default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def populate_tag_counts(apps, schema_editor):
+    Patch = apps.get_model('patchwork', 'Patch')
+    PatchTag = apps.get_model('patchwork', 'PatchTag')
+
+    tag_counts = {}
+    for patch_id, tag_id, count in PatchTag.objects.values_list(
+            'patch_id', 'tag_id', 'count').iterator():
+        tag_counts.setdefault(patch_id, {})[tag_id] = count
+
+    # update patches with the same counts together, in chunks small enough
+    # to stay within the limits of every database
+    groups = {}
+    for patch_id, counts in tag_counts.items():
+        groups.setdefault(tuple(sorted(counts.items())), []).append(patch_id)
+
+    for counts, ids in groups.items():
+        for i in range(0, len(ids), 500):
+            Patch.objects.filter(submission_ptr_id__in=ids[i:i + 500]).update(
+                tag_counts=dict(counts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0037_add_patch_tag_counts'),
+    ]
+
+    operations = [
+        # Copy PatchTag.count to Patch.tag_counts. There's nothing to do in
+        # reverse as the column is simply dropped.
+        migrations.RunPython(populate_tag_counts,
+                             migrations.RunPython.noop),
+    ]
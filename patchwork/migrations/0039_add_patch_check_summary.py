@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db import models
+
+import patchwork.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0038_migrate_data_to_patch_tag_counts'),
+    ]
+
+    operations = [
+        # Add Patch.check_summary and Patch.check_state, denormalised from
+        # Check
+        migrations.AddField(
+            model_name='patch',
+            name='check_summary',
+            field=patchwork.fields.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='check_state',
+            field=models.SmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Check.STATE_*, in the order they take precedence when combined
+COMBINED_STATES = (3, 2, 0)  # fail, warning, pending
+STATE_PENDING = 0
+STATE_SUCCESS = 1
+
+
+def update_patch(Patch, patch_id, summary):
+    states = set(entry['state'] for entry in summary.values())
+
+    check_state = STATE_SUCCESS if states else STATE_PENDING
+    for state in COMBINED_STATES:
+        if state in states:
+            check_state = state
+            break
+
+    Patch.objects.filter(submission_ptr_id=patch_id).update(
+        check_summary=summary, check_state=check_state)
+
+
+def populate_check_summary(apps, schema_editor):
+    Check = apps.get_model('patchwork', 'Check')
+    Patch = apps.get_model('patchwork', 'Patch')
+
+    patch_id = None
+    summary = {}
+    latest = {}
+
+    for check_id, check_patch_id, user_id, context, state, date in \
+            Check.objects.order_by('patch_id', 'id').values_list(
+                'id', 'patch_id', 'user_id', 'context', 'state',
+                'date').iterator():
+        if check_patch_id != patch_id:
+            if patch_id is not None:
+                update_patch(Patch, patch_id, summary)
+            patch_id = check_patch_id
+            summary = {}
+            latest = {}
+
+        # only keep the latest check of each context for each user
+        key = '%d:%s' % (user_id, context)
+        if key in latest and latest[key] > (date, check_id):
+            continue
+
+        latest[key] = (date, check_id)
+        summary[key] = {'id': check_id, 'state': state,
+                        'date': date.isoformat()}
+
+    if patch_id is not None:
+        update_patch(Patch, patch_id, summary)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0039_add_patch_check_summary'),
+    ]
+
+    operations = [
+        # Summarise the checks of each patch in Patch.check_summary and
+        # Patch.check_state. There's nothing to do in reverse as the columns
+        # are simply dropped.
+        migrations.RunPython(populate_check_summary,
+                             migrations.RunPython.noop),
+    ]
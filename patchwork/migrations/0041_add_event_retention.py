@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0040_migrate_data_to_patch_check_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='event_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of days to keep events for. Older events are removed by the cron management command. If empty, events are kept forever.', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['project', 'date'], name='event_project_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['project', 'category', 'date'], name='event_project_category_idx'),
+        ),
+    ]
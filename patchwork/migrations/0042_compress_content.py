@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+import patchwork.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0041_add_event_retention'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='content',
+            field=patchwork.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='headers',
+            field=patchwork.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='patch',
+            name='diff',
+            field=patchwork.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='content',
+            field=patchwork.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='headers',
+            field=patchwork.fields.CompressedTextField(blank=True),
+        ),
+    ]
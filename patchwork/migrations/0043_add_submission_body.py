@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import patchwork.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0042_compress_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionBody',
+            fields=[
+                ('submission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='body', serialize=False, to='patchwork.Submission')),
+                ('headers', patchwork.fields.CompressedTextField(blank=True)),
+                ('content', patchwork.fields.CompressedTextField(blank=True, null=True)),
+                ('diff', patchwork.fields.CompressedTextField(blank=True, null=True)),
+            ],
+        ),
+    ]
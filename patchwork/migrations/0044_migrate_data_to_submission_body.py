@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0043_add_submission_body'),
+    ]
+
+    operations = [
+        # Values are copied as stored, so compressed values stay compressed
+        migrations.RunSQL(
+            """INSERT INTO patchwork_submissionbody
+                  (submission_id, headers, content, diff)
+                SELECT patchwork_submission.id, patchwork_submission.headers,
+                       patchwork_submission.content, patchwork_patch.diff
+                FROM patchwork_submission LEFT OUTER JOIN patchwork_patch
+                  ON patchwork_patch.submission_ptr_id =
+                     patchwork_submission.id;
+            """,
+            """UPDATE patchwork_submission SET headers =
+                  (SELECT headers FROM patchwork_submissionbody
+                   WHERE patchwork_submissionbody.submission_id =
+                            patchwork_submission.id);
+               UPDATE patchwork_submission SET content =
+                  (SELECT content FROM patchwork_submissionbody
+                   WHERE patchwork_submissionbody.submission_id =
+                            patchwork_submission.id);
+               UPDATE patchwork_patch SET diff =
+                  (SELECT diff FROM patchwork_submissionbody
+                   WHERE patchwork_submissionbody.submission_id =
+                            patchwork_patch.submission_ptr_id);
+            """,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0044_migrate_data_to_submission_body'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='submission',
+            name='content',
+        ),
+        migrations.RemoveField(
+            model_name='submission',
+            name='headers',
+        ),
+        migrations.RemoveField(
+            model_name='patch',
+            name='diff',
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models import Max
+
+
+def sequence_existing_events(apps, schema_editor):
+    Event = apps.get_model('patchwork', 'Event')
+    EventSequence = apps.get_model('patchwork', 'EventSequence')
+
+    # events already committed can keep the order of their IDs
+    Event.objects.update(sequence=F('id'))
+    EventSequence.objects.create(
+        id=1, value=Event.objects.aggregate(value=Max('id'))['value'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0045_remove_submission_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='sequence',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(sequence_existing_events,
+                             migrations.RunPython.noop),
+    ]
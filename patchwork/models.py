@@ -6,20 +6,30 @@
 
 from collections import Counter
 from collections import OrderedDict
+import contextlib
+import copy
 import datetime
 import random
 import re
+import threading
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.functional import cached_property
 
+from patchwork.fields import CompressedTextField
 from patchwork.fields import HashField
+from patchwork.fields import JSONField
+from patchwork.fields import TagCountsField
 from patchwork.hasher import hash_diff
+from patchwork.stats import phase
 
 if settings.ENABLE_REST_API:
     from rest_framework.authtoken.models import Token
@@ -82,6 +92,11 @@ class Project(models.Model):
 
     send_notifications = models.BooleanField(default=False)
     use_tags = models.BooleanField(default=True)
+    event_retention_days = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='Number of days to keep events for. Older events are '
+        'removed by the cron management command. If empty, events are kept '
+        'forever.')
 
     def is_editable(self, user):
         if not user.is_authenticated:
@@ -220,6 +235,9 @@ class State(models.Model):
         ordering = ['ordering']
 
 
+_tag_regexes = {}
+
+
 @python_2_unicode_compatible
 class Tag(models.Model):
     name = models.CharField(max_length=20)
@@ -236,8 +254,14 @@ class Tag(models.Model):
                                       default=True)
 
     @property
-    def attr_name(self):
-        return 'tag_%d_count' % self.id
+    def regex(self):
+        """The compiled pattern, which is only compiled once per process."""
+        try:
+            return _tag_regexes[self.pattern]
+        except KeyError:
+            regex = re.compile(self.pattern, re.MULTILINE | re.IGNORECASE)
+            _tag_regexes[self.pattern] = regex
+            return regex
 
     def __str__(self):
         return self.name
@@ -259,45 +283,97 @@ def get_default_initial_patch_state():
     return State.objects.get(ordering=0)
 
 
-class PatchQuerySet(models.query.QuerySet):
+_deferred_tag_refresh = threading.local()
 
-    def with_tag_counts(self, project=None):
-        if project and not project.use_tags:
-            return self
 
-        # We need the project's use_tags field loaded for Project.tags().
-        # Using prefetch_related means we'll share the one instance of
-        # Project, and share the project.tags cache between all patch.project
-        # references.
-        qs = self.prefetch_related('project')
-        select = OrderedDict()
-        select_params = []
+@contextlib.contextmanager
+def defer_tag_refresh():
+    """Defer refreshing of patch tag counts until the end of the block.
 
-        # All projects have the same tags, so we're good to go here
-        if project:
-            tags = project.tags
-        else:
-            tags = Tag.objects.all()
+    Any call to ``Patch.refresh_tag_counts`` made inside the block is
+    recorded and, if the block completes successfully, the tag counts of
+    every affected patch are refreshed once using
+    ``PatchManager.refresh_tag_counts``.
+    """
+    if getattr(_deferred_tag_refresh, 'patch_ids', None) is not None:
+        # we're nested in another block, which will handle the refresh
+        yield
+        return
 
-        for tag in tags:
-            select[tag.attr_name] = (
-                "coalesce("
-                "(SELECT count FROM patchwork_patchtag"
-                " WHERE patchwork_patchtag.patch_id="
-                "patchwork_patch.submission_ptr_id"
-                " AND patchwork_patchtag.tag_id=%s), 0)")
-            select_params.append(tag.id)
+    _deferred_tag_refresh.patch_ids = OrderedDict()
+    try:
+        yield
+        patch_ids = list(_deferred_tag_refresh.patch_ids)
+    finally:
+        _deferred_tag_refresh.patch_ids = None
 
-        return qs.extra(select=select, select_params=select_params)
+    Patch.objects.refresh_tag_counts(patch_ids)
 
 
 class PatchManager(models.Manager):
 
-    def get_queryset(self):
-        return PatchQuerySet(self.model, using=self.db)
+    def refresh_tag_counts(self, patch_ids):
+        """Refresh the tag counts of many patches at once.
 
-    def with_tag_counts(self, project):
-        return self.get_queryset().with_tag_counts(project)
+        This is equivalent to calling ``Patch.refresh_tag_counts`` for
+        each patch, but uses a fixed number of queries regardless of the
+        number of patches and comments.
+
+        Returns:
+            A dict mapping the ID of each patch refreshed to its new tag
+            counts, as stored in ``Patch.tag_counts``
+        """
+        with phase('tags'):
+            return self._refresh_tag_counts(patch_ids)
+
+    def _refresh_tag_counts(self, patch_ids):
+        tags = list(Tag.objects.all())
+        if not tags or not patch_ids:
+            return {}
+
+        def extract_tags(content):
+            counts = Counter()
+            if content:
+                for tag in tags:
+                    counts[tag] = len(tag.regex.findall(content))
+            return counts
+
+        counters = {}
+        for patch_id, content in self.get_queryset().filter(
+                id__in=patch_ids, project__use_tags=True).values_list(
+                    'id', 'body__content'):
+            counters[patch_id] = extract_tags(content)
+
+        if not counters:
+            return {}
+
+        for patch_id, content in Comment.objects.filter(
+                submission__in=list(counters)).values_list(
+                    'submission_id', 'content'):
+            counters[patch_id] += extract_tags(content)
+
+        PatchTag.objects.filter(patch__in=list(counters)).delete()
+        PatchTag.objects.bulk_create([
+            PatchTag(patch_id=patch_id, tag=tag, count=counter[tag])
+            for patch_id, counter in counters.items()
+            for tag in tags if counter[tag]])
+
+        tag_counts = {
+            patch_id: {tag.id: counter[tag] for tag in tags if counter[tag]}
+            for patch_id, counter in counters.items()}
+
+        # most patches share the same counts, if only because they have no
+        # tags, so update each group of patches at once
+        groups = {}
+        for patch_id, counts in tag_counts.items():
+            groups.setdefault(tuple(sorted(counts.items())), []).append(
+                patch_id)
+
+        for counts, ids in groups.items():
+            self.get_queryset().filter(id__in=ids).update(
+                tag_counts=dict(counts))
+
+        return tag_counts
 
 
 class EmailMixin(models.Model):
@@ -306,12 +382,10 @@ class EmailMixin(models.Model):
 
     msgid = models.CharField(max_length=255)
     date = models.DateTimeField(default=datetime.datetime.utcnow)
-    headers = models.TextField(blank=True)
 
     # content
 
     submitter = models.ForeignKey(Person, on_delete=models.CASCADE)
-    content = models.TextField(null=True, blank=True)
 
     response_re = re.compile(
         r'^(Tested|Reviewed|Acked|Signed-off|Nacked|Reported)-by:.*$',
@@ -325,13 +399,33 @@ class EmailMixin(models.Model):
         return ''.join([match.group(0) + '\n' for match in
                         self.response_re.finditer(self.content)])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(EmailMixin, cls).from_db(db, field_names, values)
+        # record the content loaded so we can tell if it's changed on save
+        instance._loaded_content = instance.__dict__.get('content')
+        return instance
+
+    def _content_changed(self):
+        """Return whether the content has changed since it was loaded."""
+        if self._state.adding:
+            return True
+
+        if 'content' not in self.__dict__:
+            # the content was deferred and has been left untouched
+            return False
+
+        return self.content != getattr(self, '_loaded_content', None)
+
     def save(self, *args, **kwargs):
         # Modifying a submission via admin interface changes '\n' newlines in
         # message content to '\r\n'. We need to fix them to avoid problems,
         # especially as git complains about malformed patches when PW runs
         # on PY2
-        self.content = self.content.replace('\r\n', '\n')
+        if self._content_changed() and self.content:
+            self.content = self.content.replace('\r\n', '\n')
         super(EmailMixin, self).save(*args, **kwargs)
+        self._loaded_content = self.__dict__.get('content')
 
     class Meta:
         abstract = True
@@ -347,6 +441,19 @@ class FilenameMixin(object):
         return fname
 
 
+def _body_field(name):
+    """Make a property for a field stored in the submission's body."""
+
+    def fget(self):
+        return getattr(self._get_body(), name)
+
+    def fset(self, value):
+        setattr(self._get_body(), name, value)
+        self._body_changed = True
+
+    return property(fget, fset)
+
+
 @python_2_unicode_compatible
 class Submission(FilenameMixin, EmailMixin, models.Model):
     # parent
@@ -357,11 +464,49 @@ class Submission(FilenameMixin, EmailMixin, models.Model):
 
     name = models.CharField(max_length=255)
 
+    # content, stored in the body and loaded when first accessed, unless
+    # fetched with select_related('body')
+
+    headers = _body_field('headers')
+    content = _body_field('content')
+
+    _body_changed = False
+
+    def _get_body(self):
+        try:
+            return self.body
+        except SubmissionBody.DoesNotExist:
+            # this also caches the new body as self.body
+            return SubmissionBody(submission=self)
+
+    def _content_changed(self):
+        if self._state.adding:
+            return True
+
+        if not self._body_changed:
+            # the body may not even have been loaded
+            return False
+
+        body = self._get_body()
+        return body.content != getattr(body, '_loaded_content', None)
+
     # patchwork metadata
 
     def is_editable(self, user):
         return False
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+
+        super(Submission, self).save(*args, **kwargs)
+
+        if adding or self._body_changed:
+            body = self._get_body()
+            body.submission_id = self.id
+            body.save(force_insert=body._state.adding)
+            body._loaded_content = body.content
+            self._body_changed = False
+
     def __str__(self):
         return self.name
 
@@ -378,6 +523,31 @@ class Submission(FilenameMixin, EmailMixin, models.Model):
         ]
 
 
+class SubmissionBody(models.Model):
+    """The headers, content and diff of a submission.
+
+    These make up most of the size of a submission but are only needed
+    when displaying or downloading it, so they're stored apart from the
+    rest of the submission. This keeps the rows scanned by lists small,
+    whether or not the query remembers to defer the content.
+    """
+
+    submission = models.OneToOneField(
+        Submission, primary_key=True, related_name='body',
+        on_delete=models.CASCADE)
+
+    headers = CompressedTextField(blank=True)
+    content = CompressedTextField(null=True, blank=True)
+    diff = CompressedTextField(null=True, blank=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(SubmissionBody, cls).from_db(db, field_names, values)
+        # record the content loaded so we can tell if it's changed on save
+        instance._loaded_content = instance.__dict__.get('content')
+        return instance
+
+
 class CoverLetter(Submission):
 
     def get_absolute_url(self):
@@ -391,10 +561,17 @@ class CoverLetter(Submission):
 class Patch(Submission):
     # patch metadata
 
-    diff = models.TextField(null=True, blank=True)
+    diff = _body_field('diff')
     commit_ref = models.CharField(max_length=255, null=True, blank=True)
     pull_url = models.CharField(max_length=255, null=True, blank=True)
     tags = models.ManyToManyField(Tag, through=PatchTag)
+    # denormalised from 'tags' so list views can show the counts without
+    # querying PatchTag for each patch
+    tag_counts = TagCountsField(default=dict, editable=False)
+    # denormalised from 'check_set': the latest check of each context for
+    # each user, keyed by '<user ID>:<context>', and their combined state
+    check_summary = JSONField(default=dict, editable=False)
+    check_state = models.SmallIntegerField(default=0, editable=False)
 
     # patchwork metadata
 
@@ -419,48 +596,138 @@ class Patch(Submission):
 
     objects = PatchManager()
 
+    # fields updated in place as tags and checks are received, which are
+    # only written by save() if they have been modified on the instance
+    MAINTAINED_FIELDS = ('tag_counts', 'check_summary', 'check_state')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Patch, cls).from_db(db, field_names, values)
+        instance._loaded_maintained = instance._get_maintained()
+        return instance
+
+    def _get_maintained(self):
+        # copied, as the summaries may be modified in place
+        return {name: copy.deepcopy(self.__dict__[name])
+                for name in self.MAINTAINED_FIELDS if name in self.__dict__}
+
+    def _set_maintained(self, **values):
+        """Set maintained fields which have already been stored."""
+        for name, value in values.items():
+            setattr(self, name, value)
+        loaded = getattr(self, '_loaded_maintained', {})
+        loaded.update(copy.deepcopy(values))
+        self._loaded_maintained = loaded
+
+    def _maintained_changed(self):
+        loaded = getattr(self, '_loaded_maintained', {})
+        return [name for name, value in self._get_maintained().items()
+                if name not in loaded or loaded[name] != value]
+
     @staticmethod
     def extract_tags(content, tags):
         counts = Counter()
 
         for tag in tags:
-            regex = re.compile(tag.pattern, re.MULTILINE | re.IGNORECASE)
-            counts[tag] = len(regex.findall(content))
+            counts[tag] = len(tag.regex.findall(content))
 
         return counts
 
-    def _set_tag(self, tag, count):
-        if count == 0:
-            self.patchtag_set.filter(tag=tag).delete()
+    def _update_tag(self, tag, count):
+        patchtags = self.patchtag_set.filter(tag=tag)
+        if patchtags.update(count=models.F('count') + count):
+            if count < 0:
+                patchtags.filter(count__lte=0).delete()
             return
-        patchtag, _ = PatchTag.objects.get_or_create(patch=self, tag=tag)
-        if patchtag.count != count:
-            patchtag.count = count
-            patchtag.save()
 
-    def refresh_tag_counts(self):
-        tags = self.project.tags
-        counter = Counter()
+        if count < 0:
+            return
+
+        try:
+            with transaction.atomic():
+                PatchTag.objects.create(patch=self, tag=tag, count=count)
+        except IntegrityError:
+            # we lost a race with another process adding the same tag
+            patchtags.update(count=models.F('count') + count)
+
+    def _update_tag_counts(self, content, sign):
+        if getattr(_deferred_tag_refresh, 'patch_ids', None) is not None:
+            _deferred_tag_refresh.patch_ids[self.id] = True
+            return
 
-        if self.content:
-            counter += self.extract_tags(self.content, tags)
+        if not content:
+            return
 
-        for comment in self.comments.all():
-            counter = counter + self.extract_tags(comment.content, tags)
+        with phase('tags'):
+            counter = self.extract_tags(content, self.project.tags)
+            counter = {tag: count for tag, count in counter.items() if count}
+            if not counter:
+                return
 
-        for tag in tags:
-            self._set_tag(tag, counter[tag])
+            for tag, count in counter.items():
+                self._update_tag(tag, sign * count)
+
+            self._set_maintained(tag_counts=dict(
+                self.patchtag_set.values_list('tag_id', 'count')))
+            Patch.objects.filter(id=self.id).update(
+                tag_counts=self.tag_counts)
+
+    def add_tag_counts(self, content):
+        """Add the tags found in some new content to the tag counts.
+
+        This allows the tag counts to be kept up-to-date as comments are
+        received without rescanning the patch and all of its comments.
+        """
+        self._update_tag_counts(content, 1)
+
+    def remove_tag_counts(self, content):
+        """Remove the tags found in some deleted content from the counts."""
+        self._update_tag_counts(content, -1)
+
+    def refresh_tag_counts(self):
+        """Recalculate the tag counts from the patch and all its comments."""
+        if getattr(_deferred_tag_refresh, 'patch_ids', None) is not None:
+            _deferred_tag_refresh.patch_ids[self.id] = True
+            return
+
+        tag_counts = Patch.objects.refresh_tag_counts([self.id])
+        if self.id in tag_counts:
+            self._set_maintained(tag_counts=tag_counts[self.id])
 
     def save(self, *args, **kwargs):
         if not hasattr(self, 'state') or not self.state:
             self.state = get_default_initial_patch_state()
 
-        if self.hash is None and self.diff is not None:
+        # the hash can only change along with the diff, so avoid loading the
+        # body if it hasn't been
+        body_changed = self._state.adding or self._body_changed
+        if self.hash is None and body_changed and self.diff is not None:
             self.hash = hash_diff(self.diff)
 
+        adding = self._state.adding
+        content_changed = self._content_changed()
+
+        if not adding and kwargs.get('update_fields') is None:
+            # the tag counts and check summary are maintained separately, so
+            # avoid overwriting them with what may be a stale copy unless
+            # they have been modified
+            deferred = self.get_deferred_fields()
+            skipped = set(self.MAINTAINED_FIELDS) - set(
+                self._maintained_changed())
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and
+                field.name not in skipped]
+
         super(Patch, self).save(**kwargs)
+        self._loaded_maintained = self._get_maintained()
 
-        self.refresh_tag_counts()
+        # a new patch can't have any comments yet, so only its own content
+        # needs to be scanned
+        if adding:
+            self.add_tag_counts(self.content)
+        elif content_changed:
+            self.refresh_tag_counts()
 
     def is_editable(self, user):
         if not user.is_authenticated:
@@ -471,6 +738,65 @@ class Patch(Submission):
 
         return self.project.is_editable(user)
 
+    @staticmethod
+    def _add_check_to_summary(summary, check_id, user_id, context, state,
+                              date):
+        key = '%d:%s' % (user_id, context)
+
+        latest = summary.get(key)
+        if latest and (parse_datetime(latest['date']), latest['id']) > (
+                date, check_id):
+            # recheck condition - ignore the older result
+            return
+
+        summary[key] = {'id': check_id, 'state': state,
+                        'date': date.isoformat()}
+
+    def _lock_check_summary(self):
+        # lock the patch, so a check created concurrently isn't lost
+        return Patch.objects.select_for_update().filter(
+            id=self.id).values_list('check_summary', flat=True).first()
+
+    def _save_check_summary(self, summary):
+        states = set(entry['state'] for entry in summary.values())
+
+        check_state = Check.STATE_SUCCESS if states else Check.STATE_PENDING
+        for state in [Check.STATE_FAIL, Check.STATE_WARNING,
+                      Check.STATE_PENDING]:  # order sensitive
+            if state in states:
+                check_state = state
+                break
+
+        self._set_maintained(check_summary=summary, check_state=check_state)
+        Patch.objects.filter(id=self.id).update(
+            check_summary=self.check_summary, check_state=self.check_state)
+        # the latest checks may have changed
+        self.__dict__.pop('checks', None)
+
+    def add_check(self, check):
+        """Add a newly created check to the check summary.
+
+        This allows the summary to be kept up-to-date as checks are
+        received without looking at every previous check.
+        """
+        with transaction.atomic():
+            summary = self._lock_check_summary() or {}
+            self._add_check_to_summary(summary, check.id, check.user_id,
+                                       check.context, check.state,
+                                       check.date)
+            self._save_check_summary(summary)
+
+    def refresh_check_summary(self):
+        """Recalculate the check summary from all checks."""
+        with transaction.atomic():
+            self._lock_check_summary()
+
+            summary = {}
+            for values in self.check_set.order_by('id').values_list(
+                    'id', 'user_id', 'context', 'state', 'date'):
+                self._add_check_to_summary(summary, *values)
+            self._save_check_summary(summary)
+
     @property
     def combined_check_state(self):
         """Return the combined state for all checks.
@@ -485,21 +811,12 @@ class Patch(Submission):
               Check reports as pending
           * success, if latest checks for all contexts reports as
               success
-        """
-        state_names = dict(Check.STATE_CHOICES)
-        states = [check.state for check in self.checks]
-
-        if not states:
-            return state_names[Check.STATE_PENDING]
-
-        for state in [Check.STATE_FAIL, Check.STATE_WARNING,
-                      Check.STATE_PENDING]:  # order sensitive
-            if state in states:
-                return state_names[state]
 
-        return state_names[Check.STATE_SUCCESS]
+        This is maintained as checks are created, so no queries are made.
+        """
+        return dict(Check.STATE_CHOICES)[self.check_state]
 
-    @property
+    @cached_property
     def checks(self):
         """Return the list of unique checks.
 
@@ -510,38 +827,15 @@ class Patch(Submission):
         one counted regardless of its value. The end result will be a
         association of types to number of unique checks for said
         type.
+
+        The checks are loaded once for each instance, and again after the
+        check summary is updated through it.
         """
-        unique = {}
-        duplicates = []
-
-        for check in self.check_set.all():
-            ctx = check.context
-            user = check.user_id
-
-            if user in unique and ctx in unique[user]:
-                # recheck condition - ignore the older result
-                if unique[user][ctx].date > check.date:
-                    duplicates.append(check.id)
-                    continue
-                duplicates.append(unique[user][ctx].id)
-
-            if user not in unique:
-                unique[user] = {}
-
-            unique[user][ctx] = check
-
-        # filter out the "duplicates" or older, now-invalid results
-
-        # Why don't we use filter or exclude here? Surprisingly, it's
-        # an optimisation in the common case. Where we're looking at
-        # checks in anything that uses a generic_list() in the view,
-        # we do a prefetch_related('check_set'). But, if we then do a
-        # .filter or a .exclude, that throws out the existing, cached
-        # information, and does another query. (See the Django docs on
-        # prefetch_related.) So, do it 'by hand' in Python. We can
-        # also be confident that this won't be worse, seeing as we've
-        # just iterated over self.check_set.all() *anyway*.
-        return [c for c in self.check_set.all() if c.id not in duplicates]
+        ids = [entry['id'] for entry in self.check_summary.values()]
+        if not ids:
+            return []
+
+        return list(self.check_set.filter(id__in=ids).order_by('id'))
 
     @property
     def check_count(self):
@@ -553,11 +847,13 @@ class Patch(Submission):
         same 'context', the newest check is the only one counted
         regardless of its value. The end result will be a association
         of types to number of unique checks for said type.
+
+        This is calculated from the check summary, so no queries are made.
         """
         counts = {key: 0 for key, _ in Check.STATE_CHOICES}
 
-        for check in self.checks:
-            counts[check.state] += 1
+        for entry in self.check_summary.values():
+            counts[entry['state']] += 1
 
         return counts
 
@@ -590,18 +886,32 @@ class Comment(EmailMixin, models.Model):
                                    related_query_name='comment',
                                    on_delete=models.CASCADE)
 
+    # content
+
+    headers = CompressedTextField(blank=True)
+    content = CompressedTextField(null=True, blank=True)
+
     def get_absolute_url(self):
         return reverse('comment-redirect', kwargs={'comment_id': self.id})
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
+        content_changed = self._content_changed()
+
         super(Comment, self).save(*args, **kwargs)
-        if hasattr(self.submission, 'patch'):
+
+        if not content_changed or not hasattr(self.submission, 'patch'):
+            return
+
+        if adding:
+            self.submission.patch.add_tag_counts(self.content)
+        else:
             self.submission.patch.refresh_tag_counts()
 
     def delete(self, *args, **kwargs):
         super(Comment, self).delete(*args, **kwargs)
         if hasattr(self.submission, 'patch'):
-            self.submission.patch.refresh_tag_counts()
+            self.submission.patch.remove_tag_counts(self.content)
 
     def is_editable(self, user):
         return False
@@ -742,13 +1052,26 @@ class SeriesReference(models.Model):
     series = models.ForeignKey(Series, related_name='references',
                                related_query_name='reference',
                                on_delete=models.CASCADE)
+    # denormalised from the series so references can be looked up without
+    # joining through it
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
     msgid = models.CharField(max_length=255)
 
+    def save(self, *args, **kwargs):
+        if self.project_id is None:
+            self.project_id = self.series.project_id
+
+        super(SeriesReference, self).save(*args, **kwargs)
+
     def __str__(self):
         return self.msgid
 
     class Meta:
         unique_together = [('series', 'msgid')]
+        indexes = [
+            models.Index(fields=['project', 'msgid'],
+                         name='seriesref_project_msgid_idx'),
+        ]
 
 
 class Bundle(models.Model):
@@ -842,6 +1165,20 @@ class Check(models.Model):
         help_text='A label to discern check from checks of other testing '
         'systems.')
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+
+        super(Check, self).save(*args, **kwargs)
+
+        if adding:
+            self.patch.add_check(self)
+        else:
+            self.patch.refresh_check_summary()
+
+    def delete(self, *args, **kwargs):
+        super(Check, self).delete(*args, **kwargs)
+        self.patch.refresh_check_summary()
+
     def __repr__(self):
         return "<Check id='%d' context='%s' state='%s'" % (
             self.id, self.context, self.get_state_display())
@@ -900,6 +1237,10 @@ class Event(models.Model):
     date = models.DateTimeField(
         default=datetime.datetime.utcnow,
         help_text='The time this event was created.')
+    # set once the transaction creating the event commits. Unlike the ID,
+    # this follows the order in which events became visible
+    sequence = models.PositiveIntegerField(
+        null=True, blank=True, db_index=True, editable=False)
 
     # event object
 
@@ -951,6 +1292,24 @@ class Event(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # These are used when listing the events for a project, possibly
+            # of a given category, and when removing a project's old events
+            models.Index(fields=['project', 'date'],
+                         name='event_project_date_idx'),
+            models.Index(fields=['project', 'category', 'date'],
+                         name='event_project_category_idx'),
+        ]
+
+
+class EventSequence(models.Model):
+    """The last sequence number given to committed events.
+
+    There is a single row, which is locked while numbering events so that
+    the numbers become visible in order.
+    """
+
+    value = models.PositiveIntegerField(default=0)
 
 
 class EmailConfirmation(models.Model):
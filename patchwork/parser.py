@@ -3,6 +3,7 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from collections import OrderedDict
 import codecs
 import datetime
 from email.header import decode_header
@@ -10,16 +11,28 @@ from email.header import make_header
 from email.utils import mktime_tz
 from email.utils import parsedate_tz
 from email.errors import HeaderParseError
-from fnmatch import fnmatch
+import fnmatch
 import logging
+from operator import itemgetter
+import os
 import re
+import threading
+import time
 
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.db.utils import IntegrityError
 from django.utils import six
 
+from patchwork import downloads
+from patchwork.hasher import DiffScanner
 from patchwork.models import Comment
 from patchwork.models import CoverLetter
+from patchwork.models import defer_tag_refresh
 from patchwork.models import DelegationRule
 from patchwork.models import get_default_initial_patch_state
 from patchwork.models import Patch
@@ -29,14 +42,22 @@ from patchwork.models import Series
 from patchwork.models import SeriesReference
 from patchwork.models import State
 from patchwork.models import Submission
+from patchwork.models import Tag
+from patchwork.signals import defer_events
+from patchwork.stats import parsing_mail
+from patchwork.stats import phase
 
 
 _hunk_re = re.compile(r'^\@\@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? \@\@')
-_filename_re = re.compile(r'^(---|\+\+\+) (\S+)')
 list_id_headers = ['List-ID', 'X-Mailing-List', 'X-list']
 
 SERIES_DELAY_INTERVAL = 10
 
+# how long, in seconds, to cache projects, states and delegates for
+CACHE_TTL = 300
+# how many message IDs to cache, if enabled
+MSGID_CACHE_SIZE = 4096
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,6 +67,140 @@ class DuplicateMailError(Exception):
         self.msgid = msgid
 
 
+class _LRUCache(object):
+    """A thread-safe LRU cache whose entries expire after 'ttl' seconds.
+
+    This is used to avoid looking up the same projects, states and
+    delegates for every mail parsed by a long-running process. Caches are
+    cleared whenever the underlying models are saved or deleted.
+    """
+
+    def __init__(self, maxsize=128, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, key, func):
+        """Return the value for 'key', calling 'func' to find it if needed."""
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry and entry[1] > now:
+                self._entries[key] = entry
+                return entry[0]
+            generation = self._generation
+
+        value = func()
+
+        with self._lock:
+            # don't store values looked up before the cache was cleared,
+            # as they may already be stale
+            if generation == self._generation:
+                self._entries[key] = (value, now + self.ttl)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        return value
+
+    def peek(self, key):
+        """Return the value for 'key' if cached, else None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry and entry[1] > time.time():
+                self._entries[key] = entry
+                return entry[0]
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+_project_cache = _LRUCache()
+_state_cache = _LRUCache()
+_delegate_cache = _LRUCache()
+_delegation_rule_cache = _LRUCache()
+# maps (project ID, message ID) to the ID of the submission replies to that
+# message should be attached to. This is disabled unless
+# 'enable_msgid_cache' is called.
+_msgid_cache = None
+
+
+def enable_msgid_cache(maxsize=MSGID_CACHE_SIZE):
+    """Cache the submission that each message ID belongs to.
+
+    This is intended for long-running processes, such as the LMTP daemon,
+    where replies to recently received mails can then be attached to the
+    correct submission without searching for every message they reference.
+    Only submission IDs are cached, and the submission is still fetched
+    when it's used, so submissions deleted by other processes are noticed.
+    """
+    global _msgid_cache
+    _msgid_cache = _LRUCache(maxsize=maxsize)
+
+
+def _cache_msgid(project, msgid, submission):
+    if _msgid_cache is None:
+        return
+
+    key = (project.id, msgid[:255])
+    submission_id = submission.id
+    # don't cache anything that may yet be rolled back
+    transaction.on_commit(lambda: _msgid_cache.set(key, submission_id))
+
+
+def clear_caches():
+    """Clear all cached projects, states, delegates and message IDs."""
+    for cache in (_project_cache, _state_cache, _delegate_cache,
+                  _delegation_rule_cache, _msgid_cache):
+        if cache is not None:
+            cache.clear()
+
+
+@receiver([post_save, post_delete], sender=Project)
+@receiver([post_save, post_delete], sender=Tag)
+def _clear_project_cache(sender, **kwargs):
+    _project_cache.clear()
+    _delegation_rule_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=State)
+def _clear_state_cache(sender, **kwargs):
+    _state_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=User)
+def _clear_delegate_cache(sender, **kwargs):
+    _delegate_cache.clear()
+    _delegation_rule_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=DelegationRule)
+def _clear_delegation_rule_cache(sender, **kwargs):
+    _delegation_rule_cache.clear()
+
+
+@receiver(post_delete, sender=Submission)
+@receiver(post_delete, sender=Comment)
+def _clear_msgid_cache(sender, **kwargs):
+    if _msgid_cache is not None:
+        _msgid_cache.clear()
+
+
 def normalise_space(value):
     value = ''.join(re.split(r'\n\s+', value))
     whitespace_re = re.compile(r'\s+')
@@ -157,13 +312,17 @@ def find_project_by_id_and_subject(list_id, subject):
     given `list_id` and empty `subject_match` field serves as a default
     (in case it exists) if no other match is found.
     """
-    projects = Project.objects.filter(listid=list_id)
+    def _get_projects():
+        return [(project, re.compile(project.subject_match,
+                                     re.MULTILINE | re.IGNORECASE)
+                 if project.subject_match else None)
+                for project in Project.objects.filter(listid=list_id)]
+
     default = None
-    for project in projects:
-        if not project.subject_match:
+    for project, subject_re in _project_cache.get(list_id, _get_projects):
+        if not subject_re:
             default = project
-        elif re.search(project.subject_match, subject,
-                       re.MULTILINE | re.IGNORECASE):
+        elif subject_re.search(subject):
             return project
 
     return default
@@ -240,19 +399,39 @@ def _find_series_by_references(project, mail):
     h = clean_header(mail.get('Message-Id'))
     if h:
         refs = [h] + refs
+    refs = [ref[:255] for ref in refs]
+    if not refs:
+        return
+
+    series_refs = _find_series_references(project, refs)
     for ref in refs:
-        try:
-            return SeriesReference.objects.get(
-                msgid=ref[:255], series__project=project).series
-        except SeriesReference.DoesNotExist:
-            continue
-        except SeriesReference.MultipleObjectsReturned:
+        if ref in series_refs:
+            return series_refs[ref].series
+
+
+def _find_series_references(project, msgids):
+    """Find the references for a set of message IDs in a single query.
+
+    Args:
+        project (patchwork.Project): The project the references belong to
+        msgids (list): The message IDs to look for
+
+    Returns:
+        A dict mapping each message ID found to its ``SeriesReference``
+    """
+    series_refs = {}
+    for series_ref in SeriesReference.objects.filter(
+            project=project, msgid__in=set(msgids)).select_related(
+                'series').order_by('id'):
+        if series_ref.msgid in series_refs:
             # FIXME: Open bug: this can happen when we're processing
             # messages in parallel. Pick the first and log.
             logger.error("Multiple SeriesReferences for %s in project %s!" %
-                         (ref[:255], project.name))
-            return SeriesReference.objects.filter(
-                msgid=ref[:255], series__project=project).first().series
+                         (series_ref.msgid, project.name))
+            continue
+        series_refs[series_ref.msgid] = series_ref
+
+    return series_refs
 
 
 def _find_series_by_markers(project, mail, author):
@@ -544,24 +723,42 @@ def _find_content(mail):
 
 def find_patch_content(mail):
     """Extract a comment and potential diff from a mail."""
+    patchbuf, commentbuf, _ = _find_patch_content(mail)
+    return patchbuf, commentbuf
+
+
+def _find_patch_content(mail):
+    """Extract a comment and potential diff from a mail, and scan the diff.
+
+    Returns:
+        A tuple containing the diff, comment and a finished
+        ``DiffScanner`` for the diff, or None if there's no diff.
+    """
     patchbuf = None
     commentbuf = ''
+    scanner = None
 
     for payload, subtype in _find_content(mail):
         if subtype in ['x-patch', 'x-diff']:
             patchbuf = payload
+            scanner = DiffScanner()
+            scanner.update(payload)
+            scanner.finish()
         elif subtype == 'plain':
             c = payload
 
             if not patchbuf:
-                patchbuf, c = parse_patch(payload)
+                patchbuf, c, scanner = _scan_patch(payload)
 
             if c is not None:
                 commentbuf += c.strip() + '\n'
 
     commentbuf = clean_content(commentbuf)
 
-    return patchbuf, commentbuf
+    if patchbuf is None:
+        scanner = None
+
+    return patchbuf, commentbuf, scanner
 
 
 def find_comment_content(mail):
@@ -583,43 +780,100 @@ def find_comment_content(mail):
     return None, commentbuf
 
 
-def find_submission_for_comment(project, refs):
+def find_submission_for_comment(project, refs, pending_comments=None):
+    """Find the submission that a comment is a reply to.
+
+    References are checked in order, with the first that matches either
+    a submission or a comment on a submission being used. All references
+    are looked up using at most two queries.
+
+    Args:
+        project (patchwork.Project): The project the submission belongs to
+        refs (list): The message IDs the comment refers to, most recent
+            first
+        pending_comments (_PendingComments): Comments from the current
+            batch that have yet to be saved
+
+    Returns:
+        The matching ``Submission`` instance, if any
+    """
+    all_refs = refs = [ref[:255] for ref in refs]
+
+    # if message IDs are being cached, we only need to look up those refs
+    # that precede the first one we already know about
+    cached_ref = cached_id = cached = None
+    if _msgid_cache is not None:
+        for i, ref in enumerate(refs):
+            cached_id = _msgid_cache.peek((project.id, ref))
+            if cached_id:
+                cached_ref = ref
+                refs = refs[:i]
+                break
+
+    submissions = {}
+    comments = {}
+
+    # first, check for a direct reply. The submission we know about is
+    # fetched along with these, as another process may have deleted it.
+    if refs or cached_id:
+        query = Q(msgid__in=refs)
+        if cached_id:
+            query |= Q(id=cached_id)
+        for submission in Submission.objects.filter(query, project=project):
+            if submission.id == cached_id:
+                cached = submission
+            if submission.msgid in refs:
+                submissions[submission.msgid] = submission
+
+    # then, see if we have comments that refer to a submission. We only need
+    # to check refs that precede the first direct reply.
+    comment_refs = refs
+    for i, ref in enumerate(refs):
+        if ref in submissions:
+            comment_refs = refs[:i]
+            break
+
+    if comment_refs:
+        for comment in Comment.objects.filter(
+                submission__project=project,
+                msgid__in=comment_refs).select_related('submission'):
+            # NOTE(stephenfin): Multiple comments with the same message ID
+            # are an artifact of prior lack of support for cover letters in
+            # Patchwork. Previously all replies to patches were saved as
+            # comments. However, it's possible that someone could have
+            # created a new series as a reply to one of the comments on the
+            # original patch series. For example, '2015-November/002096.html'
+            # from the Patchwork archives. In this case, reparsing the
+            # archives will result in creation of a cover letter with the
+            # same message ID as the existing comment. Follow up comments
+            # will then apply to both this cover letter and the linked patch
+            # from the comment previously created. We choose to apply the
+            # comment to the cover letter, which will be the latter item.
+            # Note that this only happens when running 'parsearchive' or
+            # similar, so it should not affect every day use in any way.
+            comments[comment.msgid] = comment.submission
+
     for ref in refs:
-        ref = ref[:255]
-        # first, check for a direct reply
-        try:
-            submission = Submission.objects.get(project=project, msgid=ref)
+        submission = submissions.get(ref) or comments.get(ref)
+        if submission:
+            if _msgid_cache is not None:
+                _msgid_cache.set((project.id, ref), submission.id)
             return submission
-        except Submission.DoesNotExist:
-            pass
 
-        # see if we have comments that refer to a patch
-        try:
-            comment = Comment.objects.get(submission__project=project,
-                                          msgid=ref)
-            return comment.submission
-        except Comment.MultipleObjectsReturned:
-            # NOTE(stephenfin): This is a artifact of prior lack of support
-            # for cover letters in Patchwork. Previously all replies to
-            # patches were saved as comments. However, it's possible that
-            # someone could have created a new series as a reply to one of the
-            # comments on the original patch series. For example,
-            # '2015-November/002096.html' from the Patchwork archives. In this
-            # case, reparsing the archives will result in creation of a cover
-            # letter with the same message ID as the existing comment. Follow
-            # up comments will then apply to both this cover letter and the
-            # linked patch from the comment previously created. We choose to
-            # apply the comment to the cover letter. Note that this only
-            # happens when running 'parsearchive' or similar, so it should not
-            # affect every day use in any way.
-            comments = Comment.objects.filter(submission__project=project,
-                                              msgid=ref)
-            # The latter item will be the cover letter
-            return comments.reverse()[0].submission
-        except Comment.DoesNotExist:
-            pass
+        # finally, see if we have comments from the current batch
+        if pending_comments is not None:
+            submission = pending_comments.find(project, ref)
+            if submission:
+                return submission
 
-    return None
+    if cached_id and not cached:
+        # the submission has been deleted, so forget it and look up the
+        # remaining refs
+        _msgid_cache.delete((project.id, cached_ref))
+        return find_submission_for_comment(project, all_refs,
+                                           pending_comments)
+
+    return cached
 
 
 def split_prefixes(prefix):
@@ -717,9 +971,6 @@ def clean_content(content):
 def parse_patch(content):
     """Split a mail's contents into a diff and comment.
 
-    This is a state machine that takes a patch, generally in UNIX mbox
-    format, and splits it into the component comments and diff.
-
     Args:
         patch: The patch to be split
 
@@ -730,7 +981,30 @@ def parse_patch(content):
     Raises:
         Exception: The state machine transitioned to an invalid state.
     """
-    patchbuf = ''
+    patchbuf, commentbuf, _ = _scan_patch(content)
+    return patchbuf, commentbuf
+
+
+def _scan_patch(content):
+    """Split a mail's contents into a diff and comment, and scan the diff.
+
+    This is a state machine that takes a patch, generally in UNIX mbox
+    format, and splits it into the component comments and diff. The diff
+    is passed to a ``DiffScanner`` as it's found, so that its hash and the
+    files it changes are available without scanning it again.
+
+    Args:
+        patch: The patch to be split
+
+    Returns:
+        A tuple containing the diff, comment and a finished
+        ``DiffScanner`` for the diff. Either one or both of the diff and
+        comment can be empty, in which case the scanner is also empty.
+
+    Raises:
+        Exception: The state machine transitioned to an invalid state.
+    """
+    patchbuf = []
     commentbuf = ''
     buf = ''
 
@@ -764,6 +1038,12 @@ def parse_patch(content):
     lc = (0, 0)
     hunk = 0
 
+    scanner = DiffScanner()
+
+    def add_to_patch(text):
+        patchbuf.append(text)
+        scanner.update(text)
+
     for line in content.split('\n'):
         line += '\n'
 
@@ -807,16 +1087,16 @@ def parse_patch(content):
                 lc = [fn(x) for x in match.groups()]
 
                 state = 4
-                patchbuf += buf + line
+                add_to_patch(buf + line)
                 buf = ''
             elif line.startswith('--- '):
-                patchbuf += buf + line
+                add_to_patch(buf + line)
                 buf = ''
                 state = 2
             elif hunk and line.startswith(r'\ No newline at end of file'):
                 # If we had a hunk and now we see this, it's part of the patch,
                 # and we're still expecting another @@ line.
-                patchbuf += line
+                add_to_patch(line)
             elif hunk:
                 state = 1
                 buf += line
@@ -836,7 +1116,7 @@ def parse_patch(content):
                 lc[0] -= 1
                 lc[1] -= 1
 
-            patchbuf += line
+            add_to_patch(line)
 
             if lc[0] <= 0 and lc[1] <= 0:
                 state = 3
@@ -846,10 +1126,10 @@ def parse_patch(content):
         elif state == 6:
             if line.startswith(('rename to ', 'rename from ',
                                 'new file mode ', 'index ')):
-                patchbuf += buf + line
+                add_to_patch(buf + line)
                 buf = ''
             elif line.startswith('--- '):
-                patchbuf += buf + line
+                add_to_patch(buf + line)
                 buf = ''
                 state = 2
             else:
@@ -860,13 +1140,16 @@ def parse_patch(content):
 
     commentbuf += buf
 
+    scanner.finish()
+
+    patchbuf = ''.join(patchbuf)
     if patchbuf == '':
         patchbuf = None
 
     if commentbuf == '':
         commentbuf = None
 
-    return patchbuf, commentbuf
+    return patchbuf, commentbuf, scanner
 
 
 def parse_pull_request(content):
@@ -882,29 +1165,76 @@ def parse_pull_request(content):
 
 def find_state(mail):
     """Return the state with the given name or the default."""
-    state_name = clean_header(mail.get('X-Patchwork-State', ''))
-    if state_name:
+    def _get_state():
         try:
             return State.objects.get(name__iexact=state_name)
         except State.DoesNotExist:
-            pass
-    return get_default_initial_patch_state()
+            return None
+
+    state_name = clean_header(mail.get('X-Patchwork-State', ''))
+    if state_name:
+        state = _state_cache.get(state_name.lower(), _get_state)
+        if state:
+            return state
+
+    # the default state is cached using a key no state name can match
+    return _state_cache.get(None, get_default_initial_patch_state)
+
+
+class _DelegationRuleMatcher(object):
+    """Match filenames against a project's delegation rules.
+
+    Rules are compiled once and indexed by the literal prefix of their
+    pattern, i.e. everything before the first wildcard. Only rules whose
+    prefix the filename starts with can match it, so a filename need only
+    be checked against a handful of rules rather than, as with calling
+    ``fnmatch`` for each rule in turn, every one of them.
+    """
+
+    def __init__(self, rules):
+        self._rules = {}
+
+        for index, rule in enumerate(rules):
+            path = os.path.normcase(rule.path)
+            prefix = re.split(r'[*?[]', path, 1)[0]
+            regex = re.compile(fnmatch.translate(path))
+            self._rules.setdefault(prefix, []).append(
+                (index, regex.match, rule.user))
+
+        self._lengths = sorted(set(len(prefix) for prefix in self._rules))
+
+    def match(self, filename):
+        """Return the delegate for the given filename, if any."""
+        filename = os.path.normcase(filename)
+
+        candidates = []
+        for length in self._lengths:
+            if length > len(filename):
+                break
+            candidates.extend(self._rules.get(filename[:length], []))
+
+        # rules are indexed in order of priority
+        for _, match, user in sorted(candidates, key=itemgetter(0)):
+            if match(filename):
+                return user
+
+        return None
 
 
 def find_delegate_by_filename(project, filenames):
     if not filenames:
         return None
 
-    rules = list(DelegationRule.objects.filter(project=project))
+    def _get_matcher():
+        return _DelegationRuleMatcher(list(DelegationRule.objects.filter(
+            project=project).select_related('user')))
+
+    matcher = _delegation_rule_cache.get(project.id, _get_matcher)
 
     patch_delegate = None
 
     for filename in filenames:
-        file_delegate = None
-        for rule in rules:
-            if fnmatch(filename, rule.path):
-                file_delegate = rule.user
-                break
+        file_delegate = matcher.match(filename)
 
         if file_delegate is None:
             return None
@@ -919,16 +1249,122 @@ def find_delegate_by_filename(project, filenames):
 
 def find_delegate_by_header(mail):
     """Return the delegate with the given email or None."""
-    delegate_email = clean_header(mail.get('X-Patchwork-Delegate', ''))
-    if delegate_email:
+    def _get_delegate():
         try:
             return User.objects.get(email__iexact=delegate_email)
         except User.DoesNotExist:
-            pass
+            return None
+
+    delegate_email = clean_header(mail.get('X-Patchwork-Delegate', ''))
+    if delegate_email:
+        return _delegate_cache.get(delegate_email.lower(), _get_delegate)
 
     return None
 
 
+class _PendingComments(object):
+    """Comments parsed as part of a batch, awaiting insertion."""
+
+    def __init__(self):
+        self.comments = OrderedDict()
+
+    def find(self, project, msgid):
+        for comment in reversed(self.comments.values()):
+            if (comment.msgid == msgid and
+                    comment.submission.project_id == project.id):
+                return comment.submission
+
+    def add(self, comment):
+        key = (comment.submission.id, comment.msgid)
+        if key in self.comments or Comment.objects.filter(
+                submission=comment.submission, msgid=comment.msgid).exists():
+            raise DuplicateMailError(msgid=comment.msgid)
+
+        # this is usually handled by 'Comment.save'
+        comment.content = comment.content.replace('\r\n', '\n')
+
+        self.comments[key] = comment
+
+    def flush(self):
+        """Save all pending comments.
+
+        Returns:
+            A list of the comments that were found to be duplicates.
+        """
+        comments = list(self.comments.values())
+        self.comments.clear()
+
+        duplicates = []
+
+        try:
+            with transaction.atomic():
+                Comment.objects.bulk_create(comments)
+        except IntegrityError:
+            # we've lost a race with another process. Fall back to saving
+            # comments one at a time to find out which.
+            for comment in comments:
+                try:
+                    with transaction.atomic():
+                        comment.save()
+                except IntegrityError:
+                    duplicates.append(comment)
+            return duplicates
+
+        # this is usually handled by the 'post_save' signal
+        downloads.invalidate(
+            set(comment.submission_id for comment in comments))
+
+        for comment in comments:
+            if hasattr(comment.submission, 'patch'):
+                comment.submission.patch.add_tag_counts(comment.content)
+
+        return duplicates
+
+
+def parse_mail_batch(mails, list_id=None):
+    """Parse a batch of mails and add to the database.
+
+    This has the same semantics as calling ``parse_mail`` for each mail
+    in turn, but all mails are saved in a single transaction. Comments
+    and events are saved using bulk inserts, and the tag counts of each
+    patch are refreshed only once, at the end of the batch.
+
+    Args:
+        mails (list of `mbox.Mail`): Mails to parse and add.
+        list_id (str): Mailing list ID
+
+    Returns:
+        A list containing a result for each mail, in order. This is
+        either the value that ``parse_mail`` would return, or the
+        exception that it would raise.
+    """
+    results = []
+    pending_comments = _PendingComments()
+
+    with phase('other'), transaction.atomic():
+        with defer_tag_refresh(), defer_events() as events:
+            for mail in mails:
+                # discard the events raised by any mail that fails
+                mark = len(events)
+                try:
+                    with parsing_mail(mail), transaction.atomic():
+                        result = _parse_mail(mail, list_id, pending_comments)
+                except Exception as exc:
+                    del events[mark:]
+                    result = exc
+
+                results.append(result)
+
+            with phase('create'):
+                duplicates = pending_comments.flush()
+
+    for i, result in enumerate(results):
+        if any(result is duplicate for duplicate in duplicates):
+            results[i] = DuplicateMailError(msgid=result.msgid)
+
+    return results
+
+
 def parse_mail(mail, list_id=None):
     """Parse a mail and add to the database.
 
@@ -946,6 +1382,11 @@ def parse_mail(mail, list_id=None):
         ValueError if there is an error in parsing or a duplicate mail
         Other truly unexpected issues may bubble up from the DB.
     """
+    with phase('other'), parsing_mail(mail):
+        return _parse_mail(mail, list_id)
+
+
+def _parse_mail(mail, list_id=None, pending_comments=None):
     # some basic sanity checks
     if 'From' not in mail:
         raise ValueError("Missing 'From' header")
@@ -961,7 +1402,8 @@ def parse_mail(mail, list_id=None):
         logger.info("Ignoring email due to 'ignore' hint")
         return
 
-    project = find_project(mail, list_id)
+    with phase('project'):
+        project = find_project(mail, list_id)
 
     if project is None:
         logger.error('Failed to find a project for email')
@@ -969,110 +1411,122 @@ def parse_mail(mail, list_id=None):
 
     # parse metadata
 
-    msgid = clean_header(mail.get('Message-Id'))
-    if not msgid:
-        raise ValueError("Broken 'Message-Id' header")
-    msgid = msgid[:255]
-
-    subject = mail.get('Subject')
-    name, prefixes = clean_subject(subject, [project.linkname])
-    is_comment = subject_check(subject)
-    x, n = parse_series_marker(prefixes)
-    version = parse_version(name, prefixes)
-    refs = find_references(mail)
-    date = find_date(mail)
-    headers = find_headers(mail)
+    with phase('metadata'):
+        msgid = clean_header(mail.get('Message-Id'))
+        if not msgid:
+            raise ValueError("Broken 'Message-Id' header")
+        msgid = msgid[:255]
+
+        subject = mail.get('Subject')
+        name, prefixes = clean_subject(subject, [project.linkname])
+        is_comment = subject_check(subject)
+        x, n = parse_series_marker(prefixes)
+        version = parse_version(name, prefixes)
+        refs = find_references(mail)
+        date = find_date(mail)
+        headers = find_headers(mail)
 
     # parse content
 
-    if not is_comment:
-        diff, message = find_patch_content(mail)
-    else:
-        diff, message = find_comment_content(mail)
+    with phase('content'):
+        scanner = None
+        if not is_comment:
+            diff, message, scanner = _find_patch_content(mail)
+        else:
+            diff, message = find_comment_content(mail)
 
-    if not (diff or message):
-        return  # nothing to work with
+        if not (diff or message):
+            return  # nothing to work with
 
-    pull_url = parse_pull_request(message)
+        pull_url = parse_pull_request(message)
 
     # build objects
 
     if not is_comment and (diff or pull_url):  # patches or pull requests
         # we delay the saving until we know we have a patch.
-        author = get_or_create_author(mail)
+        with phase('author'):
+            author = get_or_create_author(mail)
 
-        delegate = find_delegate_by_header(mail)
-        if not delegate and diff:
-            filenames = find_filenames(diff)
-            delegate = find_delegate_by_filename(project, filenames)
+        with phase('delegate'):
+            delegate = find_delegate_by_header(mail)
+            if not delegate and diff:
+                delegate = find_delegate_by_filename(project,
+                                                     scanner.filenames)
 
         try:
-            patch = Patch.objects.create(
-                msgid=msgid,
-                project=project,
-                patch_project=project,
-                name=name[:255],
-                date=date,
-                headers=headers,
-                submitter=author,
-                content=message,
-                diff=diff,
-                pull_url=pull_url,
-                delegate=delegate,
-                state=find_state(mail))
+            with phase('create'):
+                patch = Patch.objects.create(
+                    msgid=msgid,
+                    project=project,
+                    patch_project=project,
+                    name=name[:255],
+                    date=date,
+                    headers=headers,
+                    submitter=author,
+                    content=message,
+                    diff=diff,
+                    hash=scanner.hexdigest() if scanner else None,
+                    pull_url=pull_url,
+                    delegate=delegate,
+                    state=find_state(mail))
             logger.debug('Patch saved')
         except IntegrityError:
             raise DuplicateMailError(msgid=msgid)
 
-        # if we don't have a series marker, we will never have an existing
-        # series to match against.
-        series = None
-        if n:
-            series = find_series(project, mail, author)
-        else:
-            x = n = 1
-
-        # We will create a new series if:
-        # - there is no existing series to assign this patch to, or
-        # - there is an existing series, but it already has a patch with this
-        #   number in it
-        if not series or Patch.objects.filter(series=series, number=x).count():
-            series = Series.objects.create(
-                project=project,
-                date=date,
-                submitter=author,
-                version=version,
-                total=n)
-
-            # NOTE(stephenfin) We must save references for series. We
-            # do this to handle the case where a later patch is
-            # received first. Without storing references, it would not
-            # be possible to identify the relationship between patches
-            # as the earlier patch does not reference the later one.
-            for ref in refs + [msgid]:
-                ref = ref[:255]
-                # we don't want duplicates
-                try:
-                    # we could have a ref to a previous series. (For
-                    # example, a series sent in reply to another
-                    # series.) That should not create a series ref
-                    # for this series, so check for the msg-id only,
-                    # not the msg-id/series pair.
-                    SeriesReference.objects.get(msgid=ref,
-                                                series__project=project)
-                except SeriesReference.DoesNotExist:
-                    SeriesReference.objects.create(series=series, msgid=ref)
-                except SeriesReference.MultipleObjectsReturned:
-                    logger.error("Multiple SeriesReferences for %s"
-                                 " in project %s!" % (ref, project.name))
-
-        # add to a series if we have found one, and we have a numbered
-        # patch. Don't add unnumbered patches (for example diffs sent
-        # in reply, or just messages with random refs/in-reply-tos)
-        if series and x:
-            # TODO(stephenfin): Remove 'series' from the conditional as we will
-            # always have a series
-            series.add_patch(patch, x)
+        _cache_msgid(project, msgid, patch)
+
+        with phase('series'):
+            # if we don't have a series marker, we will never have an existing
+            # series to match against.
+            series = None
+            if n:
+                series = find_series(project, mail, author)
+            else:
+                x = n = 1
+
+            # We will create a new series if:
+            # - there is no existing series to assign this patch to, or
+            # - there is an existing series, but it already has a patch with
+            #   this number in it
+            if not series or Patch.objects.filter(series=series,
+                                                  number=x).count():
+                series = Series.objects.create(
+                    project=project,
+                    date=date,
+                    submitter=author,
+                    version=version,
+                    total=n)
+
+                # NOTE(stephenfin) We must save references for series. We
+                # do this to handle the case where a later patch is
+                # received first. Without storing references, it would not
+                # be possible to identify the relationship between patches
+                # as the earlier patch does not reference the later one.
+                #
+                # We could have a ref to a previous series. (For example, a
+                # series sent in reply to another series.) That should not
+                # create a series ref for this series, so check for the
+                # msg-id only, not the msg-id/series pair.
+                series_refs = [ref[:255] for ref in refs + [msgid]]
+                existing_refs = set(_find_series_references(project,
+                                                            series_refs))
+                new_refs = []
+                for ref in series_refs:
+                    # we don't want duplicates
+                    if ref in existing_refs:
+                        continue
+                    existing_refs.add(ref)
+                    new_refs.append(SeriesReference(
+                        series=series, project=project, msgid=ref))
+                SeriesReference.objects.bulk_create(new_refs)
+
+            # add to a series if we have found one, and we have a numbered
+            # patch. Don't add unnumbered patches (for example diffs sent
+            # in reply, or just messages with random refs/in-reply-tos)
+            if series and x:
+                # TODO(stephenfin): Remove 'series' from the conditional as we
+                # will always have a series
+                series.add_patch(patch, x)
 
         return patch
     elif x == 0:  # (potential) cover letters
@@ -1094,107 +1548,98 @@ def parse_mail(mail, list_id=None):
                 is_cover_letter = True
 
         if is_cover_letter:
-            author = get_or_create_author(mail)
-
-            # we don't use 'find_series' here as a cover letter will
-            # always be the first item in a thread, thus the references
-            # could only point to a different series or unrelated
-            # message
-            try:
-                series = SeriesReference.objects.get(
-                    msgid=msgid, series__project=project).series
-            except SeriesReference.DoesNotExist:
-                series = None
-            except SeriesReference.MultipleObjectsReturned:
-                logger.error("Multiple SeriesReferences for %s"
-                             " in project %s!" % (msgid, project.name))
-                series = SeriesReference.objects.filter(
-                    msgid=msgid, series__project=project).first().series
-
-            if not series:
-                series = Series.objects.create(
-                    project=project,
-                    date=date,
-                    submitter=author,
-                    version=version,
-                    total=n)
-
-                # we don't save the in-reply-to or references fields
-                # for a cover letter, as they can't refer to the same
-                # series
-                try:
-                    SeriesReference.objects.get_or_create(series=series,
-                                                          msgid=msgid)
-                except SeriesReference.MultipleObjectsReturned:
-                    logger.error("Multiple SeriesReferences for %s"
-                                 " in project %s!" % (msgid, project.name))
+            with phase('author'):
+                author = get_or_create_author(mail)
+
+            with phase('series'):
+                # we don't use 'find_series' here as a cover letter will
+                # always be the first item in a thread, thus the references
+                # could only point to a different series or unrelated
+                # message
+                series_ref = _find_series_references(
+                    project, [msgid]).get(msgid)
+                series = series_ref.series if series_ref else None
+
+                if not series:
+                    series = Series.objects.create(
+                        project=project,
+                        date=date,
+                        submitter=author,
+                        version=version,
+                        total=n)
+
+                    # we don't save the in-reply-to or references fields
+                    # for a cover letter, as they can't refer to the same
+                    # series
+                    try:
+                        SeriesReference.objects.get_or_create(
+                            series=series, project=project, msgid=msgid)
+                    except SeriesReference.MultipleObjectsReturned:
+                        logger.error("Multiple SeriesReferences for %s"
+                                     " in project %s!" % (msgid, project.name))
 
             try:
-                cover_letter = CoverLetter.objects.create(
-                    msgid=msgid,
-                    project=project,
-                    name=name[:255],
-                    date=date,
-                    headers=headers,
-                    submitter=author,
-                    content=message)
+                with phase('create'):
+                    cover_letter = CoverLetter.objects.create(
+                        msgid=msgid,
+                        project=project,
+                        name=name[:255],
+                        date=date,
+                        headers=headers,
+                        submitter=author,
+                        content=message)
             except IntegrityError:
                 raise DuplicateMailError(msgid=msgid)
 
             logger.debug('Cover letter saved')
+            _cache_msgid(project, msgid, cover_letter)
 
-            series.add_cover_letter(cover_letter)
+            with phase('series'):
+                series.add_cover_letter(cover_letter)
 
             return cover_letter
 
     # comments
 
     # we only save comments if we have the parent email
-    submission = find_submission_for_comment(project, refs)
+    with phase('parent'):
+        submission = find_submission_for_comment(project, refs,
+                                                 pending_comments)
     if not submission:
         return
 
-    author = get_or_create_author(mail)
+    with phase('author'):
+        author = get_or_create_author(mail)
+
+    comment = Comment(
+        submission=submission,
+        msgid=msgid,
+        date=date,
+        headers=headers,
+        submitter=author,
+        content=message)
+
+    if pending_comments is not None:
+        pending_comments.add(comment)
+        logger.debug('Comment queued')
+        return comment
 
     try:
-        comment = Comment.objects.create(
-            submission=submission,
-            msgid=msgid,
-            date=date,
-            headers=headers,
-            submitter=author,
-            content=message)
+        with phase('create'):
+            comment.save(force_insert=True)
     except IntegrityError:
         raise DuplicateMailError(msgid=msgid)
 
     logger.debug('Comment saved')
+    _cache_msgid(project, msgid, submission)
 
     return comment
 
 
 def find_filenames(diff):
     """Find files changes in a given diff."""
-    # normalise spaces
-    diff = diff.replace('\r', '')
-    diff = diff.strip() + '\n'
-
-    filenames = {}
-
-    for line in diff.split('\n'):
-        if len(line) <= 0:
-            continue
-
-        filename_match = _filename_re.match(line)
-        if not filename_match:
-            continue
-
-        filename = filename_match.group(2)
-        if filename.startswith('/dev/null'):
-            continue
-
-        filename = '/'.join(filename.split('/')[1:])
-        filenames[filename] = True
-
-    filenames = sorted(filenames.keys())
+    scanner = DiffScanner()
+    scanner.update(diff)
+    scanner.finish()
 
-    return filenames
+    return scanner.filenames
@@ -0,0 +1,60 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Notification of new events to clients waiting for them.
+
+Clients of the event stream API wait for new events rather than polling
+the event list. Whenever events are created, a notification is published
+so that waiting clients know to look for them. The database remains the
+source of truth: a notification only indicates that it's worth looking.
+
+Only waiters in the process that created the events are notified, so
+events created by other processes, such as the mail parser, are instead
+found by waiters checking the database periodically.
+"""
+
+import threading
+
+
+class LocalPubSub(object):
+    """Publish notifications to threads in the current process."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+
+    @property
+    def generation(self):
+        """A value which changes whenever a notification is published.
+
+        This should be read before looking for new events, and passed to
+        ``wait`` if there are none, so that a notification published in
+        the meantime isn't missed.
+        """
+        return self._generation
+
+    def publish(self):
+        """Wake all threads waiting for a notification."""
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """Wait for a notification published after 'generation'.
+
+        Args:
+            generation (int): The value of ``generation`` read before the
+                caller last looked for new events.
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            True if a notification was published, else False.
+        """
+        with self._condition:
+            if self._generation == generation:
+                self._condition.wait(timeout)
+            return self._generation != generation
+
+
+events = LocalPubSub()
@@ -0,0 +1,44 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import datetime
+
+from django.db import transaction
+
+from patchwork.models import Event
+from patchwork.models import Project
+
+
+def prune_events(batch_size=1000):
+    """Remove events older than their project's retention period.
+
+    Events are removed in batches, each in its own transaction, so that
+    removing a large backlog doesn't hold locks on the event table for long.
+
+    Args:
+        batch_size (int): The maximum number of events to remove at a time.
+
+    Returns:
+        The number of events removed.
+    """
+    now = datetime.datetime.utcnow()
+    count = 0
+
+    projects = Project.objects.filter(event_retention_days__isnull=False)
+    for project in projects:
+        cutoff = now - datetime.timedelta(days=project.event_retention_days)
+        events = Event.objects.filter(project=project, date__lt=cutoff)
+
+        while True:
+            with transaction.atomic():
+                batch = list(events.order_by('date').values_list(
+                    'id', flat=True)[:batch_size])
+                if not batch:
+                    break
+
+                Event.objects.filter(id__in=batch).delete()
+
+            count += len(batch)
+
+    return count
@@ -129,7 +129,7 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
         'patchwork.compat.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
-        'rest_framework.filters.OrderingFilter',
+        'patchwork.api.filters.OrderingFilter',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
@@ -185,6 +185,11 @@ LOGGING = {
             'level': 'WARNING',
             'propagate': False,
         },
+        'patchwork.stats': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
         'patchwork.management.commands.parsearchive': {
             'handlers': ['console'],
             'level': 'WARNING',
@@ -195,6 +200,11 @@ LOGGING = {
             'level': 'WARNING',
             'propagate': True,
         },
+        'patchwork.lmtp': {
+            'handlers': ['console', 'mail_admins'],
+            'level': 'WARNING',
+            'propagate': True,
+        },
     },
 }
 
@@ -219,6 +229,28 @@ ENABLE_REST_API = True
 REST_RESULTS_PER_PAGE = 30
 MAX_REST_RESULTS_PER_PAGE = 250
 
+# The number of seconds a request to the REST API event stream waits for new
+# events, and how often it checks for events created by other processes
+REST_EVENT_STREAM_TIMEOUT = 30
+REST_EVENT_STREAM_POLL_INTERVAL = 5
+
+# The maximum number of event stream requests that may wait for events at
+# once in each process, or None for no limit. Further requests return
+# immediately
+REST_EVENT_STREAM_MAX_WAITING = None
+
+# The cache, from CACHES, to store the mbox files and diffs of patches in for
+# download, and the number of seconds to store them for. This must be shared
+# by all processes, such as memcached, as cached files are only invalidated
+# by the process making a change. Set to None to disable caching
+DOWNLOAD_CACHE = None
+DOWNLOAD_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Set to True to store the headers, content and diffs of submissions and
+# comments compressed. Use the recompress management command to convert
+# existing values after changing this
+COMPRESS_CONTENT = False
+
 # Set to True to enable redirections or URLs from previous versions
 # of patchwork
 COMPAT_REDIR = True
@@ -3,37 +3,109 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import contextlib
 from datetime import datetime as dt
+import threading
 
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 
+from patchwork import downloads
 from patchwork.models import Check
+from patchwork.models import Comment
 from patchwork.models import CoverLetter
 from patchwork.models import Event
+from patchwork.models import EventSequence
 from patchwork.models import Patch
 from patchwork.models import PatchChangeNotification
+from patchwork.models import Person
 from patchwork.models import Series
+from patchwork.models import Submission
+from patchwork import pubsub
+from patchwork.stats import phase
 
+_deferred_events = threading.local()
 
-@receiver(pre_save, sender=Patch)
-def patch_change_callback(sender, instance, raw, **kwargs):
-    # we only want notification of modified patches
-    if raw or instance.pk is None:
-        return
 
-    if instance.project is None or not instance.project.send_notifications:
+@contextlib.contextmanager
+def defer_events():
+    """Defer creation of events until the end of the block.
+
+    Events raised inside the block are buffered and, if the block
+    completes successfully, saved using a single bulk insert. The buffer
+    is yielded so callers can discard events raised by work that was
+    later rolled back.
+    """
+    if getattr(_deferred_events, 'events', None) is not None:
+        # we're nested in another block, which will handle the insert
+        yield _deferred_events.events
         return
 
+    _deferred_events.events = []
     try:
-        orig_patch = Patch.objects.get(pk=instance.pk)
-    except Patch.DoesNotExist:
+        yield _deferred_events.events
+        events = _deferred_events.events
+    finally:
+        _deferred_events.events = None
+
+    with phase('signals'):
+        Event.objects.bulk_create(events)
+
+    if events:
+        transaction.on_commit(_events_committed)
+
+
+def _sequence_events():
+    """Number the committed events which haven't been numbered yet.
+
+    Event IDs are allocated when events are inserted, so a transaction
+    which takes a while to commit can make an event visible after events
+    with later IDs. The event stream instead follows these numbers, which
+    are taken from a counter locked until the numbering commits.
+    """
+    if not Event.objects.filter(sequence__isnull=True).exists():
+        return
+
+    with transaction.atomic():
+        sequence, _ = EventSequence.objects.select_for_update().get_or_create(
+            id=1)
+        sequence.value += 1
+        sequence.save()
+
+        Event.objects.filter(sequence__isnull=True).update(
+            sequence=sequence.value)
+
+
+def _events_committed():
+    _sequence_events()
+    # let clients of the event stream know they can see the events
+    pubsub.events.publish()
+
+
+def _create_event(**kwargs):
+    with phase('signals'):
+        event = Event(**kwargs)
+
+        if getattr(_deferred_events, 'events', None) is not None:
+            _deferred_events.events.append(event)
+        else:
+            event.save()
+            transaction.on_commit(_events_committed)
+
+    return event
+
+
+def patch_change_callback(instance, orig_patch):
+    if instance.project is None or not instance.project.send_notifications:
         return
 
     # If there's no interesting changes, abort without creating the
     # notification
-    if orig_patch.state == instance.state:
+    if orig_patch.state_id == instance.state_id:
         return
 
     notification = None
@@ -43,9 +115,9 @@ def patch_change_callback(sender, instance, raw, **kwargs):
         pass
 
     if notification is None:
-        notification = PatchChangeNotification(patch=instance,
-                                               orig_state=orig_patch.state)
-    elif notification.orig_state == instance.state:
+        notification = PatchChangeNotification(
+            patch=instance, orig_state_id=orig_patch.state_id)
+    elif notification.orig_state_id == instance.state_id:
         # If we're back at the original state, there is no need to notify
         notification.delete()
         return
@@ -58,7 +130,7 @@ def patch_change_callback(sender, instance, raw, **kwargs):
 def create_cover_created_event(sender, instance, created, raw, **kwargs):
 
     def create_event(cover):
-        return Event.objects.create(
+        return _create_event(
             category=Event.CATEGORY_COVER_CREATED,
             project=cover.project,
             cover=cover)
@@ -74,7 +146,7 @@ def create_cover_created_event(sender, instance, created, raw, **kwargs):
 def create_patch_created_event(sender, instance, created, raw, **kwargs):
 
     def create_event(patch):
-        return Event.objects.create(
+        return _create_event(
             category=Event.CATEGORY_PATCH_CREATED,
             project=patch.project,
             patch=patch)
@@ -86,72 +158,56 @@ def create_patch_created_event(sender, instance, created, raw, **kwargs):
     create_event(instance)
 
 
-@receiver(pre_save, sender=Patch)
-def create_patch_state_changed_event(sender, instance, raw, **kwargs):
+def create_patch_state_changed_event(instance, orig_patch):
 
     def create_event(patch, before, after):
-        return Event.objects.create(
+        return _create_event(
             category=Event.CATEGORY_PATCH_STATE_CHANGED,
             project=patch.project,
             patch=patch,
-            previous_state=before,
-            current_state=after)
-
-    # don't trigger for items loaded from fixtures or new items
-    if raw or not instance.pk:
-        return
+            previous_state_id=before,
+            current_state_id=after)
 
-    orig_patch = Patch.objects.get(pk=instance.pk)
-
-    if orig_patch.state == instance.state:
+    if orig_patch.state_id == instance.state_id:
         return
 
-    create_event(instance, orig_patch.state, instance.state)
+    create_event(instance, orig_patch.state_id, instance.state_id)
 
 
-@receiver(pre_save, sender=Patch)
-def create_patch_delegated_event(sender, instance, raw, **kwargs):
+def create_patch_delegated_event(instance, orig_patch):
 
     def create_event(patch, before, after):
-        return Event.objects.create(
+        return _create_event(
             category=Event.CATEGORY_PATCH_DELEGATED,
             project=patch.project,
             patch=patch,
-            previous_delegate=before,
-            current_delegate=after)
+            previous_delegate_id=before,
+            current_delegate_id=after)
 
-    # don't trigger for items loaded from fixtures or new items
-    if raw or not instance.pk:
+    if orig_patch.delegate_id == instance.delegate_id:
         return
 
-    orig_patch = Patch.objects.get(pk=instance.pk)
-
-    if orig_patch.delegate == instance.delegate:
-        return
+    create_event(instance, orig_patch.delegate_id, instance.delegate_id)
 
-    create_event(instance, orig_patch.delegate, instance.delegate)
 
-
-@receiver(pre_save, sender=Patch)
-def create_patch_completed_event(sender, instance, raw, **kwargs):
+def create_patch_completed_event(instance, orig_patch):
 
     def create_event(patch):
-        return Event.objects.create(
+        # successors belong to the same project and series as the instance,
+        # so use those rather than looking them up again
+        return _create_event(
             category=Event.CATEGORY_PATCH_COMPLETED,
-            project=patch.project,
+            project=instance.project,
             patch=patch,
-            series=patch.series)
+            series=instance.series)
 
-    # don't trigger for items loaded from fixtures, new items or items that
-    # (still) don't have a series
-    if raw or not instance.pk or not instance.series:
+    # don't trigger for items that (still) don't have a series
+    if not instance.series_id:
         return
 
-    orig_patch = Patch.objects.get(pk=instance.pk)
-
     # we don't currently allow users to change a series, though this might
     # change in the future. However, we handle that here nonetheless
-    if orig_patch.series == instance.series:
+    if orig_patch.series_id == instance.series_id:
         return
 
     # if dependencies not met, don't raise event. There's also no point raising
@@ -167,7 +223,8 @@ def create_patch_completed_event(sender, instance, raw, **kwargs):
     # those
     count = instance.number + 1
     for successor in Patch.objects.order_by('number').filter(
-            series=instance.series, number__gt=instance.number):
+            series=instance.series, number__gt=instance.number).only(
+            'id', 'number'):
         if successor.number != count:
             break
 
@@ -181,7 +238,7 @@ def create_check_created_event(sender, instance, created, raw, **kwargs):
     def create_event(check):
         # TODO(stephenfin): It might make sense to add a 'project' field to
         # 'check' to prevent lookups here and in the REST API
-        return Event.objects.create(
+        return _create_event(
             category=Event.CATEGORY_CHECK_CREATED,
             project=check.patch.project,
             patch=check.patch,
@@ -198,7 +255,7 @@ def create_check_created_event(sender, instance, created, raw, **kwargs):
 def create_series_created_event(sender, instance, created, raw, **kwargs):
 
     def create_event(series):
-        return Event.objects.create(
+        return _create_event(
             category=Event.CATEGORY_SERIES_CREATED,
             project=series.project,
             series=series)
@@ -210,8 +267,7 @@ def create_series_created_event(sender, instance, created, raw, **kwargs):
     create_event(instance)
 
 
-@receiver(pre_save, sender=Patch)
-def create_series_completed_event(sender, instance, raw, **kwargs):
+def create_series_completed_event(instance, orig_patch):
 
     # NOTE(stephenfin): It's actually possible for this event to be fired
     # multiple times for a given series. To trigger this case, you would need
@@ -220,25 +276,83 @@ def create_series_completed_event(sender, instance, raw, **kwargs):
     # in that case.
 
     def create_event(series):
-        return Event.objects.create(
+        return _create_event(
             category=Event.CATEGORY_SERIES_COMPLETED,
             project=series.project,
             series=series)
 
-    # don't trigger for items loaded from fixtures, new items or items that
-    # (still) don't have a series
-    if raw or not instance.pk or not instance.series:
+    # don't trigger for items that (still) don't have a series
+    if not instance.series_id:
         return
 
-    orig_patch = Patch.objects.get(pk=instance.pk)
-
     # we don't currently allow users to change a series (though this might
     # change in the future) meaning if the patch already had a series, there's
     # nothing to notify about
-    if orig_patch.series:
+    if orig_patch.series_id:
         return
 
     # we can't use "series.received_all" here since we haven't actually saved
     # the instance yet so we duplicate that logic here but with an offset
     if (instance.series.received_total + 1) >= instance.series.total:
         create_event(instance.series)
+
+
+@receiver(pre_save, sender=Patch)
+def patch_pre_save_callback(sender, instance, raw, **kwargs):
+    # don't trigger for items loaded from fixtures or new items
+    if raw or not instance.pk:
+        return
+
+    # fetch the original patch once for all of the handlers below, and only
+    # the fields they compare against
+    try:
+        orig_patch = Patch.objects.only(
+            'state', 'delegate', 'series').get(pk=instance.pk)
+    except Patch.DoesNotExist:
+        return
+
+    patch_change_callback(instance, orig_patch)
+    create_patch_state_changed_event(instance, orig_patch)
+    create_patch_delegated_event(instance, orig_patch)
+    create_patch_completed_event(instance, orig_patch)
+    create_series_completed_event(instance, orig_patch)
+
+
+# Invalidation of cached downloads. Submissions are invalidated when created
+# too, in case a cached file remains from a deleted submission with the same
+# ID.
+
+@receiver(post_save, sender=Patch)
+@receiver(post_save, sender=CoverLetter)
+def invalidate_submission_downloads(sender, instance, **kwargs):
+    downloads.invalidate([instance.id])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_downloads(sender, instance, **kwargs):
+    # the tags found in comments are included in mbox files
+    downloads.invalidate([instance.submission_id])
+
+
+@receiver(post_save, sender=Person)
+def invalidate_submitter_downloads(sender, instance, created, **kwargs):
+    # the name and email address of the submitter are included in mbox files
+    if created:
+        return
+
+    downloads.invalidate(Submission.objects.filter(
+        submitter=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def invalidate_delegate_downloads(sender, instance, created, update_fields,
+                                  **kwargs):
+    # the email address of the delegate is included in mbox files. Users are
+    # saved each time they log in, so ignore saves which don't include it
+    if created or (update_fields is not None and
+                   'email' not in update_fields):
+        return
+
+    downloads.invalidate(Patch.objects.filter(
+        delegate=instance).values_list('id', flat=True))
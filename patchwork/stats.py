@@ -0,0 +1,206 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Optional instrumentation of mail parsing.
+
+While a ``collect_parse_stats`` block is active, the time spent and the
+number of database queries made in each phase of parsing a mail are
+recorded. Phases are marked using ``phase`` blocks, which cost next to
+nothing when stats aren't being collected. Time spent in a nested phase
+is only counted against that phase, not against the enclosing one.
+
+The stats for each mail are also logged, at debug level, using the
+``parse_stats`` attribute of the log record.
+
+Query counts require Django 2.0 or later. On earlier versions, only
+timings are recorded.
+"""
+
+from collections import Counter
+import contextlib
+import logging
+import threading
+import timeit
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class ParseStats(object):
+    """The time spent and queries made in each phase of parsing."""
+
+    def __init__(self):
+        self.mails = 0
+        self.time = Counter()
+        self.queries = Counter()
+
+        self._query_count = 0
+        self._stack = []
+        self._mark = None
+
+    def __getstate__(self):
+        # only the results are needed when passed between processes
+        state = self.__dict__.copy()
+        state['_stack'] = []
+        state['_mark'] = None
+        return state
+
+    def _count_query(self, execute, sql, params, many, context):
+        self._query_count += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def total_time(self):
+        return sum(self.time.values())
+
+    @property
+    def total_queries(self):
+        return sum(self.queries.values())
+
+    def _charge(self):
+        """Charge everything since the last mark to the current phase."""
+        now = timeit.default_timer()
+        if self._stack:
+            phase, queries = self._stack[-1]
+            self.time[phase] += now - self._mark
+            self.queries[phase] += self._query_count - queries
+            self._stack[-1] = (phase, self._query_count)
+        self._mark = now
+
+    def enter(self, phase):
+        self._charge()
+        self._stack.append((phase, self._query_count))
+
+    def exit(self):
+        self._charge()
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1] = (self._stack[-1][0], self._query_count)
+
+    def snapshot(self):
+        """Return a copy of the stats collected so far."""
+        stats = ParseStats()
+        stats.merge(self)
+        return stats
+
+    def merge(self, other):
+        """Add the stats from another instance to these."""
+        self.mails += other.mails
+        self.time.update(other.time)
+        self.queries.update(other.queries)
+
+    def __sub__(self, other):
+        stats = ParseStats()
+        stats.mails = self.mails - other.mails
+        stats.time = Counter(self.time)
+        stats.time.subtract(other.time)
+        stats.queries = Counter(self.queries)
+        stats.queries.subtract(other.queries)
+        return stats
+
+    def as_dict(self):
+        """Return the stats in a form suitable for structured logging."""
+        return {
+            'mails': self.mails,
+            'time': round(self.total_time, 6),
+            'queries': self.total_queries,
+            'phases': {
+                phase: {
+                    'time': round(self.time[phase], 6),
+                    'queries': self.queries[phase],
+                } for phase in self.time},
+        }
+
+    def summary(self):
+        """Return a table summarising the stats."""
+        lines = ['%-10s %10s %7s %10s %10s' % (
+            'phase', 'time (s)', '%', 'queries', 'per mail')]
+
+        for phase, elapsed in self.time.most_common():
+            lines.append('%-10s %10.3f %6.1f%% %10d %10.2f' % (
+                phase, elapsed,
+                elapsed / self.total_time * 100 if self.total_time else 0,
+                self.queries[phase],
+                float(self.queries[phase]) / self.mails if self.mails else 0))
+
+        lines.append('%-10s %10.3f %6.1f%% %10d %10.2f' % (
+            'total', self.total_time, 100, self.total_queries,
+            float(self.total_queries) / self.mails if self.mails else 0))
+
+        return '\n'.join(lines)
+
+
+def get_parse_stats():
+    """Return the stats being collected in this thread, if any."""
+    return getattr(_local, 'stats', None)
+
+
+@contextlib.contextmanager
+def collect_parse_stats(stats=None):
+    """Collect stats for mails parsed in this thread within the block.
+
+    Args:
+        stats (ParseStats): An instance to add the stats to. If not
+            provided, a new one is created.
+
+    Yields:
+        The ``ParseStats`` instance stats are added to.
+    """
+    stats = stats if stats is not None else ParseStats()
+
+    previous = get_parse_stats()
+    _local.stats = stats
+    try:
+        # execute_wrapper was added in Django 2.0
+        if hasattr(connection, 'execute_wrapper'):
+            with connection.execute_wrapper(stats._count_query):
+                yield stats
+        else:
+            yield stats
+    finally:
+        _local.stats = previous
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Mark a phase of parsing, if stats are being collected."""
+    stats = get_parse_stats()
+    if stats is None:
+        yield
+        return
+
+    stats.enter(name)
+    try:
+        yield
+    finally:
+        stats.exit()
+
+
+@contextlib.contextmanager
+def parsing_mail(mail):
+    """Mark the parsing of a single mail, if stats are being collected.
+
+    This should be nested in a phase, so that any time not spent in
+    another phase is accounted for.
+    """
+    stats = get_parse_stats()
+    if stats is None:
+        yield
+        return
+
+    before = stats.snapshot()
+    try:
+        yield
+    finally:
+        stats.mails += 1
+        stats._charge()
+
+        mail_stats = stats - before
+        logger.debug('Parsed mail %s in %.3fs with %d queries',
+                     mail.get('Message-Id'), mail_stats.total_time,
+                     mail_stats.total_queries,
+                     extra={'parse_stats': mail_stats.as_dict()})
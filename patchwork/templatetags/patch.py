@@ -19,7 +19,7 @@ def patch_tags(patch):
     counts = []
     titles = []
     for tag in [t for t in patch.project.tags if t.show_column]:
-        count = getattr(patch, tag.attr_name)
+        count = patch.tag_counts.get(tag.id, 0)
         titles.append('%d %s' % (count, tag.name))
         if count == 0:
             counts.append("-")
@@ -6,9 +6,14 @@
 import unittest
 
 from django.conf import settings
+from django.test.utils import override_settings
 from django.urls import reverse
+from django.utils.six.moves.urllib.parse import parse_qsl
+from django.utils.six.moves.urllib.parse import urlparse
 
 from patchwork.models import Event
+from patchwork import pubsub
+from patchwork import signals
 from patchwork.tests.api import utils
 from patchwork.tests.utils import create_check
 from patchwork.tests.utils import create_cover
@@ -19,6 +24,7 @@ from patchwork.tests.utils import create_state
 
 if settings.ENABLE_REST_API:
     from rest_framework import status
+    from rest_framework.test import APIClient
 
 
 @unittest.skipUnless(settings.ENABLE_REST_API, 'requires ENABLE_REST_API')
@@ -86,6 +92,37 @@ class TestEventAPI(utils.APITestCase):
             event_obj = events.get(category=event_rsp['category'])
             self.assertSerialized(event_obj, event_rsp)
 
+    def test_list_same_date(self):
+        """List events created at the same time, newest first."""
+        self._create_events()
+        Event.objects.update(date=Event.objects.first().date)
+
+        resp = self.client.get(self.api_url())
+        ids = [x['id'] for x in resp.data]
+        self.assertEqual(sorted(ids, reverse=True), ids)
+
+    def test_list_cursor(self):
+        """List events using cursor-based pagination."""
+        events = self._create_events()
+
+        ids = []
+        params = {'cursor': '', 'per_page': 3}
+        while params is not None:
+            resp = self.client.get(self.api_url(), params)
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+            self.assertLessEqual(len(resp.data), 3)
+            ids.extend(x['id'] for x in resp.data)
+
+            params = None
+            for link in resp.get('Link', '').split(', '):
+                if link.endswith('; rel="next"'):
+                    url = urlparse(link[1:link.index('>')])
+                    params = dict(parse_qsl(url.query))
+
+        self.assertEqual(
+            list(events.order_by('-date', '-id').values_list('id', flat=True)),
+            ids)
+
     def test_list_filter_project(self):
         """Filter events by project."""
         events = self._create_events()
@@ -149,6 +186,81 @@ class TestEventAPI(utils.APITestCase):
         resp = self.client.get(self.api_url(), {'series': 999999})
         self.assertEqual(0, len(resp.data))
 
+    def test_list_num_queries(self):
+        """List events with a constant number of queries."""
+        self._create_events()
+
+        # one to count the events and one to fetch them
+        with self.assertNumQueries(2):
+            resp = self.client.get(self.api_url())
+        self.assertEqual(8, len(resp.data))
+
+    def test_list_expand(self):
+        """List events with only some related objects expanded."""
+        events = self._create_events()
+
+        resp = self.client.get(self.api_url(), {'expand': 'patch,foo'})
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(8, len(resp.data))
+        for event_rsp in resp.data:
+            event_obj = events.get(category=event_rsp['category'])
+            self.assertEqual(event_obj.project.id, event_rsp['project'])
+            payload = event_rsp['payload']
+            if 'patch' in payload:
+                self.assertEqual(event_obj.patch.id, payload['patch']['id'])
+            if 'series' in payload:
+                self.assertEqual(event_obj.series.id, payload['series'])
+            if 'check' in payload:
+                self.assertEqual(event_obj.created_check.id, payload['check'])
+            if 'current_delegate' in payload:
+                self.assertEqual(event_obj.current_delegate.id,
+                                 payload['current_delegate'])
+            if 'current_state' in payload:
+                # states are always represented by their slugs
+                self.assertEqual(event_obj.current_state.slug,
+                                 payload['current_state'])
+
+    def test_list_expand_none(self):
+        """List events with no related objects expanded."""
+        events = self._create_events()
+
+        # no related objects need be fetched, beyond states
+        with self.assertNumQueries(2):
+            resp = self.client.get(self.api_url(), {'expand': ''})
+        self.assertEqual(8, len(resp.data))
+
+        event_rsp = [x for x in resp.data
+                     if x['category'] == 'patch-completed'][0]
+        event_obj = events.get(category='patch-completed')
+        self.assertEqual(event_obj.project_id, event_rsp['project'])
+        self.assertEqual({'patch': event_obj.patch_id,
+                          'series': event_obj.series_id},
+                         event_rsp['payload'])
+
+    def test_list_fields(self):
+        """List events with only some fields."""
+        events = self._create_events()
+
+        resp = self.client.get(self.api_url(), {'fields': 'id,category'})
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(
+            sorted(events.values_list('id', 'category')),
+            sorted((x['id'], x['category']) for x in resp.data))
+        for event_rsp in resp.data:
+            self.assertEqual(['id', 'category'], list(event_rsp))
+
+    def test_list_sparse_old_version(self):
+        """List events with sparse fields using an old API version."""
+        self._create_events()
+
+        resp = APIClient().get(self.api_url(version='1.1'), {
+            'fields': 'id', 'expand': ''})
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(8, len(resp.data))
+        for event_rsp in resp.data:
+            self.assertIn('payload', event_rsp)
+            self.assertIn('id', event_rsp['project'])
+
     def test_create(self):
         """Ensure creates aren't allowed"""
         user = create_maintainer()
@@ -158,3 +270,154 @@ class TestEventAPI(utils.APITestCase):
         self.client.force_authenticate(user=user)
         resp = self.client.post(self.api_url(), {'category': 'patch-created'})
         self.assertEqual(status.HTTP_405_METHOD_NOT_ALLOWED, resp.status_code)
+
+
+class _StandInPubSub(object):
+    """Stands in for another thread creating an event while we wait."""
+
+    generation = 0
+
+    def __init__(self, create_event):
+        self.create_event = create_event
+        self.waits = 0
+
+    def publish(self):
+        self.generation += 1
+
+    def wait(self, generation, timeout):
+        self.waits += 1
+        self.create_event()
+        self.generation += 1
+        return True
+
+
+@unittest.skipUnless(settings.ENABLE_REST_API, 'requires ENABLE_REST_API')
+@override_settings(REST_EVENT_STREAM_TIMEOUT=0)
+class TestEventStreamAPI(utils.APITransactionTestCase):
+    """Test the event stream.
+
+    Events are only numbered once committed, so these tests must commit.
+    """
+
+    @staticmethod
+    def api_url(version=None):
+        kwargs = {}
+        if version:
+            kwargs['version'] = version
+
+        return reverse('api-event-stream', kwargs=kwargs)
+
+    def setUp(self):
+        super(TestEventStreamAPI, self).setUp()
+        self.events = pubsub.events
+
+    def tearDown(self):
+        pubsub.events = self.events
+        super(TestEventStreamAPI, self).tearDown()
+
+    def test_stream(self):
+        """Show events created after a given event."""
+        patch = create_patch()
+        events = Event.objects.order_by('id')
+        since_id = events.last().id
+        create_cover()
+        create_check(patch=patch)
+
+        resp = self.client.get(self.api_url(), {'since_id': since_id})
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(
+            list(events.filter(id__gt=since_id).values_list('id', flat=True)),
+            [x['id'] for x in resp.data])
+        self.assertEqual(['series-created', 'cover-created', 'check-created'],
+                         [x['category'] for x in resp.data])
+
+    def test_stream_no_events(self):
+        """Show events when none have been created since the given one."""
+        create_patch()
+        since_id = Event.objects.order_by('id').last().id
+
+        resp = self.client.get(self.api_url(), {'since_id': since_id})
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual([], resp.data)
+
+    @override_settings(REST_EVENT_STREAM_TIMEOUT=10)
+    def test_stream_wait(self):
+        """Wait for an event to be created."""
+        patch = create_patch()
+        since_id = Event.objects.order_by('id').last().id
+        pubsub.events = _StandInPubSub(lambda: create_check(patch=patch))
+
+        resp = self.client.get(self.api_url(), {'since_id': since_id})
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(1, pubsub.events.waits)
+        self.assertEqual(['check-created'],
+                         [x['category'] for x in resp.data])
+
+    def test_stream_late_commit(self):
+        """Show events committed after events with later IDs."""
+        patch = create_patch()
+        events = Event.objects.order_by('id')
+        since_id = events.last().id
+        create_cover()
+        create_check(patch=patch)
+
+        # the cover letter's transaction is still open, while the check's
+        # has committed
+        late = events.filter(id__gt=since_id).exclude(
+            category='check-created')
+        late.update(sequence=None)
+
+        resp = self.client.get(self.api_url(), {'since_id': since_id})
+        self.assertEqual(['check-created'],
+                         [x['category'] for x in resp.data])
+        since_id = resp.data[-1]['id']
+
+        signals._sequence_events()
+
+        resp = self.client.get(self.api_url(), {'since_id': since_id})
+        self.assertEqual(['series-created', 'cover-created'],
+                         [x['category'] for x in resp.data])
+
+    @override_settings(REST_EVENT_STREAM_TIMEOUT=10,
+                       REST_EVENT_STREAM_MAX_WAITING=0)
+    def test_stream_max_waiting(self):
+        """Don't wait if too many other requests are waiting."""
+        patch = create_patch()
+        since_id = Event.objects.order_by('id').last().id
+        pubsub.events = _StandInPubSub(lambda: create_check(patch=patch))
+
+        resp = self.client.get(self.api_url(), {'since_id': since_id})
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(0, pubsub.events.waits)
+        self.assertEqual([], resp.data)
+
+    def test_stream_filter_project(self):
+        """Wait for events in a given project."""
+        patch = create_patch()
+        since_id = Event.objects.order_by('id').last().id
+        create_patch()  # create patch in a random project
+        create_check(patch=patch)
+
+        resp = self.client.get(self.api_url(), {
+            'since_id': since_id, 'project': patch.project.linkname})
+        self.assertEqual(['check-created'],
+                         [x['category'] for x in resp.data])
+
+    # these use a client which doesn't validate requests against the schema,
+    # as that rejects requests with invalid parameters or paths outright
+
+    def test_stream_invalid_since_id(self):
+        """Wait for events without a valid 'since_id'."""
+        client = APIClient()
+
+        resp = client.get(self.api_url())
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+
+        resp = client.get(self.api_url(), {'since_id': 'foo'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+
+    def test_stream_old_version(self):
+        """Wait for events using an API version without the event stream."""
+        resp = APIClient().get(self.api_url().replace('/api/', '/api/1.1/'),
+                               {'since_id': 0})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, resp.status_code)
@@ -8,10 +8,16 @@ from email.utils import make_msgid
 import unittest
 
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.six.moves.urllib.parse import parse_qsl
+from django.utils.six.moves.urllib.parse import urlparse
 
+from patchwork.models import Check
 from patchwork.models import Patch
 from patchwork.tests.api import utils
+from patchwork.tests.utils import create_check
 from patchwork.tests.utils import create_maintainer
 from patchwork.tests.utils import create_patch
 from patchwork.tests.utils import create_person
@@ -152,6 +158,68 @@ class TestPatchAPI(utils.APITestCase):
             'submitter': 'test@example.org'})
         self.assertEqual(0, len(resp.data))
 
+    def test_list_order_check(self):
+        """Order patches by the combined state of their checks."""
+        patch_a = create_patch()
+        patch_b = create_patch()
+        patch_c = create_patch()
+        create_check(patch=patch_a, state=Check.STATE_FAIL)
+        # several checks must not cause a patch to be listed more than once
+        create_check(patch=patch_b, context='a')
+        create_check(patch=patch_b, context='b')
+
+        resp = self.client.get(self.api_url(), {'order': 'check'})
+        self.assertEqual([patch_c.id, patch_b.id, patch_a.id],
+                         [x['id'] for x in resp.data])
+        self.assertEqual(['pending', 'success', 'fail'],
+                         [x['check'] for x in resp.data])
+
+        resp = self.client.get(self.api_url(), {'order': '-check'})
+        self.assertEqual([patch_a.id, patch_b.id, patch_c.id],
+                         [x['id'] for x in resp.data])
+
+    def _get_link(self, resp, rel):
+        """Return the path and parameters of a link in the Link header."""
+        for link in resp.get('Link', '').split(', '):
+            if link.endswith('; rel="%s"' % rel):
+                url = urlparse(link[1:link.index('>')])
+                return url.path, dict(parse_qsl(url.query,
+                                                keep_blank_values=True))
+        return None, None
+
+    def test_list_cursor(self):
+        """List patches using cursor-based pagination."""
+        patches = [create_patch() for _ in range(5)]
+
+        ids = []
+        path = self.api_url()
+        params = {'cursor': '', 'per_page': 2, 'order': '-name'}
+        while path:
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(path, params)
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+            self.assertFalse([query for query in queries
+                              if 'COUNT(' in query['sql']])
+            self.assertNotIn('rel="last"', resp['Link'])
+
+            ids.extend(x['id'] for x in resp.data)
+            path, params = self._get_link(resp, 'next')
+
+        # the requested ordering is ignored, as it's fixed for cursors
+        self.assertEqual([patch.id for patch in patches], ids)
+
+        # and we can go back the way we came
+        resp = self.client.get(*self._get_link(resp, 'prev'))
+        self.assertEqual([patches[2].id, patches[3].id],
+                         [x['id'] for x in resp.data])
+
+    def test_list_cursor_invalid(self):
+        """List patches using an invalid cursor."""
+        create_patch()
+
+        resp = self.client.get(self.api_url(), {'cursor': 'invalid'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, resp.status_code)
+
     @utils.store_samples('patch-list-1-0')
     def test_list_version_1_0(self):
         """List patches using API v1.0."""
@@ -155,3 +155,7 @@ class APIClient(BaseAPIClient):
 
 class APITestCase(testcases.TestCase):
     client_class = APIClient
+
+
+class APITransactionTestCase(testcases.TransactionTestCase):
+    client_class = APIClient
@@ -117,14 +117,14 @@ class BundleMboxTest(BundleTestBase):
     def test_empty_bundle(self):
         response = self.client.get(bundle_mbox_url(self.bundle))
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.content, six.b(''))
+        self.assertEqual(response.getvalue(), six.b(''))
 
     def test_non_empty_bundle(self):
         self.bundle.append_patch(self.patches[0])
 
         response = self.client.get(bundle_mbox_url(self.bundle))
         self.assertEqual(response.status_code, 200)
-        self.assertNotEqual(response.content, six.b(''))
+        self.assertNotEqual(response.getvalue(), six.b(''))
 
 
 class BundleUpdateTest(BundleTestBase):
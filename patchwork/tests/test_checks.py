@@ -6,9 +6,11 @@
 from datetime import datetime as dt
 from datetime import timedelta
 
+from django.test import TestCase
 from django.test import TransactionTestCase
 
 from patchwork.models import Check
+from patchwork.models import Patch
 from patchwork.tests.utils import create_check
 from patchwork.tests.utils import create_patches
 from patchwork.tests.utils import create_user
@@ -71,6 +73,17 @@ class PatchChecksTest(TransactionTestCase):
         check_b = self._create_check(context='new-context/test1')
         self.assertChecksEqual(self.patch, [check_a, check_b])
 
+    def test_checks__cached(self):
+        check_a = self._create_check()
+        self.assertChecksEqual(self.patch, [check_a])
+
+        with self.assertNumQueries(0):
+            self.assertChecksEqual(self.patch, [check_a])
+
+        # saving a check for the patch refreshes the cache
+        check_b = self._create_check(context='new-context/test1')
+        self.assertChecksEqual(self.patch, [check_a, check_b])
+
     def test_checks__duplicate_checks(self):
         self._create_check(date=(dt.utcnow() - timedelta(days=1)))
         check = self._create_check()
@@ -137,3 +150,104 @@ class PatchChecksTest(TransactionTestCase):
         self._create_check()
         self._create_check(context='new/test1')
         self.assertCheckEqual(self.patch, Check.STATE_SUCCESS)
+
+
+class PatchCheckSummaryTest(TestCase):
+
+    def setUp(self):
+        self.patch = create_patches()[0]
+        self.user = create_user()
+
+    def _create_check(self, **kwargs):
+        values = {
+            'patch': self.patch,
+            'user': self.user,
+        }
+        values.update(**kwargs)
+
+        return create_check(**values)
+
+    def assertSummaryEqual(self, checks):  # noqa
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(
+            sorted(entry['id'] for entry in patch.check_summary.values()),
+            sorted(check.id for check in checks))
+
+    def test_stored(self):
+        check = self._create_check(state=Check.STATE_WARNING)
+        self._create_check(user=create_user(), context='other')
+
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(patch.check_state, Check.STATE_WARNING)
+        with self.assertNumQueries(0):
+            self.assertEqual(patch.combined_check_state, 'warning')
+            self.assertEqual(patch.check_count[Check.STATE_WARNING], 1)
+            self.assertEqual(patch.check_count[Check.STATE_SUCCESS], 1)
+        self.assertEqual(
+            patch.check_summary['%d:jenkins-ci' % self.user.id]['id'],
+            check.id)
+
+    def test_recheck(self):
+        self._create_check(state=Check.STATE_FAIL)
+        check = self._create_check()
+        # an older check must not replace a newer one
+        self._create_check(date=(dt.utcnow() - timedelta(days=1)),
+                           state=Check.STATE_FAIL)
+
+        self.assertSummaryEqual([check])
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(patch.check_state, Check.STATE_SUCCESS)
+
+    def test_delete(self):
+        check_a = self._create_check(date=(dt.utcnow() - timedelta(days=1)),
+                                     state=Check.STATE_FAIL)
+        check_b = self._create_check()
+
+        check_b.delete()
+
+        self.assertSummaryEqual([check_a])
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(patch.check_state, Check.STATE_FAIL)
+
+    def test_update(self):
+        check = self._create_check()
+
+        check.state = Check.STATE_FAIL
+        check.save()
+
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(patch.check_state, Check.STATE_FAIL)
+
+    def test_stale_patch(self):
+        """Ensure saving a stale copy of a patch doesn't lose checks."""
+        patch = Patch.objects.get(id=self.patch.id)
+        self._create_check(state=Check.STATE_FAIL)
+
+        patch.name = 'new name'
+        patch.save()
+
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(patch.name, 'new name')
+        self.assertEqual(patch.check_state, Check.STATE_FAIL)
+
+    def test_modified_patch(self):
+        """Ensure a check state set on the patch itself is saved."""
+        patch = Patch.objects.get(id=self.patch.id)
+
+        patch.check_state = Check.STATE_WARNING
+        patch.save()
+
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(patch.check_state, Check.STATE_WARNING)
+
+    def test_updated_patch_save(self):
+        """Ensure saving a patch after adding a check keeps the summary."""
+        self._create_check(state=Check.STATE_FAIL)
+        Patch.objects.filter(id=self.patch.id).update(
+            check_state=Check.STATE_WARNING)
+
+        self.patch.name = 'new name'
+        self.patch.save()
+
+        patch = Patch.objects.get(id=self.patch.id)
+        self.assertEqual(patch.check_state, Check.STATE_WARNING)
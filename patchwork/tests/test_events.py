@@ -3,9 +3,17 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import datetime
+import threading
+import time
+
 from django.test import TestCase
+from django.test import TransactionTestCase
 
 from patchwork.models import Event
+from patchwork import pubsub
+from patchwork.signals import defer_events
+from patchwork.retention import prune_events
 from patchwork.tests import utils
 
 BASE_FIELDS = ['previous_state', 'current_state', 'previous_delegate',
@@ -223,3 +231,95 @@ class SeriesChangedTest(_BaseTestCase):
         events = _get_events(series=series)
         self.assertIn(Event.CATEGORY_SERIES_COMPLETED,
                       [x.category for x in events])
+
+
+class DeferredEventsTest(TestCase):
+
+    def test_dates_kept(self):
+        """Ensure deferred events are saved with the dates they were raised."""
+        with defer_events() as events:
+            for _ in range(3):
+                utils.create_patch(series=None)
+                time.sleep(0.01)
+            raised = [event.date for event in events]
+
+        self.assertEqual(3, len(set(raised)))
+        self.assertEqual(raised, sorted(raised))
+        self.assertEqual(raised, list(Event.objects.order_by('id').values_list(
+            'date', flat=True)))
+
+
+class PubSubTest(TestCase):
+
+    def test_wait_timeout(self):
+        events = pubsub.LocalPubSub()
+        self.assertFalse(events.wait(events.generation, 0.01))
+
+    def test_wait_missed(self):
+        """Ensure a notification published before waiting isn't missed."""
+        events = pubsub.LocalPubSub()
+        generation = events.generation
+        events.publish()
+        self.assertTrue(events.wait(generation, 10))
+
+    def test_wait_published(self):
+        events = pubsub.LocalPubSub()
+        generation = events.generation
+        thread = threading.Timer(0.01, events.publish)
+        thread.start()
+        self.assertTrue(events.wait(generation, 10))
+        thread.join()
+
+
+class EventPublishedTest(TransactionTestCase):
+
+    def test_event_published(self):
+        generation = pubsub.events.generation
+        utils.create_patch(series=None)
+        self.assertNotEqual(pubsub.events.generation, generation)
+
+
+class EventRetentionTest(TestCase):
+
+    def _create_events(self, project, days_ago):
+        # patch-created
+        patch = utils.create_patch(project=project, series=None)
+        Event.objects.filter(patch=patch).update(
+            date=datetime.datetime.utcnow() - datetime.timedelta(
+                days=days_ago))
+        return patch
+
+    def test_prune(self):
+        project = utils.create_project(event_retention_days=30)
+        old_patch = self._create_events(project, 31)
+        new_patch = self._create_events(project, 29)
+
+        self.assertEqual(1, prune_events())
+        self.assertFalse(Event.objects.filter(patch=old_patch).exists())
+        self.assertTrue(Event.objects.filter(patch=new_patch).exists())
+
+    def test_prune_batches(self):
+        project = utils.create_project(event_retention_days=30)
+        for _ in range(5):
+            self._create_events(project, 31)
+
+        self.assertEqual(5, prune_events(batch_size=2))
+        self.assertFalse(Event.objects.filter(project=project).exists())
+
+    def test_prune_no_retention(self):
+        """Ensure events are kept for projects without a retention period."""
+        project = utils.create_project()
+        self._create_events(project, 3650)
+
+        self.assertEqual(0, prune_events())
+        self.assertTrue(Event.objects.filter(project=project).exists())
+
+    def test_prune_per_project(self):
+        project_a = utils.create_project(event_retention_days=30)
+        project_b = utils.create_project(event_retention_days=60)
+        self._create_events(project_a, 45)
+        self._create_events(project_b, 45)
+
+        self.assertEqual(1, prune_events())
+        self.assertFalse(Event.objects.filter(project=project_a).exists())
+        self.assertTrue(Event.objects.filter(project=project_b).exists())
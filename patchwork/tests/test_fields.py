@@ -3,9 +3,16 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from django.db import models
+from django.db.models.functions import Cast
+from django.test import override_settings
 from django.test import SimpleTestCase
+from django.test import TestCase
 
 from patchwork import fields
+from patchwork.models import Patch
+from patchwork.models import SubmissionBody
+from patchwork.tests.utils import create_patch
 
 
 class TestHashField(SimpleTestCase):
@@ -17,3 +24,61 @@ class TestHashField(SimpleTestCase):
         """
         field = fields.HashField()
         self.assertEqual(field.n_bytes, 40)
+
+
+def _get_stored(patch, field):
+    """Get the value of a field as stored in the database."""
+    return SubmissionBody.objects.filter(submission=patch).annotate(
+        stored=Cast(field, models.TextField())).values_list(
+            'stored', flat=True).get()
+
+
+class TestCompressedTextField(TestCase):
+
+    diff = 'diff --git a/file b/file\n' + '+line\n' * 100
+
+    @override_settings(COMPRESS_CONTENT=True)
+    def test_compressed(self):
+        patch = create_patch(diff=self.diff, content='Short content.')
+
+        stored = _get_stored(patch, 'diff')
+        self.assertTrue(stored.startswith(fields.CompressedTextField.prefix))
+        self.assertLess(len(stored), len(self.diff))
+        # values too short to benefit are stored as they are
+        self.assertEqual(_get_stored(patch, 'content'), 'Short content.')
+
+        patch = Patch.objects.get(id=patch.id)
+        self.assertEqual(patch.diff, self.diff)
+        self.assertEqual(patch.content, 'Short content.')
+        self.assertEqual(
+            Patch.objects.filter(id=patch.id).values_list(
+                'body__diff', flat=True).get(), self.diff)
+
+    @override_settings(COMPRESS_CONTENT=False)
+    def test_uncompressed(self):
+        patch = create_patch(diff=self.diff)
+
+        self.assertEqual(_get_stored(patch, 'diff'), self.diff)
+        self.assertEqual(Patch.objects.get(id=patch.id).diff, self.diff)
+
+    @override_settings(COMPRESS_CONTENT=False)
+    def test_setting_changed(self):
+        with override_settings(COMPRESS_CONTENT=True):
+            patch = create_patch(diff=self.diff)
+
+        self.assertEqual(Patch.objects.get(id=patch.id).diff, self.diff)
+
+    def test_prefix(self):
+        """Validate that text which looks compressed is read correctly."""
+        diff = fields.CompressedTextField.prefix + 'diff'
+        patch = create_patch(diff=diff)
+
+        self.assertNotEqual(_get_stored(patch, 'diff'), diff)
+        self.assertEqual(Patch.objects.get(id=patch.id).diff, diff)
+
+    def test_null(self):
+        patch = create_patch(diff=None)
+
+        with override_settings(COMPRESS_CONTENT=True):
+            self.assertIsNone(Patch.objects.get(id=patch.id).diff)
+            self.assertTrue(Patch.objects.filter(body__diff=None).exists())
@@ -0,0 +1,166 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import io
+import os
+import socket
+import threading
+
+from django.test import TestCase
+
+from patchwork import lmtp
+from patchwork import models
+from patchwork.lmtp import deliver
+from patchwork.lmtp import LMTPHandler
+from patchwork.lmtp import MailBatcher
+from patchwork.mbox import message_from_bytes
+from patchwork.tests import TEST_MAIL_DIR
+from patchwork.tests import utils
+
+
+class _FakeServer(object):
+
+    def __init__(self, list_id=None):
+        self.list_id = list_id
+
+    def deliver(self, data):
+        deliver(data, self.list_id)
+
+
+class LMTPHandlerTest(TestCase):
+
+    def setUp(self):
+        self.project = utils.create_project()
+        utils.create_state()
+
+    def _session(self, commands):
+        """Run an LMTP session and return the replies."""
+        server, client = socket.socketpair()
+        self.addCleanup(client.close)
+
+        client.sendall(commands)
+        client.shutdown(socket.SHUT_WR)
+
+        try:
+            LMTPHandler(server, None, _FakeServer(self.project.listid))
+        finally:
+            server.close()
+
+        replies = b''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            replies += data
+
+        return [line.split(b' ')[0].split(b'-')[0]
+                for line in replies.splitlines()]
+
+    def _read_mail(self, filename):
+        with open(os.path.join(TEST_MAIL_DIR, filename), 'rb') as f:
+            data = f.read()
+
+        # strip the mbox 'From ' line, dot-stuff and use CRLF line endings
+        data = data.split(b'\n', 1)[1]
+        return b''.join(b'.' + line if line.startswith(b'.') else line
+                        for line in data.splitlines(True)).replace(
+                            b'\n', b'\r\n')
+
+    def test_deliver(self):
+        replies = self._session(
+            b'LHLO localhost\r\n'
+            b'MAIL FROM:<>\r\n'
+            b'RCPT TO:<patchwork@example.com>\r\n'
+            b'RCPT TO:<patchwork2@example.com>\r\n'
+            b'DATA\r\n' +
+            self._read_mail('0013-with-utf8-body.mbox') +
+            b'.\r\n'
+            b'QUIT\r\n')
+
+        # LHLO replies with a multiline response, and DATA with a reply
+        # per recipient
+        self.assertEqual(replies, [b'220', b'250', b'250', b'250', b'250',
+                                   b'250', b'250', b'354', b'250', b'250',
+                                   b'221'])
+        self.assertEqual(models.Patch.objects.count(), 1)
+
+    def test_deliver_invalid(self):
+        """Validate mails that can't be parsed are still accepted."""
+        replies = self._session(
+            b'LHLO localhost\r\n'
+            b'MAIL FROM:<>\r\n'
+            b'RCPT TO:<patchwork@example.com>\r\n'
+            b'DATA\r\n'
+            b'Subject: test\r\n'
+            b'\r\n'
+            b'test\r\n'
+            b'.\r\n')
+
+        self.assertEqual(replies[-1], b'250')
+        self.assertEqual(models.Patch.objects.count(), 0)
+
+    def test_long_lines(self):
+        """Validate lines longer than a read aren't split into lines."""
+        self.addCleanup(setattr, lmtp, 'MAX_LINE_LENGTH', lmtp.MAX_LINE_LENGTH)
+        lmtp.MAX_LINE_LENGTH = 8
+
+        handler = LMTPHandler.__new__(LMTPHandler)
+        # these are split into chunks of 8 bytes, which start with a dot, or
+        # end in the middle of a line ending
+        handler.rfile = io.BytesIO(
+            b'..stuffed\r\n'
+            b'12345678.\r\n'
+            b'12345678..\r\n'
+            b'1234567\r\n'
+            b'.\r\n'
+            b'not read\r\n')
+
+        self.assertEqual(handler.read_data(),
+                         b'.stuffed\n12345678.\n12345678..\n1234567\n')
+
+    def test_missing_commands(self):
+        replies = self._session(
+            b'LHLO localhost\r\n'
+            b'RCPT TO:<patchwork@example.com>\r\n'
+            b'DATA\r\n'
+            b'FOO\r\n')
+
+        self.assertEqual(replies, [b'220', b'250', b'250', b'250', b'503',
+                                   b'503', b'500'])
+
+
+class MailBatcherTest(TestCase):
+
+    def setUp(self):
+        self.project = utils.create_project()
+        utils.create_state()
+
+    def _pending(self, filename):
+        with open(os.path.join(TEST_MAIL_DIR, filename), 'rb') as f:
+            mail = message_from_bytes(f.read())
+        return mail, threading.Event()
+
+    def test_next_batch(self):
+        batcher = MailBatcher(size=2, delay=0)
+        pending = [self._pending('0001-git-pull-request.mbox')
+                   for _ in range(3)]
+        batcher._pending = list(pending)
+
+        self.assertEqual(batcher._next_batch(), pending[:2])
+        # the delay has passed, so a smaller batch is taken
+        self.assertEqual(batcher._next_batch(), pending[2:])
+
+    def test_parse(self):
+        batcher = MailBatcher(self.project.listid)
+        batch = [self._pending('0013-with-utf8-body.mbox'),
+                 self._pending('0001-git-pull-request.mbox'),
+                 self._pending('0013-with-utf8-body.mbox')]
+        del batch[1][0]['Message-Id']
+
+        batcher._parse(batch)
+
+        # mails that can't be parsed, or are duplicates, are still
+        # acknowledged
+        self.assertTrue(all(done.is_set() for _, done in batch))
+        self.assertEqual(models.Patch.objects.count(), 1)
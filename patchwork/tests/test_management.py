@@ -3,15 +3,24 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import datetime
+import mailbox
 import os
 import sys
+import tempfile
 
 from django.core.management import call_command
+from django.db.models import TextField
+from django.db.models.functions import Cast
 from django.utils.six import StringIO
+from django.test import override_settings
 from django.test import TestCase
 
 from patchwork import models
+from patchwork.hasher import hash_diff
+from patchwork.management.commands import parsearchive
 from patchwork.tests import TEST_MAIL_DIR
+from patchwork.tests import TEST_SERIES_DIR
 from patchwork.tests import utils
 
 
@@ -87,6 +96,18 @@ class ParsemailTest(TestCase):
         count = models.Patch.objects.filter(project=project.id).count()
         self.assertEqual(count, 1)
 
+    def test_invalid_workers(self):
+        with self.assertRaises(SystemExit) as exc:
+            call_command('parsemail', daemon=True, workers=0,
+                         stderr=StringIO())
+        self.assertEqual(exc.exception.code, 1)
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(SystemExit) as exc:
+            call_command('parsemail', daemon=True, batch_size=0,
+                         stderr=StringIO())
+        self.assertEqual(exc.exception.code, 1)
+
     def test_dup_mail(self):
         project = utils.create_project()
         utils.create_state()
@@ -124,3 +145,243 @@ class ParsearchiveTest(TestCase):
 
         self.assertIn('Processed 1 messages -->', out.getvalue())
         self.assertIn('  1 dropped', out.getvalue())
+
+    def test_stdin(self):
+        project = utils.create_project()
+        utils.create_state()
+
+        out = StringIO()
+        path = os.path.join(TEST_SERIES_DIR, 'base-cover-letter.mbox')
+        sys.stdin.close()
+        sys.stdin = open(path)
+        call_command('parsearchive', infile=None, list_id=project.listid,
+                     stdout=out)
+        sys.stdin.close()
+
+        self.assertIn('Processed 3 messages -->', out.getvalue())
+        self.assertIn('  1 cover letters', out.getvalue())
+        self.assertIn('  2 patches', out.getvalue())
+        self.assertEqual(models.Patch.objects.count(), 2)
+
+    def test_batch_size(self):
+        project = utils.create_project()
+        utils.create_state()
+
+        out = StringIO()
+        call_command('parsearchive',
+                     os.path.join(TEST_SERIES_DIR, 'revision-basic.mbox'),
+                     list_id=project.listid, batch_size=4, stdout=out)
+
+        self.assertIn('Processed 6 messages -->', out.getvalue())
+        self.assertIn('  2 cover letters', out.getvalue())
+        self.assertIn('  4 patches', out.getvalue())
+        self.assertEqual(models.Series.objects.count(), 2)
+
+    def test_stats(self):
+        project = utils.create_project()
+        utils.create_state()
+
+        out = StringIO()
+        call_command('parsearchive',
+                     os.path.join(TEST_SERIES_DIR, 'base-cover-letter.mbox'),
+                     list_id=project.listid, stats=True, stdout=out)
+
+        self.assertIn('Processed 3 messages -->', out.getvalue())
+        self.assertIn('phase', out.getvalue())
+        self.assertIn('create', out.getvalue())
+        self.assertIn('total', out.getvalue())
+
+    def test_invalid_jobs(self):
+        out = StringIO()
+        with self.assertRaises(SystemExit) as exc:
+            call_command('parsearchive',
+                         os.path.join(TEST_MAIL_DIR,
+                                      '0001-git-pull-request.mbox'),
+                         jobs=0, stdout=out)
+        self.assertEqual(exc.exception.code, 1)
+
+    def test_group_by_thread(self):
+        mbox = mailbox.mbox(os.path.join(TEST_SERIES_DIR,
+                                         'revision-basic.mbox'),
+                            create=False)
+        keys = list(mbox.iterkeys())
+
+        threads = parsearchive.group_by_thread(mbox)
+        mbox.close()
+
+        # two unrelated revisions, each with a cover letter and two patches
+        self.assertEqual(threads, [keys[:3], keys[3:]])
+
+    def test_group_by_thread_revision_in_reply(self):
+        mbox = mailbox.mbox(os.path.join(TEST_SERIES_DIR,
+                                         'revision-threaded-to-cover.mbox'),
+                            create=False)
+        keys = list(mbox.iterkeys())
+
+        threads = parsearchive.group_by_thread(mbox)
+        mbox.close()
+
+        # the second revision was sent in reply to the first
+        self.assertEqual(threads, [keys])
+
+    def test_group_by_thread_no_references(self):
+        mbox = mailbox.mbox(os.path.join(TEST_SERIES_DIR,
+                                         'base-no-references-no-cover.mbox'),
+                            create=False)
+        keys = list(mbox.iterkeys())
+
+        threads = parsearchive.group_by_thread(mbox)
+        mbox.close()
+
+        self.assertEqual(threads, [[key] for key in keys])
+
+
+class RehashTest(TestCase):
+
+    def setUp(self):
+        self.patches = utils.create_patches(3)
+        models.Patch.objects.update(hash='0' * 40)
+
+    def assertRehashed(self, patches):  # noqa
+        for patch in models.Patch.objects.all():
+            if patch in patches:
+                self.assertEqual(patch.hash, hash_diff(patch.diff))
+            else:
+                self.assertEqual(patch.hash, '0' * 40)
+
+    def test_all(self):
+        out = StringIO()
+        call_command('rehash', stdout=out)
+
+        self.assertRehashed(self.patches)
+        self.assertIn('Updated 3 patches', out.getvalue())
+
+    def test_batches(self):
+        # patches are batched by ID, regardless of their date
+        for i, patch in enumerate(self.patches):
+            models.Patch.objects.filter(id=patch.id).update(
+                date=datetime.datetime(2000 - i, 1, 1))
+
+        out = StringIO()
+        call_command('rehash', batch_size=1, stdout=out)
+
+        self.assertRehashed(self.patches)
+        self.assertIn('Updated 3 patches', out.getvalue())
+
+    def test_patch_ids(self):
+        call_command('rehash', self.patches[1].id, stdout=StringIO())
+
+        self.assertRehashed(self.patches[1:2])
+
+    def test_project(self):
+        patch = utils.create_patch()
+        models.Patch.objects.update(hash='0' * 40)
+
+        call_command('rehash', project=patch.project.linkname,
+                     stdout=StringIO())
+
+        self.assertRehashed([patch])
+
+    def test_since(self):
+        models.Patch.objects.filter(id=self.patches[0].id).update(
+            date=datetime.datetime(2000, 1, 1))
+
+        call_command('rehash', since='2001-01-01', stdout=StringIO())
+
+        self.assertRehashed(self.patches[1:])
+
+    def test_checkpoint(self):
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write('%d\n' % self.patches[0].id)
+
+        out = StringIO()
+        call_command('rehash', checkpoint=checkpoint, batch_size=1,
+                     stdout=out)
+
+        self.assertIn('Resuming after patch %d' % self.patches[0].id,
+                      out.getvalue())
+        self.assertRehashed(self.patches[1:])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_invalid_since(self):
+        with self.assertRaises(SystemExit) as exc:
+            call_command('rehash', since='yesterday', stdout=StringIO(),
+                         stderr=StringIO())
+        self.assertEqual(exc.exception.code, 1)
+
+
+class RetagTest(TestCase):
+    fixtures = ['default_tags']
+
+    def test_retag(self):
+        patches = utils.create_patches(2)
+        for patch in patches:
+            utils.create_comment(
+                submission=patch,
+                content='Acked-by: Test User <test@example.com>\n')
+        models.PatchTag.objects.all().delete()
+        models.Patch.objects.update(tag_counts={})
+
+        out = StringIO()
+        call_command('retag', patches[0].id, stdout=out)
+
+        self.assertIn('Updated 1 patches', out.getvalue())
+        self.assertEqual(models.PatchTag.objects.get().patch_id,
+                         patches[0].id)
+        self.assertEqual(
+            list(models.Patch.objects.values_list('tag_counts', flat=True)),
+            [{models.Tag.objects.get(name='Acked-by').id: 1}, {}])
+
+
+@override_settings(COMPRESS_CONTENT=False)
+class RecompressTest(TestCase):
+
+    content = 'Some content.\n' * 50
+    diff = 'diff --git a/file b/file\n' + '+line\n' * 100
+
+    def setUp(self):
+        self.patch = utils.create_patch(content=self.content, diff=self.diff)
+        self.cover = utils.create_cover(content=self.content)
+        self.comment = utils.create_comment(submission=self.patch,
+                                            content=self.content)
+
+    def assertCompressed(self, model, obj, field, compressed=True):  # noqa
+        if model is not models.Comment:
+            model = models.SubmissionBody
+        stored = model.objects.filter(pk=obj.id).annotate(
+            stored=Cast(field, TextField())).values_list(
+                'stored', flat=True).get()
+        self.assertEqual(stored != getattr(obj, field), compressed)
+        self.assertEqual(getattr(model.objects.get(pk=obj.id), field),
+                         getattr(obj, field))
+
+    def test_compress(self):
+        out = StringIO()
+        with override_settings(COMPRESS_CONTENT=True):
+            call_command('recompress', stdout=out)
+
+        self.assertIn('Updated 2 patches', out.getvalue())
+        self.assertCompressed(models.Patch, self.patch, 'diff')
+        self.assertCompressed(models.Patch, self.patch, 'content')
+        self.assertCompressed(models.CoverLetter, self.cover, 'content')
+        self.assertCompressed(models.Comment, self.comment, 'content')
+
+    def test_decompress(self):
+        with override_settings(COMPRESS_CONTENT=True):
+            call_command('recompress', stdout=StringIO())
+
+        call_command('recompress', stdout=StringIO())
+
+        self.assertCompressed(models.Patch, self.patch, 'diff', False)
+        self.assertCompressed(models.CoverLetter, self.cover, 'content',
+                              False)
+        self.assertCompressed(models.Comment, self.comment, 'content', False)
+
+    def test_project(self):
+        with override_settings(COMPRESS_CONTENT=True):
+            call_command('recompress', project=self.cover.project.linkname,
+                         stdout=StringIO())
+
+        self.assertCompressed(models.CoverLetter, self.cover, 'content')
+        self.assertCompressed(models.Patch, self.patch, 'diff', False)
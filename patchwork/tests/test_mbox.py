@@ -0,0 +1,103 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import io
+import mailbox
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+from django.utils import six
+
+from patchwork.mbox import MaildirReader
+from patchwork.mbox import MboxReader
+from patchwork.mbox import open_archive
+from patchwork.tests import TEST_SERIES_DIR
+
+
+class MboxReaderTest(SimpleTestCase):
+
+    def _expected(self, path):
+        mbox = mailbox.mbox(path, create=False)
+        if six.PY3:
+            messages = [mbox.get_bytes(key) for key in mbox.iterkeys()]
+        else:
+            messages = [mbox.get_string(key) for key in mbox.iterkeys()]
+        mbox.close()
+        return messages
+
+    def test_mmap(self):
+        path = os.path.join(TEST_SERIES_DIR, 'revision-basic.mbox')
+
+        with MboxReader(path) as reader:
+            self.assertTrue(reader.seekable)
+            self.assertEqual(list(reader), self._expected(path))
+
+    def test_keys(self):
+        path = os.path.join(TEST_SERIES_DIR, 'revision-basic.mbox')
+
+        with MboxReader(path) as reader:
+            keys = list(reader.iterkeys())
+            self.assertEqual(len(keys), 6)
+            self.assertEqual(reader.get_bytes(keys[3]),
+                             self._expected(path)[3])
+
+    def test_stream(self):
+        path = os.path.join(TEST_SERIES_DIR, 'revision-basic.mbox')
+        with open(path, 'rb') as f:
+            stream = io.BytesIO(f.read())
+
+        reader = MboxReader(stream)
+        self.assertFalse(reader.seekable)
+        self.assertEqual(list(reader), self._expected(path))
+
+        with self.assertRaises(TypeError):
+            list(reader.iterkeys())
+
+    def test_leading_garbage(self):
+        reader = MboxReader(io.BytesIO(
+            b'garbage\n\nFrom foo@example.com Thu Jan  1 00:00:00 1970\n'
+            b'Subject: test\n\nbody\n'))
+        self.assertEqual(list(reader), [b'Subject: test\n\nbody\n'])
+
+    def test_messages(self):
+        path = os.path.join(TEST_SERIES_DIR, 'revision-basic.mbox')
+
+        with MboxReader(path) as reader:
+            messages = list(reader.messages())
+
+        self.assertEqual(len(messages), 6)
+        self.assertEqual(reader.count, 6)
+        self.assertEqual(reader.broken, 0)
+        self.assertEqual(
+            messages[0]['Message-Id'],
+            '<1473632524-8585-1-git-send-email-stephenfinucane@gmail.com>')
+
+    def test_empty(self):
+        reader = MboxReader(io.BytesIO(b''))
+        self.assertEqual(list(reader.messages()), [])
+        self.assertEqual(reader.count, 0)
+
+
+class MaildirReaderTest(SimpleTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        maildir = mailbox.Maildir(os.path.join(self.path, 'maildir'))
+        mbox = mailbox.mbox(os.path.join(TEST_SERIES_DIR,
+                                         'base-cover-letter.mbox'),
+                            create=False)
+        for message in mbox:
+            maildir.add(message)
+        mbox.close()
+        maildir.close()
+
+    def test_open_archive(self):
+        with open_archive(os.path.join(self.path, 'maildir')) as reader:
+            self.assertIsInstance(reader, MaildirReader)
+            self.assertTrue(reader.seekable)
+            self.assertEqual(len(list(reader.messages())), 3)
@@ -10,10 +10,16 @@ import dateutil.parser
 import dateutil.tz
 import email
 
+from django.db import connection
 from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from patchwork.models import SubmissionBody
+from patchwork.tests.utils import create_bundle
 from patchwork.tests.utils import create_comment
+from patchwork.tests.utils import create_maintainer
 from patchwork.tests.utils import create_patch
 from patchwork.tests.utils import create_project
 from patchwork.tests.utils import create_person
@@ -226,8 +232,13 @@ class MboxSeriesDependencies(TestCase):
         response = self.client.get('%s?series=*' % reverse(
             'patch-mbox', args=[patch_b.id]))
 
-        self.assertContains(response, patch_a.content)
-        self.assertContains(response, patch_b.content)
+        self.assertEqual(response.status_code, 200)
+        # the response is streamed, so can only be read once
+        content = response.getvalue().decode()
+        self.assertIn(patch_a.content, content)
+        self.assertIn(patch_b.content, content)
+        self.assertLess(content.index(patch_a.content),
+                        content.index(patch_b.content))
 
     def test_patch_with_numeric_series(self):
         series, patch_a, patch_b = self._create_patches()
@@ -235,8 +246,13 @@ class MboxSeriesDependencies(TestCase):
         response = self.client.get('%s?series=%d' % (
             reverse('patch-mbox', args=[patch_b.id]), series.id))
 
-        self.assertContains(response, patch_a.content)
-        self.assertContains(response, patch_b.content)
+        self.assertEqual(response.status_code, 200)
+        # the response is streamed, so can only be read once
+        content = response.getvalue().decode()
+        self.assertIn(patch_a.content, content)
+        self.assertIn(patch_b.content, content)
+        self.assertLess(content.index(patch_a.content),
+                        content.index(patch_b.content))
 
     def test_patch_with_invalid_series(self):
         series, patch_a, patch_b = self._create_patches()
@@ -267,5 +283,180 @@ class MboxSeries(TestCase):
 
         response = self.client.get(reverse('series-mbox', args=[series.id]))
 
-        self.assertContains(response, patch_a.content)
-        self.assertContains(response, patch_b.content)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        # the response is streamed, so can only be read once
+        content = response.getvalue().decode()
+        self.assertIn(patch_a.content, content)
+        self.assertIn(patch_b.content, content)
+        self.assertLess(content.index(patch_a.content),
+                        content.index(patch_b.content))
+
+
+class MboxQueryCountTest(TestCase):
+    """Ensure mbox files for many patches need a fixed number of queries."""
+
+    def _create_patches(self, count, **kwargs):
+        project = create_project()
+        delegate = create_maintainer(project)
+        patches = []
+        for _ in range(count):
+            patch = create_patch(project=project, delegate=delegate,
+                                 **kwargs)
+            create_comment(submission=patch,
+                           content='comment\n\nAcked-by: Test <t@e.com>')
+            patches.append(patch)
+        return patches
+
+    def _get_query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            # the response is streamed, so most queries are made here
+            content = response.getvalue().decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Acked-by: Test <t@e.com>', content)
+        return len(queries)
+
+    def _get_series_query_count(self, count):
+        series = create_series()
+        self._create_patches(count, series=series)
+        return self._get_query_count(reverse('series-mbox', args=[series.id]))
+
+    def _get_bundle_query_count(self, count):
+        bundle = create_bundle(public=True)
+        for patch in self._create_patches(count):
+            bundle.append_patch(patch)
+        return self._get_query_count(reverse('bundle-mbox', kwargs={
+            'username': bundle.owner.username, 'bundlename': bundle.name}))
+
+    def test_series(self):
+        self.assertEqual(self._get_series_query_count(1),
+                         self._get_series_query_count(10))
+
+    def test_bundle(self):
+        self.assertEqual(self._get_bundle_query_count(1),
+                         self._get_bundle_query_count(10))
+
+    def test_patch_with_dependencies(self):
+        counts = []
+        for count in (1, 10):
+            series = create_series()
+            patches = self._create_patches(count, series=series)
+            counts.append(self._get_query_count('%s?series=*' % reverse(
+                'patch-mbox', args=[patches[-1].id])))
+        self.assertEqual(counts[0], counts[1])
+
+
+@override_settings(DOWNLOAD_CACHE='default')
+class MboxCacheTest(TestCase):
+    """Ensure mbox files and diffs are cached, and invalidated."""
+
+    def setUp(self):
+        self.patch = create_patch()
+        self.url = reverse('patch-mbox', args=[self.patch.id])
+
+    def test_cached(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, self.patch.content)
+
+        # this bypasses invalidation, so the cached file should be used
+        SubmissionBody.objects.filter(submission=self.patch).update(
+            content='foo')
+
+        response = self.client.get(self.url)
+        self.assertContains(response, self.patch.content)
+
+    def test_invalidate_comment(self):
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Acked-by: 1\n')
+
+        create_comment(submission=self.patch, content='Acked-by: 1\n')
+
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Acked-by: 1\n')
+
+    def test_invalidate_delegate(self):
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'X-Patchwork-Delegate')
+
+        self.patch.delegate = create_user()
+        self.patch.save()
+
+        response = self.client.get(self.url)
+        self.assertContains(response, 'X-Patchwork-Delegate: %s' % (
+            self.patch.delegate.email))
+
+    def test_invalidate_submitter(self):
+        self.client.get(self.url)
+
+        submitter = self.patch.submitter
+        submitter.name = 'New Name'
+        submitter.save()
+
+        response = self.client.get(self.url)
+        self.assertContains(response, 'X-Patchwork-Submitter: New Name')
+
+    def test_not_modified_etag(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        create_comment(submission=self.patch)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_last_modified(self):
+        response = self.client.get(self.url)
+
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_series(self):
+        series = create_series()
+        create_patch(series=series)
+        url = reverse('series-mbox', args=[series.id])
+
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        create_patch(series=series)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_diff(self):
+        url = reverse('patch-raw', args=[self.patch.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.content.decode(), self.patch.diff)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class MboxNoCacheTest(TestCase):
+    """Ensure mbox files and diffs aren't cached by default."""
+
+    def setUp(self):
+        self.patch = create_patch()
+        self.url = reverse('patch-mbox', args=[self.patch.id])
+
+    def test_not_cached(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, self.patch.content)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+        SubmissionBody.objects.filter(submission=self.patch).update(
+            content='foo')
+
+        response = self.client.get(self.url)
+        self.assertContains(response, 'foo')
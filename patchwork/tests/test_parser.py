@@ -11,28 +11,55 @@ from email.utils import make_msgid
 import os
 import unittest
 
+from django.db import connection
 from django.test import TestCase
+from django.test import override_settings
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import six
 
+from patchwork import downloads
+from patchwork.hasher import DiffScanner
+from patchwork.hasher import hash_diff
+from patchwork.mbox import MboxReader
 from patchwork.models import Comment
+from patchwork.models import CoverLetter
+from patchwork.models import DelegationRule
+from patchwork.models import Event
 from patchwork.models import Patch
 from patchwork.models import Person
 from patchwork.models import State
+from patchwork import parser
 from patchwork.parser import clean_subject
 from patchwork.parser import get_or_create_author
 from patchwork.parser import find_patch_content as find_content
 from patchwork.parser import find_comment_content
+from patchwork.parser import find_delegate_by_filename
+from patchwork.parser import find_delegate_by_header
+from patchwork.parser import find_filenames
 from patchwork.parser import find_project
 from patchwork.parser import find_series
+from patchwork.parser import find_state
+from patchwork.parser import DuplicateMailError
+from patchwork.parser import enable_msgid_cache
+from patchwork.parser import find_submission_for_comment
 from patchwork.parser import parse_mail as _parse_mail
+from patchwork.parser import parse_mail_batch
 from patchwork.parser import parse_pull_request
 from patchwork.parser import parse_series_marker
 from patchwork.parser import parse_version
 from patchwork.parser import split_prefixes
+from patchwork.parser import _find_series_by_references
+from patchwork.parser import _scan_patch
 from patchwork.parser import subject_check
+from patchwork.stats import collect_parse_stats
+from patchwork.stats import get_parse_stats
 from patchwork.tests import TEST_MAIL_DIR
 from patchwork.tests import TEST_FUZZ_DIR
+from patchwork.tests import TEST_SERIES_DIR
+from patchwork.tests.utils import create_comment
+from patchwork.tests.utils import create_cover
+from patchwork.tests.utils import create_patch
 from patchwork.tests.utils import create_project
 from patchwork.tests.utils import create_series
 from patchwork.tests.utils import create_series_reference
@@ -381,6 +408,29 @@ class SeriesCorrelationTest(TestCase):
         self.assertEqual(len(msgids), 4 + 1)  # old series + new cover
         self.assertEqual(series, ref_v2.series)
 
+    def test_deep_thread(self):
+        """Resolve all references using a single query."""
+        project = create_project()
+        msgids = [make_msgid() for _ in range(30)]
+        ref = create_series_reference(msgid=msgids[0],
+                                      series=create_series(project=project))
+
+        email = self._create_email(make_msgid(), msgids)
+        email.replace_header('References', ' '.join(msgids))
+        with self.assertNumQueries(1):
+            series = _find_series_by_references(project, email)
+
+        self.assertEqual(series, ref.series)
+
+    def test_other_project(self):
+        """Ignore references belonging to another project."""
+        msgid_a = make_msgid()
+        email = self._create_email(make_msgid(), [msgid_a])
+        create_series_reference(msgid=msgid_a)
+
+        self.assertIsNone(find_series(create_project(), email,
+                                      get_or_create_author(email)))
+
 
 class SubjectEncodingTest(TestCase):
     """Validate correct handling of encoded subjects."""
@@ -679,6 +729,79 @@ class CommentParseTest(TestCase):
         self.assertFalse('<div' in message)
 
 
+class FindSubmissionForCommentTest(TestCase):
+
+    def setUp(self):
+        self.project = create_project()
+
+    def tearDown(self):
+        parser._msgid_cache = None
+
+    def test_priority(self):
+        """Use the most recent reference that matches."""
+        patch_a = create_patch(project=self.project)
+        patch_b = create_patch(project=self.project)
+        comment = create_comment(submission=patch_b)
+
+        submission = find_submission_for_comment(
+            self.project, [make_msgid(), comment.msgid, patch_a.msgid])
+
+        self.assertEqual(submission.id, patch_b.id)
+
+    def test_queries(self):
+        """Look up all references using two queries."""
+        refs = [make_msgid() for _ in range(30)]
+
+        with self.assertNumQueries(2):
+            submission = find_submission_for_comment(self.project, refs)
+
+        self.assertIsNone(submission)
+
+    def test_cover_letter(self):
+        """Prefer the cover letter when comments share a message ID."""
+        patch = create_patch(project=self.project)
+        cover = create_cover(project=self.project)
+        comment = create_comment(submission=patch)
+        create_comment(submission=cover, msgid=comment.msgid)
+
+        submission = find_submission_for_comment(self.project,
+                                                 [comment.msgid])
+
+        self.assertEqual(submission.id, cover.id)
+
+    def test_msgid_cache(self):
+        enable_msgid_cache()
+        patch = create_patch(project=self.project)
+        refs = [patch.msgid, make_msgid()]
+
+        self.assertEqual(
+            find_submission_for_comment(self.project, refs).id, patch.id)
+
+        # the cached submission is fetched, but no refs are searched for
+        with self.assertNumQueries(1):
+            submission = find_submission_for_comment(self.project, refs)
+
+        self.assertEqual(submission.id, patch.id)
+
+        # the cache is cleared when submissions are deleted
+        patch.delete()
+
+        self.assertIsNone(find_submission_for_comment(self.project, refs))
+
+    def test_msgid_cache_stale(self):
+        """Ignore cached submissions deleted by another process."""
+        enable_msgid_cache()
+        patch = create_patch(project=self.project)
+        msgid = make_msgid()
+        parser._msgid_cache.set((self.project.id, msgid), patch.id + 1000)
+
+        submission = find_submission_for_comment(self.project,
+                                                 [msgid, patch.msgid])
+
+        self.assertEqual(submission.id, patch.id)
+        self.assertIsNone(parser._msgid_cache.peek((self.project.id, msgid)))
+
+
 class DelegateRequestTest(TestCase):
 
     patch_filename = '0001-add-line.patch'
@@ -719,6 +842,50 @@ class DelegateRequestTest(TestCase):
         parse_mail(email)
         self.assertDelegate(None)
 
+    def test_delegate_cache_invalidated(self):
+        email = self._get_email()
+        email['X-Patchwork-Delegate'] = self.invalid_delegate_email
+        self.assertIsNone(find_delegate_by_header(email))
+
+        self.user.email = self.invalid_delegate_email
+        self.user.save()
+
+        self.assertEqual(find_delegate_by_header(email), self.user)
+
+    def test_delegate_by_filename(self):
+        rule = DelegationRule.objects.create(
+            project=self.project, user=self.user, path='meep*')
+
+        self.assertEqual(
+            find_delegate_by_filename(self.project, ['meep.text']),
+            self.user)
+
+        rule.path = 'other*'
+        rule.save()
+
+        self.assertIsNone(
+            find_delegate_by_filename(self.project, ['meep.text']))
+
+    def test_delegate_by_filename_priority(self):
+        user_b = create_user()
+        DelegationRule.objects.create(
+            project=self.project, user=self.user, path='*.c', priority=1)
+        DelegationRule.objects.create(
+            project=self.project, user=user_b, path='drivers/*', priority=2)
+
+        self.assertEqual(
+            find_delegate_by_filename(self.project, ['drivers/foo.c']),
+            user_b)
+        self.assertEqual(
+            find_delegate_by_filename(self.project, ['lib/foo.c']),
+            self.user)
+
+        # every file must have the same delegate
+        self.assertIsNone(find_delegate_by_filename(
+            self.project, ['drivers/foo.c', 'lib/foo.c']))
+        self.assertIsNone(find_delegate_by_filename(
+            self.project, ['lib/foo.c', 'lib/foo.h']))
+
 
 class InitialPatchStateTest(TestCase):
 
@@ -774,6 +941,16 @@ class InitialPatchStateTest(TestCase):
         parse_mail(email)
         self.assertState(self.default_state)
 
+    def test_state_cache_invalidated(self):
+        email = self._get_email()
+        email['X-Patchwork-State'] = self.invalid_state_name
+        self.assertEqual(find_state(email), self.default_state)
+
+        self.nondefault_state.name = self.invalid_state_name
+        self.nondefault_state.save()
+
+        self.assertEqual(find_state(email), self.nondefault_state)
+
 
 class ParseInitialTagsTest(PatchTest):
 
@@ -829,6 +1006,221 @@ class ParseCommentTagsTest(PatchTest):
             tag__name='Tested-by').count, 1)
 
 
+class ParseMailBatchTest(TestCase):
+    fixtures = ['default_tags']
+    comment_content = ('test comment\n\n' +
+                       'Tested-by: Test User <test@example.com>\n' +
+                       'Reviewed-by: Test User <test@example.com>\n')
+
+    def setUp(self):
+        create_state()
+        self.project = create_project(listid='test.example.com')
+
+    def test_series(self):
+        """Validate batches are equivalent to parsing mails individually."""
+        other_project = create_project()
+        mails = []
+        for name in ('revision-basic.mbox', 'base-no-cover-letter.mbox'):
+            with MboxReader(os.path.join(TEST_SERIES_DIR, name)) as reader:
+                mails.extend(reader.messages())
+
+        expected = [type(_parse_mail(mail, other_project.listid))
+                    for mail in mails]
+        results = parse_mail_batch(mails, self.project.listid)
+
+        self.assertEqual([type(result) for result in results], expected)
+        self.assertEqual(expected.count(CoverLetter), 2)
+
+        for model in (Patch, CoverLetter):
+            self.assertEqual(
+                [(obj.name, obj.series.name) for obj in
+                 model.objects.filter(project=self.project)],
+                [(obj.name, obj.series.name) for obj in
+                 model.objects.filter(project=other_project)])
+
+        for category, _ in Event.CATEGORY_CHOICES:
+            self.assertEqual(
+                Event.objects.filter(project=self.project,
+                                     category=category).count(),
+                Event.objects.filter(project=other_project,
+                                     category=category).count(),
+                category)
+
+    def test_comments(self):
+        patch = create_email(read_patch('0001-add-line.patch'),
+                             listid=self.project.listid)
+        comment = create_email(self.comment_content,
+                               in_reply_to=patch['Message-Id'])
+        reply = create_email(self.comment_content,
+                             in_reply_to=comment['Message-Id'])
+
+        results = parse_mail_batch([patch, comment, reply])
+
+        self.assertEqual([type(result) for result in results],
+                         [Patch, Comment, Comment])
+        patch = Patch.objects.get()
+        self.assertEqual(patch.comments.count(), 2)
+        self.assertEqual(patch.patchtag_set.get(
+            tag__name='Reviewed-by').count, 2)
+        self.assertEqual(patch.patchtag_set.get(
+            tag__name='Tested-by').count, 2)
+
+    @override_settings(DOWNLOAD_CACHE='default')
+    def test_comments_invalidate_downloads(self):
+        patch = create_email(read_patch('0001-add-line.patch'),
+                             listid=self.project.listid)
+        comment = create_email(self.comment_content,
+                               in_reply_to=patch['Message-Id'])
+
+        patch = parse_mail(patch)
+        versions = downloads.get_versions([patch.id])
+
+        parse_mail_batch([comment])
+
+        self.assertNotEqual(downloads.get_versions([patch.id]), versions)
+
+    def test_duplicates(self):
+        patch = create_email(read_patch('0001-add-line.patch'),
+                             listid=self.project.listid)
+        comment = create_email(self.comment_content,
+                               in_reply_to=patch['Message-Id'])
+
+        results = parse_mail_batch([patch, comment, patch, comment])
+
+        self.assertEqual([type(result) for result in results],
+                         [Patch, Comment, DuplicateMailError,
+                          DuplicateMailError])
+
+        results = parse_mail_batch([comment])
+
+        self.assertEqual([type(result) for result in results],
+                         [DuplicateMailError])
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_invalid(self):
+        mail = create_email('test', listid=self.project.listid)
+        del mail['From']
+
+        results = parse_mail_batch([mail])
+
+        self.assertIsInstance(results[0], ValueError)
+
+
+class DiffScannerTest(TestCase):
+
+    def _scan(self, diff, chunk_size=None):
+        scanner = DiffScanner()
+        chunk_size = chunk_size or len(diff) or 1
+        for i in range(0, len(diff), chunk_size):
+            scanner.update(diff[i:i + chunk_size])
+        scanner.finish()
+        return scanner
+
+    def test_stats(self):
+        scanner = self._scan(read_patch('0001-add-line.patch'))
+        self.assertEqual(scanner.filenames, ['meep.text'])
+        self.assertEqual(scanner.files, 1)
+        self.assertEqual(scanner.insertions, 1)
+        self.assertEqual(scanner.deletions, 0)
+
+    def test_dev_null(self):
+        scanner = self._scan(SAMPLE_DIFF)
+        self.assertEqual(scanner.filenames, [''])
+
+    def test_chunked(self):
+        diff = read_patch('0001-add-line.patch')
+        expected = hash_diff(diff)
+
+        for chunk_size in (1, 7, 100):
+            scanner = self._scan(diff, chunk_size)
+            self.assertEqual(scanner.hexdigest(), expected)
+            self.assertEqual(scanner.filenames, find_filenames(diff))
+
+    def test_whitespace(self):
+        """Validate leading and trailing whitespace isn't hashed."""
+        diff = read_patch('0001-add-line.patch')
+        self.assertEqual(
+            self._scan('\n \n' + diff + ' \n\n', 5).hexdigest(),
+            hash_diff(diff))
+
+        # but whitespace within the diff is
+        self.assertNotEqual(
+            self._scan(diff + ' \n+meep\n').hexdigest(),
+            self._scan(diff + '+meep\n').hexdigest())
+
+    def test_parse_patch(self):
+        """Validate the diff is scanned as it's split from a comment."""
+        diff = read_patch('0001-add-line.patch')
+        content = 'Some comment\n\n' + diff + '\n-- \n2.17.1\n'
+        patchbuf, _, scanner = _scan_patch(content)
+
+        self.assertEqual(patchbuf, diff)
+        self.assertEqual(scanner.hexdigest(), hash_diff(patchbuf))
+        self.assertEqual(scanner.filenames, ['meep.text'])
+
+
+class ParseStatsTest(TestCase):
+
+    def setUp(self):
+        self.project = create_project()
+        create_state()
+
+    def test_no_stats(self):
+        self.assertIsNone(get_parse_stats())
+        parse_mail(create_email(SAMPLE_DIFF, listid=self.project.listid))
+        self.assertIsNone(get_parse_stats())
+
+    def test_stats(self):
+        with collect_parse_stats() as stats:
+            parse_mail(create_email(SAMPLE_DIFF, listid=self.project.listid))
+
+        self.assertEqual(stats.mails, 1)
+        for phase in ('project', 'metadata', 'content', 'author', 'create',
+                      'series'):
+            self.assertIn(phase, stats.time)
+        self.assertAlmostEqual(stats.total_time, sum(stats.time.values()))
+
+        self.assertIn('total', stats.summary())
+        self.assertEqual(stats.as_dict()['mails'], 1)
+
+    def test_stats_comment(self):
+        patch = create_email(SAMPLE_DIFF, listid=self.project.listid)
+        parse_mail(patch)
+        comment = create_email('test comment', listid=self.project.listid,
+                               in_reply_to=patch['Message-Id'])
+
+        with collect_parse_stats() as stats:
+            parse_mail(comment)
+
+        # finding the parent is not part of series handling
+        self.assertIn('parent', stats.time)
+        self.assertNotIn('series', stats.time)
+
+    @unittest.skipUnless(hasattr(connection, 'execute_wrapper'),
+                         'Requires Django 2.0 or later')
+    def test_queries(self):
+        mail = create_email(SAMPLE_DIFF, listid=self.project.listid)
+
+        with CaptureQueriesContext(connection) as queries:
+            with collect_parse_stats() as stats:
+                _parse_mail(mail)
+
+        self.assertEqual(stats.total_queries, len(queries))
+        self.assertGreater(stats.queries['create'], 0)
+
+    def test_batch(self):
+        mails = [
+            create_email(SAMPLE_DIFF, listid=self.project.listid),
+            create_email(SAMPLE_DIFF, listid=self.project.listid),
+        ]
+
+        with collect_parse_stats() as stats:
+            parse_mail_batch(mails)
+
+        self.assertEqual(stats.mails, 2)
+        self.assertIn('tags', stats.time)
+
+
 class SubjectTest(TestCase):
 
     def test_clean_subject(self):
@@ -961,6 +1353,23 @@ class SubjectMatchTest(TestCase):
                                self.keyword_project.listid)
         self.assertEqual(project, self.keyword_project)
 
+    def test_project_cached(self):
+        self.email['Subject'] = '[PATCH keyword] subsystem'
+        find_project(self.email)
+
+        with self.assertNumQueries(0):
+            project = find_project(self.email)
+        self.assertEqual(project, self.keyword_project)
+
+    def test_project_cache_invalidated(self):
+        self.email['Subject'] = '[PATCH keyword] subsystem'
+        self.assertEqual(find_project(self.email), self.keyword_project)
+
+        self.keyword_project.subject_match = r'other-keyword'
+        self.keyword_project.save()
+
+        self.assertEqual(find_project(self.email), self.default_project)
+
 
 class WeirdMailTest(TransactionTestCase):
     """Test fuzzed or otherwise weird patches."""
@@ -0,0 +1,166 @@
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from patchwork.hasher import hash_diff
+from patchwork.models import CoverLetter
+from patchwork.models import Patch
+from patchwork.models import SubmissionBody
+from patchwork.models import Tag
+from patchwork.tests.utils import create_cover
+from patchwork.tests.utils import create_patch
+from patchwork.tests.utils import create_patches
+from patchwork.tests.utils import create_state
+from patchwork.tests.utils import create_user
+
+
+class SubmissionBodyTest(TestCase):
+
+    def test_create(self):
+        patch = create_patch(headers='Foo: bar', content='content',
+                             diff='diff --git a/file b/file\n')
+        cover = create_cover(headers='Foo: baz', content='cover content')
+
+        body = SubmissionBody.objects.get(submission=patch)
+        self.assertEqual(body.headers, 'Foo: bar')
+        self.assertEqual(body.content, 'content')
+        self.assertEqual(body.diff, 'diff --git a/file b/file\n')
+        self.assertEqual(patch.hash, hash_diff(body.diff))
+
+        body = SubmissionBody.objects.get(submission=cover)
+        self.assertEqual(body.content, 'cover content')
+        self.assertIsNone(body.diff)
+
+    def test_lazy_load(self):
+        patch = create_patch(content='content')
+
+        patch = Patch.objects.get(id=patch.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(patch.content, 'content')
+            self.assertEqual(patch.diff, patch.body.diff)
+
+        patch = Patch.objects.select_related('body').get(id=patch.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(patch.content, 'content')
+
+    def test_update_metadata(self):
+        """Validate that saving a patch doesn't load or write its body."""
+        patch = create_patch()
+
+        patch = Patch.objects.get(id=patch.id)
+        patch.state = create_state()
+        with CaptureQueriesContext(connection) as queries:
+            patch.save()
+
+        self.assertFalse([query for query in queries
+                          if 'submissionbody' in query['sql']])
+
+    def test_update_content(self):
+        patch = create_patch(content='content')
+
+        patch = Patch.objects.get(id=patch.id)
+        patch.content = 'new\r\ncontent'
+        patch.save()
+
+        self.assertEqual(
+            SubmissionBody.objects.get(submission=patch).content,
+            'new\ncontent')
+
+    def test_missing_body(self):
+        cover = create_cover()
+        SubmissionBody.objects.filter(submission=cover).delete()
+
+        cover = CoverLetter.objects.get(id=cover.id)
+        self.assertEqual(cover.headers, '')
+        self.assertIsNone(cover.content)
+
+        cover.content = 'content'
+        cover.save()
+
+        self.assertEqual(
+            SubmissionBody.objects.get(submission=cover).content, 'content')
+
+    def test_delete(self):
+        patch = create_patch()
+
+        patch.delete()
+
+        self.assertFalse(SubmissionBody.objects.exists())
+
+    def test_list(self):
+        """Validate that listing patches doesn't touch their bodies."""
+        patch = create_patches(5)[0]
+        url = reverse('patch-list',
+                      kwargs={'project_id': patch.project.linkname})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertContains(response, patch.name)
+        self.assertFalse([query for query in queries
+                          if 'submissionbody' in query['sql']])
+
+
+class SubmissionBodyAdminTest(TestCase):
+    """Validate that editing a body in the admin updates the submission."""
+
+    fixtures = ['default_tags']
+
+    def setUp(self):
+        user = create_user()
+        user.is_staff = True
+        user.is_superuser = True
+        user.save()
+        self.client.force_login(user)
+
+    def _post_change(self, url, **body):
+        response = self.client.get(url)
+        data = {}
+        for field in response.context['adminform'].form:
+            value = field.value()
+            if hasattr(field.field.widget, 'decompress'):
+                # split into separate inputs, such as the date and time
+                for i, part in enumerate(field.field.widget.decompress(value)):
+                    data['%s_%d' % (field.html_name, i)] = part
+            elif value is not None:
+                data[field.html_name] = value
+        for inline in response.context['inline_admin_formsets']:
+            formset = inline.formset
+            for field in formset.management_form:
+                data[field.html_name] = field.value()
+            for form in formset:
+                for field in form:
+                    value = body.get(field.name, field.value())
+                    if value is not None:
+                        data[field.html_name] = value
+
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_patch(self):
+        patch = create_patch(content='content')
+        url = reverse('admin:patchwork_patch_change', args=[patch.id])
+
+        self._post_change(url, content='new\r\nAcked-by: Test <t@e.com>',
+                          diff='diff --git a/new b/new\n')
+
+        patch = Patch.objects.get(id=patch.id)
+        self.assertEqual(patch.content, 'new\nAcked-by: Test <t@e.com>')
+        self.assertEqual(patch.diff, 'diff --git a/new b/new\n')
+        self.assertEqual(patch.hash, hash_diff(patch.diff))
+        self.assertEqual(patch.tag_counts,
+                         {Tag.objects.get(name='Acked-by').id: 1})
+
+    def test_cover(self):
+        cover = create_cover(content='content')
+        url = reverse('admin:patchwork_coverletter_change', args=[cover.id])
+
+        self._post_change(url, content='new\r\ncontent')
+
+        cover = CoverLetter.objects.get(id=cover.id)
+        self.assertEqual(cover.content, 'new\ncontent')
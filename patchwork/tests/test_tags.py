@@ -3,9 +3,14 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from email.utils import make_msgid
+
+from django.db import connection
 from django.test import TestCase
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
+from patchwork.models import Comment
 from patchwork.models import Patch
 from patchwork.models import PatchTag
 from patchwork.models import Tag
@@ -167,27 +172,107 @@ class PatchTagsTest(TransactionTestCase):
         self.assertTagsEqual(self.patch, 1, 1, 0)
 
 
-class PatchTagManagerTest(PatchTagsTest):
+class IncrementalTagsTest(PatchTagsTest):
 
-    def assertTagsEqual(self, patch, acks, reviews, tests):  # noqa
-        tagattrs = {}
-        for tag in Tag.objects.all():
-            tagattrs[tag.name] = tag.attr_name
+    def assertTagQueries(self, queries, count):  # noqa
+        """Check comments weren't rescanned and count tag updates."""
+        sql = [query['sql'] for query in queries]
+        self.assertFalse([q for q in sql if q.startswith('SELECT') and
+                          'patchwork_comment' in q])
+        self.assertEqual(len([q for q in sql if 'patchwork_patchtag' in q]),
+                         count)
+
+    def test_patch_update(self):
+        """Don't rescan comments when a patch is saved unchanged."""
+        for _ in range(5):
+            self.create_tag_comment(self.patch, self.ACK)
+
+        patch = Patch.objects.get(pk=self.patch.pk)
+        patch.archived = True
+        with CaptureQueriesContext(connection) as queries:
+            patch.save()
+
+        self.assertTagQueries(queries, 0)
+        self.assertTagsEqual(self.patch, 5, 0, 0)
+
+    def test_patch_content_update(self):
+        """Rescan everything when a patch's content changes."""
+        self.create_tag_comment(self.patch, self.ACK)
+
+        patch = Patch.objects.get(pk=self.patch.pk)
+        patch.content += '\n' + self.create_tag(self.REVIEW)
+        patch.save()
+
+        self.assertTagsEqual(self.patch, 1, 1, 0)
 
-        # force project.tags to be queried outside of the assertNumQueries
-        patch.project.tags
+    def test_comment_add(self):
+        """Only scan the new comment when a comment is added."""
+        for _ in range(5):
+            self.create_tag_comment(self.patch, self.ACK)
+
+        comment = Comment(submission=self.patch,
+                          submitter=self.patch.submitter,
+                          msgid=make_msgid(),
+                          content=self.create_tag(self.ACK))
+
+        with CaptureQueriesContext(connection) as queries:
+            comment.save()
+
+        # update the count, then read back the counts for the patch
+        self.assertTagQueries(queries, 2)
+        self.assertTagsEqual(self.patch, 6, 0, 0)
+
+    def test_retag(self):
+        """Fix counts that have become out of sync."""
+        self.create_tag_comment(self.patch, self.ACK)
+        PatchTag.objects.all().delete()
+
+        self.patch.refresh_tag_counts()
+
+        self.assertTagsEqual(self.patch, 1, 0, 0)
 
-        # we should be able to do this with two queries: one for
-        # the patch table lookup, and the prefetch_related for the
-        # projects table.
-        with self.assertNumQueries(2):
-            patch = Patch.objects.with_tag_counts(project=patch.project) \
-                .get(pk=patch.pk)
+
+class PatchTagCountsTest(PatchTagsTest):
+
+    def assertTagsEqual(self, patch, acks, reviews, tests):  # noqa
+        tags = {tag.name: tag.id for tag in Tag.objects.all()}
+
+        # the counts should be loaded along with the patch itself
+        with self.assertNumQueries(1):
+            patch = Patch.objects.get(pk=patch.pk)
 
             counts = (
-                getattr(patch, tagattrs['Acked-by']),
-                getattr(patch, tagattrs['Reviewed-by']),
-                getattr(patch, tagattrs['Tested-by']),
+                patch.tag_counts.get(tags['Acked-by'], 0),
+                patch.tag_counts.get(tags['Reviewed-by'], 0),
+                patch.tag_counts.get(tags['Tested-by'], 0),
             )
 
         self.assertEqual(counts, (acks, reviews, tests))
+
+    def test_stale_patch_save(self):
+        """Saving a stale copy of a patch doesn't overwrite its counts."""
+        patch = Patch.objects.get(pk=self.patch.pk)
+        self.create_tag_comment(self.patch, self.ACK)
+
+        patch.archived = True
+        patch.save()
+
+        self.assertTagsEqual(self.patch, 1, 0, 0)
+
+    def test_modified_counts_save(self):
+        """Counts modified on the patch itself are saved."""
+        tag = Tag.objects.get(name='Acked-by')
+        patch = Patch.objects.get(pk=self.patch.pk)
+
+        patch.tag_counts[tag.id] = 2
+        patch.save()
+
+        self.assertTagsEqual(self.patch, 2, 0, 0)
+
+    def test_refresh(self):
+        self.create_tag_comment(self.patch, self.ACK)
+        Patch.objects.filter(pk=self.patch.pk).update(tag_counts={})
+
+        Patch.objects.refresh_tag_counts([self.patch.pk])
+
+        self.assertTagsEqual(self.patch, 1, 0, 0)
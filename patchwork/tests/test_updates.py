@@ -3,9 +3,12 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from patchwork.models import Event
 from patchwork.models import Patch
 from patchwork.models import State
 from patchwork.tests.utils import create_patches
@@ -88,6 +91,25 @@ class MultipleUpdateTest(TestCase):
         for patch in [Patch.objects.get(pk=p.pk) for p in self.patches]:
             self.assertEqual(patch.state, state)
 
+    def test_state_change_events(self):
+        """Ensure the events are inserted together, in order."""
+        state = create_state()
+
+        with CaptureQueriesContext(connection) as queries:
+            self._test_state_change(state.pk)
+
+        inserts = [query for query in queries
+                   if query['sql'].startswith('INSERT') and
+                   'patchwork_event' in query['sql']]
+        self.assertEqual(1, len(inserts))
+
+        events = Event.objects.filter(
+            category=Event.CATEGORY_PATCH_STATE_CHANGED).order_by('id')
+        self.assertEqual([p.id for p in self.patches],
+                         [e.patch_id for e in events])
+        for event in events:
+            self.assertEqual(state, event.current_state)
+
     def test_state_change_invalid(self):
         state = max(State.objects.all().values_list('id', flat=True)) + 1
         orig_states = [patch.state for patch in self.patches]
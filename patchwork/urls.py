@@ -235,9 +235,16 @@ if settings.ENABLE_REST_API:
             name='api-cover-comment-list'),
     ]
 
+    api_1_2_patterns = [
+        url(r'^events/stream/$',
+            api_event_views.EventStream.as_view(),
+            name='api-event-stream'),
+    ]
+
     urlpatterns += [
-        url(r'^api/(?:(?P<version>(1.0|1.1))/)?', include(api_patterns)),
-        url(r'^api/(?:(?P<version>1.1)/)?', include(api_1_1_patterns)),
+        url(r'^api/(?:(?P<version>(1.0|1.1|1.2))/)?', include(api_patterns)),
+        url(r'^api/(?:(?P<version>(1.1|1.2))/)?', include(api_1_1_patterns)),
+        url(r'^api/(?:(?P<version>1.2)/)?', include(api_1_2_patterns)),
 
         # token change
         url(r'^user/generate-token/$', user_views.generate_token,
@@ -4,8 +4,8 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 from django.contrib import messages
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from django.db.models import Prefetch
 
 from patchwork.filters import Filters
 from patchwork.forms import MultiplePatchForm
@@ -13,8 +13,8 @@ from patchwork.models import Bundle
 from patchwork.models import BundlePatch
 from patchwork.models import Patch
 from patchwork.models import Project
-from patchwork.models import Check
 from patchwork.paginator import Paginator
+from patchwork.signals import defer_events
 
 
 bundle_actions = ['create', 'add', 'remove']
@@ -259,29 +259,23 @@ def generic_list(request, project, view, view_args=None, filter_settings=None,
     if patches is None:
         patches = Patch.objects.filter(patch_project=project)
 
-    # annotate with tag counts
-    patches = patches.with_tag_counts(project)
+    # we need the project's tags to display tag counts. Using
+    # prefetch_related means we'll share the one instance of Project, and
+    # share the project.tags cache between all patch.project references.
+    patches = patches.prefetch_related('project')
 
     patches = context['filters'].apply(patches)
     if not editable_order:
         patches = order.apply(patches)
 
-    # we don't need the content, diff or headers for a list; they're text
-    # fields that can potentially contain a lot of data
-    patches = patches.defer('content', 'diff', 'headers')
-
     # but we will need to follow the state and submitter relations for
     # rendering the list template
     patches = patches.select_related('state', 'submitter', 'delegate',
                                      'series')
 
     patches = patches.only('state', 'submitter', 'delegate', 'project',
-                           'series__name', 'name', 'date')
-
-    # we also need checks and series
-    patches = patches.prefetch_related(
-        Prefetch('check_set', queryset=Check.objects.only(
-            'context', 'user_id', 'patch_id', 'state', 'date')))
+                           'series__name', 'name', 'date', 'tag_counts',
+                           'check_summary')
 
     paginator = Paginator(request, patches)
 
@@ -306,14 +300,16 @@ def process_multiplepatch_form(request, form, action, patches, context):
         return errors
 
     changed_patches = 0
-    for patch in patches:
-        if not patch.is_editable(request.user):
-            errors.append("You don't have permissions to edit patch '%s'"
-                          % patch.name)
-            continue
-
-        changed_patches += 1
-        form.save(patch)
+    # the events raised by each change are inserted together at the end
+    with transaction.atomic(), defer_events():
+        for patch in patches:
+            if not patch.is_editable(request.user):
+                errors.append("You don't have permissions to edit patch '%s'"
+                              % patch.name)
+                continue
+
+            changed_patches += 1
+            form.save(patch)
 
     if changed_patches == 1:
         messages.success(request, '1 patch updated')
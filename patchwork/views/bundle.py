@@ -5,7 +5,6 @@
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
 from django.http import HttpResponseRedirect
 from django.http import HttpResponseNotFound
 from django.shortcuts import get_object_or_404
@@ -20,6 +19,7 @@ from patchwork.models import BundlePatch
 from patchwork.models import Project
 from patchwork.views import generic_list
 from patchwork.views.utils import bundle_to_mbox
+from patchwork.views.utils import download_response
 
 if settings.ENABLE_REST_API:
     from rest_framework.authentication import SessionAuthentication
@@ -144,10 +144,10 @@ def bundle_mbox(request, username, bundlename):
     if not (request.user == bundle.owner or bundle.public):
         return HttpResponseNotFound()
 
-    response = HttpResponse(content_type='text/plain')
+    response = download_response(request, bundle_to_mbox(bundle),
+                                 streaming=True, content_type='text/plain')
     response['Content-Disposition'] = \
         'attachment; filename=bundle-%d-%s.mbox' % (bundle.id, bundle.name)
-    response.write(bundle_to_mbox(bundle))
 
     return response
 
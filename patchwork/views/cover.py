@@ -18,7 +18,8 @@ from patchwork.views.utils import cover_to_mbox
 def cover_detail(request, cover_id):
     # redirect to patches where necessary
     try:
-        cover = get_object_or_404(CoverLetter, id=cover_id)
+        cover = get_object_or_404(CoverLetter.objects.select_related('body'),
+                                  id=cover_id)
     except Http404 as exc:
         submissions = Submission.objects.filter(id=cover_id)
         if submissions:
@@ -41,7 +42,8 @@ def cover_detail(request, cover_id):
 
 
 def cover_mbox(request, cover_id):
-    cover = get_object_or_404(CoverLetter, id=cover_id)
+    cover = get_object_or_404(CoverLetter.objects.select_related('body'),
+                              id=cover_id)
 
     response = HttpResponse(content_type='text/plain')
     response.write(cover_to_mbox(cover))
@@ -5,7 +5,6 @@
 
 from django.contrib import messages
 from django.http import Http404
-from django.http import HttpResponse
 from django.http import HttpResponseForbidden
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
@@ -19,7 +18,8 @@ from patchwork.models import Patch
 from patchwork.models import Project
 from patchwork.models import Submission
 from patchwork.views import generic_list
-from patchwork.views.utils import patch_to_mbox
+from patchwork.views.utils import download_response
+from patchwork.views.utils import PatchDownload
 from patchwork.views.utils import series_patch_to_mbox
 
 
@@ -37,7 +37,8 @@ def patch_list(request, project_id):
 def patch_detail(request, patch_id):
     # redirect to cover letters where necessary
     try:
-        patch = get_object_or_404(Patch, id=patch_id)
+        patch = get_object_or_404(Patch.objects.select_related('body'),
+                                  id=patch_id)
     except Http404 as exc:
         submissions = Submission.objects.filter(id=patch_id)
         if submissions:
@@ -115,10 +116,12 @@ def patch_detail(request, patch_id):
 
 
 def patch_raw(request, patch_id):
+    # the diff is read from the cache where possible
     patch = get_object_or_404(Patch, id=patch_id)
 
-    response = HttpResponse(content_type="text/x-patch")
-    response.write(patch.diff)
+    response = download_response(
+        request, PatchDownload('diff', [patch.id]),
+        content_type='text/x-patch')
     response['Content-Disposition'] = 'attachment; filename=%s.diff' % (
         patch.filename)
 
@@ -126,19 +129,23 @@ def patch_raw(request, patch_id):
 
 
 def patch_mbox(request, patch_id):
+    # the mbox file is read from the cache where possible
     patch = get_object_or_404(Patch, id=patch_id)
     series_id = request.GET.get('series')
 
-    response = HttpResponse(content_type='text/plain')
     if series_id:
         if not patch.series:
             raise Http404('Patch does not have an associated series. This is '
                           'because the patch was processed with an older '
                           'version of Patchwork. It is not possible to '
                           'provide dependencies for this patch.')
-        response.write(series_patch_to_mbox(patch, series_id))
+        response = download_response(
+            request, series_patch_to_mbox(patch, series_id), streaming=True,
+            content_type='text/plain')
     else:
-        response.write(patch_to_mbox(patch))
+        response = download_response(
+            request, PatchDownload('mbox', [patch.id]),
+            content_type='text/plain')
     response['Content-Disposition'] = 'attachment; filename=%s.patch' % (
         patch.filename)
 
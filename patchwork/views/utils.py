@@ -4,6 +4,7 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from collections import defaultdict
 import datetime
 from email.encoders import encode_7or8bit
 from email.header import Header
@@ -13,9 +14,15 @@ import email.utils
 import re
 
 from django.conf import settings
+from django.db.models import Q
 from django.http import Http404
+from django.http import HttpResponse
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.utils import six
 
+from patchwork import downloads
 from patchwork.models import Comment
 from patchwork.models import Patch
 
@@ -33,13 +40,15 @@ class PatchMbox(MIMENonMultipart):
         encode_7or8bit(self)
 
 
-def _submission_to_mbox(submission):
+def _submission_to_mbox(submission, patch_responses=None):
     """Get an mbox representation of a single Submission.
 
     Handles both Patch and CoverLetter objects.
 
     Arguments:
         submission: The Patch object to convert.
+        patch_responses: The tags found in comments on the submission, if
+            already known. If not provided, they are looked up.
 
     Returns:
         A string for the mbox file.
@@ -61,8 +70,11 @@ def _submission_to_mbox(submission):
         postscript = ''
 
     # TODO(stephenfin): Make this use the tags infrastructure
-    for comment in Comment.objects.filter(submission=submission):
-        body += comment.patch_responses
+    if patch_responses is None:
+        patch_responses = ''.join(
+            comment.patch_responses for comment in
+            Comment.objects.filter(submission=submission).only('content'))
+    body += patch_responses
 
     if postscript:
         body += '---\n' + postscript + '\n'
@@ -110,6 +122,118 @@ patch_to_mbox = _submission_to_mbox
 cover_to_mbox = _submission_to_mbox
 
 
+def _get_patch_responses(patches):
+    """Get the tags found in comments on each of the given patches.
+
+    Arguments:
+        patches: A queryset of the Patch objects to look up.
+
+    Returns:
+        A dict mapping the ID of each patch with comments to its tags.
+    """
+    responses = defaultdict(str)
+
+    comments = Comment.objects.filter(
+        submission__in=patches.order_by().values('id')).only(
+        'submission', 'content')
+    for comment in comments.iterator():
+        responses[comment.submission_id] += comment.patch_responses
+
+    return responses
+
+
+def _render_mboxes(patch_ids):
+    """Render the given patches as mbox files.
+
+    A fixed number of queries is made, however many patches there are.
+    """
+    patches = Patch.objects.filter(id__in=patch_ids)
+    responses = _get_patch_responses(patches)
+
+    return {
+        patch.id: patch_to_mbox(patch, responses[patch.id])
+        for patch in patches.select_related('submitter', 'delegate', 'body')
+    }
+
+
+def _render_diffs(patch_ids):
+    """Get the diffs of the given patches."""
+    return {
+        patch_id: diff or '' for patch_id, diff in
+        Patch.objects.filter(id__in=patch_ids).values_list('id', 'body__diff')
+    }
+
+
+class PatchDownload(object):
+    """A file containing one or more patches, for download.
+
+    If caching is enabled, the file for each patch is cached, and is only
+    rendered if it isn't found in the cache. The file is generated in
+    chunks of patches as it's iterated over, so that it can be streamed
+    without holding the whole file in memory.
+
+    Arguments:
+        kind: The kind of file, either 'mbox' or 'diff'.
+        patch_ids: The IDs of the patches to include, in order. Patches
+            which don't exist are skipped.
+    """
+
+    chunk_size = 100
+
+    _renderers = {
+        'mbox': _render_mboxes,
+        'diff': _render_diffs,
+    }
+
+    def __init__(self, kind, patch_ids):
+        self.kind = kind
+        self.patch_ids = patch_ids
+        self.versions = downloads.get_versions(patch_ids)
+
+    @property
+    def etag(self):
+        return downloads.get_etag(self.kind, self.patch_ids, self.versions)
+
+    @property
+    def last_modified(self):
+        return downloads.get_last_modified(self.versions)
+
+    def _get_files(self, patch_ids):
+        if not downloads.is_enabled():
+            return self._renderers[self.kind](patch_ids)
+
+        versions = {x: self.versions[x] for x in patch_ids}
+
+        files = downloads.get_files(self.kind, versions)
+
+        missing = [x for x in patch_ids if x not in files]
+        if missing:
+            rendered = self._renderers[self.kind](missing)
+            downloads.set_files(self.kind, versions, rendered)
+            files.update(rendered)
+
+        return files
+
+    def __iter__(self):
+        first = True
+        for start in range(0, len(self.patch_ids), self.chunk_size):
+            chunk = self.patch_ids[start:start + self.chunk_size]
+            files = self._get_files(chunk)
+
+            for patch_id in chunk:
+                if patch_id not in files:
+                    continue
+
+                if not first:
+                    yield '\n'
+                yield files[patch_id]
+                first = False
+
+    def render(self):
+        """Generate the whole file."""
+        return ''.join(self)
+
+
 def bundle_to_mbox(bundle):
     """Get an mbox representation of a bundle.
 
@@ -117,9 +241,10 @@ def bundle_to_mbox(bundle):
         patch: The Bundle object to convert.
 
     Returns:
-        A string for the mbox file.
+        A PatchDownload for the mbox file.
     """
-    return '\n'.join([patch_to_mbox(p) for p in bundle.ordered_patches()])
+    return PatchDownload('mbox', list(
+        bundle.ordered_patches().values_list('id', flat=True)))
 
 
 def series_patch_to_mbox(patch, series_id):
@@ -131,7 +256,7 @@ def series_patch_to_mbox(patch, series_id):
             '*' if using the latest series.
 
     Returns:
-        A string for the mbox file.
+        A PatchDownload for the mbox file.
     """
     if series_id != '*':
         try:
@@ -143,16 +268,12 @@ def series_patch_to_mbox(patch, series_id):
         if patch.series.id != series_id:
             raise Http404('Patch does not belong to series %d' % series_id)
 
-    mbox = []
-
     # get the series-ified patch
-    for dep in patch.series.patches.filter(
-            number__lt=patch.number).order_by('number'):
-        mbox.append(patch_to_mbox(dep))
+    patches = Patch.objects.filter(
+        Q(series=patch.series, number__lt=patch.number) | Q(id=patch.id))
 
-    mbox.append(patch_to_mbox(patch))
-
-    return '\n'.join(mbox)
+    return PatchDownload('mbox', list(
+        patches.order_by('number').values_list('id', flat=True)))
 
 
 def series_to_mbox(series):
@@ -162,14 +283,45 @@ def series_to_mbox(series):
         series: The Series object to convert.
 
     Returns:
-        A string for the mbox file.
+        A PatchDownload for the mbox file.
     """
-    mbox = []
+    return PatchDownload('mbox', list(
+        series.patches.order_by('number').values_list('id', flat=True)))
+
 
-    for dep in series.patches.all().order_by('number'):
-        mbox.append(patch_to_mbox(dep.patch))
+def download_response(request, download, streaming=False, **kwargs):
+    """Get a response serving a download.
 
-    return '\n'.join(mbox)
+    If the client already has the current version of the file, as shown by
+    the conditional request headers, a 304 response is returned instead.
+
+    Arguments:
+        request: The request for the download.
+        download: The PatchDownload to serve.
+        streaming: Whether to stream the file rather than generating it
+            before responding.
+        kwargs: Any other arguments for the response.
+
+    Returns:
+        The response.
+    """
+    etag = download.etag
+    last_modified = download.last_modified
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if streaming:
+            response = StreamingHttpResponse(download, **kwargs)
+        else:
+            response = HttpResponse(download.render(), **kwargs)
+
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+    return response
 
 
 def regenerate_token(user):
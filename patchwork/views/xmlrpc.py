@@ -26,7 +26,7 @@ from patchwork.models import Patch
 from patchwork.models import Person
 from patchwork.models import Project
 from patchwork.models import State
-from patchwork.views.utils import patch_to_mbox
+from patchwork.views.utils import PatchDownload
 
 
 class PatchworkXMLRPCDispatcher(SimpleXMLRPCDispatcher,
@@ -566,11 +566,6 @@ def patch_list(filt=None):
 
     patches = Patch.objects.filter(**dfilter)
 
-    # Only extract the relevant fields. This saves a big db load as we
-    # no longer fetch content/headers/etc for potentially every patch
-    # in a project.
-    patches = patches.defer('content', 'headers', 'diff')
-
     return _get_objects(patch_to_dict, patches, max_count)
 
 
@@ -652,8 +647,8 @@ def patch_get_mbox(patch_id):
         else an empty string.
     """
     try:
-        patch = Patch.objects.get(id=patch_id)
-        return patch_to_mbox(patch)
+        patch = Patch.objects.only('id').get(id=patch_id)
+        return PatchDownload('mbox', [patch.id]).render()
     except Patch.DoesNotExist:
         return ''
 
@@ -673,8 +668,8 @@ def patch_get_diff(patch_id):
         else an empty string.
     """
     try:
-        patch = Patch.objects.get(id=patch_id)
-        return patch.diff
+        patch = Patch.objects.only('id').get(id=patch_id)
+        return PatchDownload('diff', [patch.id]).render()
     except Patch.DoesNotExist:
         return ''
 
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Benchmark matching of filenames against delegation rules.
+
+Compares the cost of finding the delegate for each file of a patch
+using the compiled rule matcher with calling 'fnmatch' for each rule,
+for a synthetic, MAINTAINERS-like set of rules. No database is needed.
+
+Usage:
+
+    DJANGO_SETTINGS_MODULE=patchwork.settings.dev \\
+        python tools/benchmarks/delegation.py --rules 500 --files 200
+"""
+
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import django  # noqa
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa
+
+from patchwork.models import DelegationRule  # noqa
+from patchwork.parser import _DelegationRuleMatcher  # noqa
+
+
+def create_rules(count):
+    """Create rules like those found in a MAINTAINERS file."""
+    rules = []
+    for i in range(count):
+        user = User(username='user%d' % i)
+        if i % 3 == 0:
+            path = 'drivers/subsys%d/*' % i
+        elif i % 3 == 1:
+            path = 'include/linux/header%d.h' % i
+        else:
+            path = 'arch/*/mach-%d/*.c' % i
+        rules.append(DelegationRule(path=path, user=user, priority=i % 5))
+
+    rules.sort(key=lambda rule: (-rule.priority, rule.path))
+    return rules
+
+
+def create_filenames(rules, count):
+    """Create filenames, each matching one of the given rules."""
+    filenames = []
+    for i in range(count):
+        path = random.choice(rules).path
+        filenames.append(path.replace('*', 'x%d' % i, 1).replace('*', 'y'))
+    return filenames
+
+
+def match_fnmatch(rules, filenames):
+    for filename in filenames:
+        for rule in rules:
+            if fnmatch.fnmatch(filename, rule.path):
+                break
+
+
+def match_compiled(matcher, filenames):
+    for filename in filenames:
+        matcher.match(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, default=500,
+                        help='number of delegation rules')
+    parser.add_argument('--files', type=int, default=200,
+                        help='number of files in the patch')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times to repeat each benchmark')
+    args = parser.parse_args()
+
+    random.seed(0)
+    rules = create_rules(args.rules)
+    filenames = create_filenames(rules, args.files)
+
+    print('%d rules, %d files' % (args.rules, args.files))
+
+    # the matcher is cached for each project, so compiling it is a one-off
+    # cost and is measured separately
+    matcher = _DelegationRuleMatcher(rules)
+
+    benchmarks = (
+        ('fnmatch', lambda: match_fnmatch(rules, filenames)),
+        ('compile', lambda: _DelegationRuleMatcher(rules)),
+        ('compiled', lambda: match_compiled(matcher, filenames)),
+    )
+    for name, func in benchmarks:
+        best = min(timeit.repeat(func, repeat=args.repeat, number=1))
+        print('  %-10s %10.3f ms' % (name, best * 1000))
+
+    # sanity check: both must pick the same delegate for every file
+    for filename in filenames:
+        expected = next((rule.user for rule in rules
+                         if fnmatch.fnmatch(filename, rule.path)), None)
+        assert matcher.match(filename) is expected, filename
+
+
+if __name__ == '__main__':
+    main()
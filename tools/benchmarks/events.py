@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Benchmark the event list API.
+
+Creates a project containing series of patches, along with checks, state
+changes and delegations, and so events of every category. Pages of
+``MAX_REST_RESULTS_PER_PAGE`` events are then requested from the REST API,
+both with every related object embedded and using sparse events. For each
+variant, the number of database queries per page and the number of events
+served per second are reported. Results can be stored as JSON and compared
+with a previous run to spot regressions.
+
+Events are stored using the configured database, inside a transaction which
+is rolled back once the benchmark completes.
+
+Usage:
+
+    DJANGO_SETTINGS_MODULE=patchwork.settings.dev \\
+        python tools/benchmarks/events.py --output results.json
+
+    DJANGO_SETTINGS_MODULE=patchwork.settings.dev \\
+        python tools/benchmarks/events.py --compare results.json
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import datetime
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import django  # noqa
+
+django.setup()
+
+from django.conf import settings  # noqa
+from django.db import connection  # noqa
+from django.db import reset_queries  # noqa
+from django.db import transaction  # noqa
+from django.test import Client  # noqa
+from django.test.utils import CaptureQueriesContext  # noqa
+from django.urls import reverse  # noqa
+
+import patchwork  # noqa
+from patchwork.models import Event  # noqa
+from patchwork.tests.utils import create_check  # noqa
+from patchwork.tests.utils import create_cover  # noqa
+from patchwork.tests.utils import create_maintainer  # noqa
+from patchwork.tests.utils import create_patch  # noqa
+from patchwork.tests.utils import create_project  # noqa
+from patchwork.tests.utils import create_series  # noqa
+from patchwork.tests.utils import create_state  # noqa
+
+VARIANTS = OrderedDict([
+    ('full', {}),
+    ('ids', {'expand': ''}),
+    ('minimal', {'expand': '', 'fields': 'id,category,payload'}),
+])
+
+
+class _Rollback(Exception):
+    pass
+
+
+def create_events(series_count, series_length):
+    """Create series of patches, generating events of every category."""
+    project = create_project()
+    user = create_maintainer(project=project)
+    state = create_state()
+
+    for _ in range(series_count):
+        series = create_series(project=project)
+        create_cover(project=project, series=series)
+        for _ in range(series_length):
+            patch = create_patch(project=project, series=series)
+            create_check(patch=patch)
+            patch.delegate = user
+            patch.state = state
+            patch.save()
+
+
+def benchmark_variant(client, params, requests):
+    """Request pages of events, counting database queries."""
+    url = reverse('api-event-list', kwargs={'version': '1.2'})
+    params = dict(params, per_page=settings.MAX_REST_RESULTS_PER_PAGE)
+
+    events = 0
+    elapsed = 0.0
+    # creating the events can fill the query log, which would prevent any
+    # more queries being counted
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(requests):
+            start = timeit.default_timer()
+            resp = client.get(url, params)
+            elapsed += timeit.default_timer() - start
+
+            if resp.status_code != 200:
+                raise Exception('Unexpected response: %d' % resp.status_code)
+            events += len(json.loads(resp.content.decode('utf-8')))
+
+    return OrderedDict([
+        ('events_per_page', float(events) / requests),
+        ('queries_per_page', float(len(queries)) / requests),
+        ('events_per_second', events / elapsed if elapsed else 0),
+    ])
+
+
+def benchmark(series_count, series_length, requests, repeat):
+    """Benchmark each variant, returning the best of 'repeat' runs."""
+    results = OrderedDict()
+    client = Client(SERVER_NAME='localhost')
+
+    try:
+        with transaction.atomic():
+            create_events(series_count, series_length)
+            results['events'] = Event.objects.count()
+            results['variants'] = OrderedDict()
+
+            for name, params in VARIANTS.items():
+                best = None
+                for _ in range(repeat):
+                    result = benchmark_variant(client, params, requests)
+                    if best is None or (result['events_per_second'] >
+                                        best['events_per_second']):
+                        best = result
+                results['variants'][name] = best
+
+            raise _Rollback()
+    except _Rollback:
+        pass
+
+    return results
+
+
+def print_results(results, previous=None):
+    print('%d events, %d per page' % (
+        results['events'], settings.MAX_REST_RESULTS_PER_PAGE))
+
+    for name, result in results['variants'].items():
+        line = '  %-10s %6.1f queries/page %10.1f events/s' % (
+            name, result['queries_per_page'], result['events_per_second'])
+
+        old = (previous or {}).get('variants', {}).get(name)
+        if old and old['events_per_second']:
+            line += '  (%+.1f%%)' % (
+                (result['events_per_second'] / old['events_per_second'] - 1) *
+                100)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times to repeat each benchmark')
+    parser.add_argument('--requests', type=int, default=10,
+                        help='number of pages to request in each benchmark')
+    parser.add_argument('--series', type=int, default=20,
+                        help='number of series to create')
+    parser.add_argument('--series-length', type=int, default=10,
+                        help='number of patches in each series')
+    parser.add_argument('--output',
+                        help='file to store the results in, as JSON')
+    parser.add_argument('--compare',
+                        help='file containing the results of a previous run '
+                        'to compare with')
+    args = parser.parse_args()
+
+    results = OrderedDict([
+        ('version', patchwork.__version__),
+        ('python', platform.python_version()),
+        ('django', django.get_version()),
+        ('database', connection.vendor),
+        ('date', datetime.datetime.utcnow().isoformat()),
+    ])
+    results.update(benchmark(args.series, args.series_length, args.requests,
+                             args.repeat))
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
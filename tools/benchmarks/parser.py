@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+#
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Benchmark the mail parser.
+
+Replays the mails used by the parser tests, along with synthetic mails
+containing a large series and a huge diff, through the parser. For each
+set of mails, the time spent in each stage of parsing, the number of
+database queries per mail and the number of mails parsed per second are
+reported. Results can be stored as JSON and compared with a previous run
+to spot regressions.
+
+Mails are stored in a new project using the configured database, inside
+a transaction which is rolled back once the benchmark completes.
+
+Usage:
+
+    DJANGO_SETTINGS_MODULE=patchwork.settings.dev \\
+        python tools/benchmarks/parser.py --output results.json
+
+    DJANGO_SETTINGS_MODULE=patchwork.settings.dev \\
+        python tools/benchmarks/parser.py --compare results.json
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import datetime
+from email.mime.text import MIMEText
+from email.utils import formatdate
+import glob
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import django  # noqa
+
+django.setup()
+
+from django.db import connection  # noqa
+from django.db import transaction  # noqa
+from django.test.utils import CaptureQueriesContext  # noqa
+
+import patchwork  # noqa
+from patchwork.hasher import hash_diff  # noqa
+from patchwork.mbox import open_archive  # noqa
+from patchwork.models import Project  # noqa
+from patchwork.models import State  # noqa
+from patchwork.parser import _find_content  # noqa
+from patchwork.parser import clean_subject  # noqa
+from patchwork.parser import DuplicateMailError  # noqa
+from patchwork.parser import find_patch_content  # noqa
+from patchwork.parser import parse_mail  # noqa
+from patchwork.parser import parse_patch  # noqa
+from patchwork.tests import TEST_FUZZ_DIR  # noqa
+from patchwork.tests import TEST_MAIL_DIR  # noqa
+from patchwork.tests import TEST_SERIES_DIR  # noqa
+
+LIST_ID = 'benchmark.patchwork.invalid'
+SAVEPOINT_SQL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class _Rollback(Exception):
+    pass
+
+
+def read_corpus(path):
+    """Read every mail found in the mbox files in the given directory."""
+    mails = []
+    for filename in sorted(glob.glob(os.path.join(path, '*.mbox'))):
+        with open_archive(filename) as archive:
+            mails.extend(archive.messages())
+    return mails
+
+
+def create_mail(subject, content, msgid, in_reply_to=None):
+    mail = MIMEText(content, _charset='utf-8')
+    mail['Subject'] = subject
+    mail['From'] = 'Benchmark User <benchmark@example.com>'
+    mail['Date'] = formatdate(0)
+    mail['Message-Id'] = msgid
+    if in_reply_to:
+        mail['In-Reply-To'] = in_reply_to
+        mail['References'] = in_reply_to
+    return mail
+
+
+def create_diff(files, lines):
+    """Create a diff changing the given number of lines in each file."""
+    diff = []
+    for i in range(files):
+        diff.append('diff --git a/dir%d/file%d.c b/dir%d/file%d.c\n'
+                    '--- a/dir%d/file%d.c\n'
+                    '+++ b/dir%d/file%d.c\n' % ((i // 10, i) * 4))
+        diff.append('@@ -1,%d +1,%d @@\n' % (lines, lines))
+        for j in range(lines // 2):
+            diff.append('-old line %d\n+new line %d\n' % (j, j))
+    return ''.join(diff)
+
+
+def create_large_series(length):
+    """Create a cover letter and series of patches."""
+    cover_msgid = '<benchmark-series-0@example.com>'
+    mails = [create_mail('[PATCH 0/%d] Large series' % length,
+                         'A large series.\n', cover_msgid)]
+    for i in range(1, length + 1):
+        content = 'Patch %d.\n\n---\n%s' % (i, create_diff(2, 20))
+        mails.append(create_mail(
+            '[PATCH %d/%d] Patch %d' % (i, length, i), content,
+            '<benchmark-series-%d@example.com>' % i, cover_msgid))
+    return mails
+
+
+def create_huge_diff(files, lines):
+    """Create a single patch with a huge diff."""
+    content = 'A huge diff.\n\n---\n%s' % create_diff(files, lines)
+    return [create_mail('[PATCH] Huge diff', content,
+                        '<benchmark-diff@example.com>')]
+
+
+def _time(func, *args):
+    start = timeit.default_timer()
+    result = func(*args)
+    return timeit.default_timer() - start, result
+
+
+def benchmark_stages(mails):
+    """Time the parsing stages that don't need a database."""
+    stages = OrderedDict((stage, 0.0) for stage in (
+        'clean_subject', 'parse_patch', 'hash_diff'))
+
+    for mail in mails:
+        elapsed, _ = _time(clean_subject, mail.get('Subject', ''))
+        stages['clean_subject'] += elapsed
+
+        for payload, subtype in _find_content(mail):
+            if subtype == 'plain':
+                elapsed, _ = _time(parse_patch, payload)
+                stages['parse_patch'] += elapsed
+
+        diff, _ = find_patch_content(mail)
+        if diff:
+            elapsed, _ = _time(hash_diff, diff)
+            stages['hash_diff'] += elapsed
+
+    return stages
+
+
+def benchmark_parse_mail(mails):
+    """Time parsing and storing of mails, counting database queries."""
+    elapsed = 0.0
+    duplicates = 0
+    errors = 0
+
+    try:
+        with transaction.atomic():
+            Project.objects.create(linkname='benchmark', name='Benchmark',
+                                   listid=LIST_ID,
+                                   listemail='benchmark@example.com')
+            if not State.objects.filter(ordering=0).exists():
+                State.objects.create(name='New', ordering=0)
+
+            with CaptureQueriesContext(connection) as queries:
+                for mail in mails:
+                    start = timeit.default_timer()
+                    try:
+                        # a savepoint allows us to carry on after errors
+                        with transaction.atomic():
+                            parse_mail(mail, LIST_ID)
+                    except DuplicateMailError:
+                        # many of the test mails share a message ID
+                        duplicates += 1
+                    except Exception:
+                        errors += 1
+                    elapsed += timeit.default_timer() - start
+
+            # don't count the savepoints we created
+            query_count = len([
+                query for query in queries
+                if not query['sql'].startswith(SAVEPOINT_SQL)])
+
+            raise _Rollback()
+    except _Rollback:
+        pass
+
+    return elapsed, query_count, duplicates, errors
+
+
+def benchmark(mails, repeat):
+    """Benchmark a set of mails, returning the best of 'repeat' runs."""
+    best = None
+    for _ in range(repeat):
+        stages = benchmark_stages(mails)
+        elapsed, queries, duplicates, errors = benchmark_parse_mail(mails)
+        stages['parse_mail'] = elapsed
+
+        if best is None or elapsed < best['stages']['parse_mail']:
+            best = OrderedDict([
+                ('mails', len(mails)),
+                ('duplicates', duplicates),
+                ('errors', errors),
+                ('stages', stages),
+                ('queries_per_mail',
+                 float(queries) / len(mails) if mails else 0),
+                ('mails_per_second', len(mails) / elapsed if elapsed else 0),
+            ])
+
+    return best
+
+
+def print_results(results, previous=None):
+    for name, result in results['corpora'].items():
+        print('%s: %d mails (%d duplicates, %d errors), %.1f queries/mail, '
+              '%.1f mails/s' % (
+                  name, result['mails'], result['duplicates'],
+                  result['errors'], result['queries_per_mail'],
+                  result['mails_per_second']))
+
+        old = (previous or {}).get('corpora', {}).get(name)
+        for stage, elapsed in result['stages'].items():
+            line = '  %-15s %10.3f ms' % (stage, elapsed * 1000)
+            if old and old['stages'].get(stage):
+                line += '  (%+.1f%%)' % (
+                    (elapsed / old['stages'][stage] - 1) * 100)
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times to repeat each benchmark')
+    parser.add_argument('--series-length', type=int, default=100,
+                        help='number of patches in the large series')
+    parser.add_argument('--diff-files', type=int, default=200,
+                        help='number of files changed by the huge diff')
+    parser.add_argument('--diff-lines', type=int, default=200,
+                        help='number of lines changed in each file of the '
+                        'huge diff')
+    parser.add_argument('--output',
+                        help='file to store the results in, as JSON')
+    parser.add_argument('--compare',
+                        help='file containing the results of a previous run '
+                        'to compare with')
+    args = parser.parse_args()
+
+    corpora = OrderedDict([
+        ('mail', read_corpus(TEST_MAIL_DIR)),
+        ('series', read_corpus(TEST_SERIES_DIR)),
+        ('fuzz', read_corpus(TEST_FUZZ_DIR)),
+        ('large-series', create_large_series(args.series_length)),
+        ('huge-diff', create_huge_diff(args.diff_files, args.diff_lines)),
+    ])
+
+    results = OrderedDict([
+        ('version', patchwork.__version__),
+        ('python', platform.python_version()),
+        ('django', django.get_version()),
+        ('database', connection.vendor),
+        ('date', datetime.datetime.utcnow().isoformat()),
+        ('corpora', OrderedDict()),
+    ])
+    for name, mails in corpora.items():
+        results['corpora'][name] = benchmark(mails, args.repeat)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+#
+# Patchwork - automated patch tracking system
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Benchmark the storage of submission content.
+
+Parses the mails used by the parser tests, or those in the given mbox
+files, and stores them both with and without the ``COMPRESS_CONTENT``
+setting enabled. For each variant, the space used to store the headers,
+content and diffs of the resulting submissions and comments is reported,
+along with the time taken to load the patches back. Results can be stored
+as JSON and compared with a previous run to spot regressions.
+
+Real archives give the most representative results, for example:
+
+    DJANGO_SETTINGS_MODULE=patchwork.settings.dev \\
+        python tools/benchmarks/storage.py --output results.json \\
+        linux-kernel-2019-01.mbox
+
+Mails are stored in a new project using the configured database, inside
+a transaction which is rolled back once each variant completes.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import datetime
+import glob
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import django  # noqa
+
+django.setup()
+
+from django.db import connection  # noqa
+from django.db import transaction  # noqa
+from django.db.models import Sum  # noqa
+from django.db.models.functions import Length  # noqa
+from django.test import override_settings  # noqa
+
+import patchwork  # noqa
+from patchwork.mbox import open_archive  # noqa
+from patchwork.models import Comment  # noqa
+from patchwork.models import Patch  # noqa
+from patchwork.models import Project  # noqa
+from patchwork.models import State  # noqa
+from patchwork.models import SubmissionBody  # noqa
+from patchwork.parser import parse_mail  # noqa
+from patchwork.tests import TEST_MAIL_DIR  # noqa
+from patchwork.tests import TEST_SERIES_DIR  # noqa
+
+LIST_ID = 'benchmark.patchwork.invalid'
+
+VARIANTS = OrderedDict([
+    ('plain', False),
+    ('compressed', True),
+])
+
+FIELDS = OrderedDict([
+    ('headers', (SubmissionBody, 'headers')),
+    ('content', (SubmissionBody, 'content')),
+    ('diff', (SubmissionBody, 'diff')),
+    ('comment_headers', (Comment, 'headers')),
+    ('comment_content', (Comment, 'content')),
+])
+
+
+class _Rollback(Exception):
+    pass
+
+
+def read_corpus(paths):
+    """Read every mail found in the given mbox files."""
+    mails = []
+    for path in paths:
+        with open_archive(path) as archive:
+            mails.extend(archive.messages())
+    return mails
+
+
+def get_sizes(project):
+    """Get the space used to store each field of the project's mails.
+
+    Lengths are calculated by the database, so are those of the values as
+    stored rather than as read.
+    """
+    sizes = OrderedDict()
+    for name, (model, field) in FIELDS.items():
+        objects = model.objects.filter(submission__project=project)
+        sizes[name] = objects.aggregate(size=Sum(Length(field)))['size'] or 0
+    return sizes
+
+
+def benchmark_variant(mails, compress, repeat):
+    """Store the mails, then measure their size and how long they take to
+    load."""
+    result = OrderedDict()
+
+    try:
+        with transaction.atomic(), override_settings(
+                COMPRESS_CONTENT=compress):
+            project = Project.objects.create(
+                linkname='benchmark', name='Benchmark', listid=LIST_ID,
+                listemail='benchmark@example.com')
+            if not State.objects.filter(ordering=0).exists():
+                State.objects.create(name='New', ordering=0)
+
+            start = timeit.default_timer()
+            for mail in mails:
+                try:
+                    # a savepoint allows us to carry on after errors, such
+                    # as the duplicate message IDs of the test mails
+                    with transaction.atomic():
+                        parse_mail(mail, LIST_ID)
+                except Exception:
+                    pass
+            result['store_seconds'] = timeit.default_timer() - start
+
+            result['patches'] = Patch.objects.filter(project=project).count()
+            result['sizes'] = get_sizes(project)
+            result['total_size'] = sum(result['sizes'].values())
+
+            best = None
+            for _ in range(repeat):
+                start = timeit.default_timer()
+                for patch in Patch.objects.filter(
+                        project=project).select_related('body'):
+                    patch.diff
+                elapsed = timeit.default_timer() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            result['load_seconds'] = best
+
+            raise _Rollback()
+    except _Rollback:
+        pass
+
+    return result
+
+
+def benchmark(mails, repeat):
+    results = OrderedDict()
+    for name, compress in VARIANTS.items():
+        results[name] = benchmark_variant(mails, compress, repeat)
+    return results
+
+
+def _change(new, old):
+    if not old:
+        return ''
+    return '  (%+.1f%%)' % ((float(new) / old - 1) * 100)
+
+
+def print_results(results, previous=None):
+    plain = results['variants']['plain']
+    print('%d mails, %d patches' % (results['mails'], plain['patches']))
+
+    for name, result in results['variants'].items():
+        old = (previous or {}).get('variants', {}).get(name, {})
+        patches = result['patches'] or 1
+
+        print('  %s:' % name)
+        for field, size in result['sizes'].items():
+            print('    %-16s %12d bytes %6.1f%%' % (
+                field, size,
+                100.0 * size / plain['sizes'][field]
+                if plain['sizes'][field] else 0))
+        print('    %-16s %12d bytes%s' % (
+            'total', result['total_size'],
+            _change(result['total_size'], old.get('total_size'))))
+        print('    %-16s %12.1f us/patch%s' % (
+            'store', result['store_seconds'] * 1000000 / patches,
+            _change(result['store_seconds'], old.get('store_seconds'))))
+        print('    %-16s %12.1f us/patch%s' % (
+            'load', result['load_seconds'] * 1000000 / patches,
+            _change(result['load_seconds'], old.get('load_seconds'))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('mboxes', nargs='*',
+                        help='mbox files to read mails from. Defaults to '
+                        'those used by the parser tests')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of times to repeat loading the patches')
+    parser.add_argument('--output',
+                        help='file to store the results in, as JSON')
+    parser.add_argument('--compare',
+                        help='file containing the results of a previous run '
+                        'to compare with')
+    args = parser.parse_args()
+
+    paths = args.mboxes or sorted(
+        glob.glob(os.path.join(TEST_SERIES_DIR, '*.mbox')) +
+        glob.glob(os.path.join(TEST_MAIL_DIR, '*.mbox')))
+    mails = read_corpus(paths)
+
+    results = OrderedDict([
+        ('version', patchwork.__version__),
+        ('python', platform.python_version()),
+        ('django', django.get_version()),
+        ('database', connection.vendor),
+        ('date', datetime.datetime.utcnow().isoformat()),
+        ('mails', len(mails)),
+    ])
+    results['variants'] = benchmark(mails, args.repeat)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()